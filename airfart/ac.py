@@ -9,6 +9,8 @@ import smart_open
 from dotenv import load_dotenv
 from pendulum import DateTime
 
+from airfart.utils.ndjson import encode_records
+
 load_dotenv()
 
 
@@ -101,10 +103,7 @@ class ActiveCampaignBaseOperator(ABC):
 
         with smart_open.open(uri=uri, mode="wb") as s3_file:
             print("About to write response to {}".format(uri))
-            for record in records:
-                if not record:
-                    continue
-                s3_file.write((json.dumps(record) + "\n").encode())
+            s3_file.write(encode_records(records))
 
             print("Uploaded {} to S3".format(api_action))
 
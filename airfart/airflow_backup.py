@@ -1,4 +1,3 @@
-import json
 from typing import Optional
 
 from airflow import settings
@@ -6,6 +5,8 @@ from airflow.models import Variable, Connection
 from airflow.models.crypto import get_fernet
 from smart_open import open
 
+from airfart.utils.ndjson import dumps
+
 env = "Local"
 data_bucket = "my_bucket"
 fernet = get_fernet()
@@ -15,7 +16,7 @@ session = settings.Session()
 def _write_to_s3(uri: str, records) -> None:
     with open(uri=uri, mode="wb") as s3_file:
         if records:
-            s3_file.write((json.dumps(records)).encode())
+            s3_file.write(dumps(records))
 
 
 def _backup_variables(execution_date: str) -> None:
@@ -1,22 +1,68 @@
+import uuid
 from abc import ABC
 from contextlib import closing
-from typing import Optional
+from typing import Callable, Iterator, Optional
 
 import MySQLdb
+import MySQLdb.cursors
 import psycopg2
 
+from airfart.hooks.db.pool import get_pool
 from airfart.model.db import DB, DBType
+from airfart.utils.stage_stats import StageStats, measure
 
 
 class DBHook(ABC):
-    def __init__(self, db: Optional[DB] = None):
+    """
+    :param db: database connection details
+    :type db: DB
+    :param pooled: reuse physical connections through a process wide pool keyed
+        by the database (see pool_key()), instead of connecting on every call
+    :type pooled: bool
+    :param pool_max_size: maximum number of physical connections per pool
+    :type pool_max_size: int
+    :param pool_idle_timeout: seconds an idle pooled connection is kept open
+    :type pool_idle_timeout: int
+    :param stats: when provided, connect/execute/fetch/transform times are recorded in it
+    :type stats: StageStats
+    """
+
+    def __init__(
+        self,
+        db: Optional[DB] = None,
+        pooled: bool = False,
+        pool_max_size: int = 5,
+        pool_idle_timeout: int = 300,
+        stats: Optional[StageStats] = None,
+    ):
         self.db = db
+        self.pooled = pooled
+        self.pool_max_size = pool_max_size
+        self.pool_idle_timeout = pool_idle_timeout
+        self.stats = stats
 
     def get_conn(self):
         """
         create a database connection from scratch every call to get_conn()
         since MariaDB fails with error POSTGRESdb._exceptions.OperationalError: (2006, '')
-        on large queries
+        on large queries.
+        when pooled, a health-checked connection is checked out of the pool instead
+        and closing it returns it to the pool
+        """
+        with measure(self.stats, "connect"):
+            if self.pooled:
+                return get_pool(
+                    self.pool_key(),
+                    connect_fn=self.create_conn,
+                    ping_fn=self.ping,
+                    max_size=self.pool_max_size,
+                    idle_timeout=self.pool_idle_timeout,
+                ).get_conn()
+            return self.create_conn()
+
+    def create_conn(self):
+        """
+        create a new physical connection
         """
         conn_args = dict(
             dbname=self.db.schema,
@@ -26,8 +72,64 @@ class DBHook(ABC):
             port=self.db.port,
         )
         if self.db.db_type == DBType.MySQL:
-            return MySQLdb.connect(**conn_args)
-        return psycopg2.connect(**conn_args)
+            conn = MySQLdb.connect(**conn_args)
+        else:
+            conn = psycopg2.connect(**conn_args)
+        self.on_connect(conn)
+        return conn
+
+    def on_connect(self, conn) -> None:
+        """
+        initialize a new physical connection, i.e. set session variables.
+        called once per physical connection
+        """
+        pass
+
+    def pool_key(self) -> tuple:
+        """
+        connections are shared between hooks having the same pool key
+        """
+        return self.db.key()
+
+    def ping(self, conn) -> None:
+        """
+        raises if the connection is no longer usable
+        """
+        if self.db.db_type == DBType.MySQL:
+            conn.ping()
+        else:
+            with closing(conn.cursor()) as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+
+    def is_disconnect(self, err: Exception) -> bool:
+        """
+        whether `err` means the server closed the connection
+        """
+        if isinstance(err, MySQLdb.OperationalError):
+            # 2006: MySQL server has gone away, 2013: Lost connection to MySQL server
+            return bool(err.args) and err.args[0] in (2006, 2013)
+        return isinstance(err, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+    def run(self, fn: Callable):
+        """
+        call `fn` with a connection. when pooled and the pooled connection turns
+        out to be disconnected, it is discarded and `fn` is retried once
+        on a new connection
+        """
+        retries = 1 if self.pooled else 0
+        while True:
+            conn = self.get_conn()
+            try:
+                return fn(conn)
+            except Exception as err:
+                if retries > 0 and self.is_disconnect(err):
+                    retries -= 1
+                    conn.invalidate()
+                    continue
+                raise
+            finally:
+                conn.close()
 
     def get_pandas_df(self, sql, parameters=None, **kwargs):
         """
@@ -50,8 +152,73 @@ class DBHook(ABC):
                 "'apache-airflow-providers-common-sql[pandas]'."
             )
 
+        def read_sql(conn):
+            # read_sql executes, fetches and builds the dataframe in one go
+            with measure(self.stats, "fetch") as counters:
+                df = psql.read_sql(sql, con=conn, params=parameters, **kwargs)
+                counters.update(rows=len(df))
+                return df
+
+        return self.run(read_sql)
+
+    def get_server_side_cursor(self, conn, batch_size: int):
+        """
+        returns a cursor that keeps the result set on the server and
+        transfers it to the client while it is being fetched
+
+        :param conn: a connection created by get_conn()
+        :param batch_size: number of rows to transfer per round trip
+        """
+        if self.db.db_type == DBType.MySQL:
+            return conn.cursor(MySQLdb.cursors.SSCursor)
+        # psycopg2 named cursors are declared on the server
+        cur = conn.cursor(name=f"airfart_{uuid.uuid4().hex}")
+        cur.itersize = batch_size
+        return cur
+
+    def get_pandas_df_batches(
+        self, sql, parameters=None, batch_size: int = 10000
+    ) -> Iterator:
+        """
+        Executes the sql over a server-side cursor and yields the results
+        as pandas dataframes of at most `batch_size` rows each, so memory
+        is bounded by the batch size rather than by the result set
+
+        :param sql: the sql statement to be executed
+        :type sql: str
+        :param parameters: The parameters to render the SQL query with.
+        :type parameters: dict or iterable
+        :param batch_size: maximum number of rows per yielded dataframe
+        :type batch_size: int
+        """
+        try:
+            import pandas as pd
+        except ImportError:
+            raise Exception(
+                "pandas library not installed, run: pip install "
+                "'apache-airflow-providers-common-sql[pandas]'."
+            )
+
         with closing(self.get_conn()) as conn:
-            return psql.read_sql(sql, con=conn, params=parameters, **kwargs)
+            with closing(self.get_server_side_cursor(conn, batch_size)) as cur:
+                with measure(self.stats, "execute"):
+                    if parameters is not None:
+                        cur.execute(sql, parameters)
+                    else:
+                        cur.execute(sql)
+                columns = None
+                while True:
+                    with measure(self.stats, "fetch") as counters:
+                        rows = cur.fetchmany(batch_size)
+                        counters.update(rows=len(rows))
+                    if not rows:
+                        break
+                    # named (postgres) cursors only describe the result after the first fetch
+                    if columns is None:
+                        columns = [c[0] for c in cur.description]
+                    with measure(self.stats, "transform", rows=len(rows)):
+                        df = pd.DataFrame.from_records(rows, columns=columns)
+                    yield df
 
     def get_records(self, sql, parameters=None):
         """
@@ -63,10 +230,17 @@ class DBHook(ABC):
         :param parameters: The parameters to render the SQL query with.
         :type parameters: dict or iterable
         """
-        with closing(self.get_conn()) as conn:
+
+        def fetch_all(conn):
             with closing(conn.cursor()) as cur:
-                if parameters is not None:
-                    cur.execute(sql, parameters)
-                else:
-                    cur.execute(sql)
-                return cur.fetchall()
+                with measure(self.stats, "execute"):
+                    if parameters is not None:
+                        cur.execute(sql, parameters)
+                    else:
+                        cur.execute(sql)
+                with measure(self.stats, "fetch") as counters:
+                    rows = cur.fetchall()
+                    counters.update(rows=len(rows))
+                return rows
+
+        return self.run(fetch_all)
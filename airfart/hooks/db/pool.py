@@ -0,0 +1,176 @@
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional
+
+from airflow.utils.log.logging_mixin import LoggingMixin
+
+
+class PooledConnection(object):
+    """
+    Proxy of a DB-API connection checked out of a ConnectionPool.
+    close() returns the physical connection to the pool instead of closing it,
+    so existing `with closing(hook.get_conn())` blocks keep working.
+    """
+
+    def __init__(self, pool: "ConnectionPool", conn):
+        self._pool = pool
+        self._conn = conn
+        self._released = False
+        self.invalid = False
+
+    def __getattr__(self, item):
+        return getattr(self._conn, item)
+
+    def invalidate(self) -> None:
+        """mark the physical connection as broken, it is discarded on close()"""
+        self.invalid = True
+
+    def close(self) -> None:
+        if not self._released:
+            self._released = True
+            self._pool.release(self._conn, discard=self.invalid)
+
+
+class ConnectionPool(LoggingMixin):
+    """
+    A thread-safe pool of physical connections to a single database.
+
+    :param connect_fn: creates a new, fully initialized physical connection
+    :type connect_fn: Callable
+    :param ping_fn: raises if a connection is no longer usable
+    :type ping_fn: Callable
+    :param max_size: maximum number of physical connections (idle and in use)
+    :type max_size: int
+    :param idle_timeout: seconds an idle connection is kept before it is closed
+    :type idle_timeout: int
+    :param checkout_timeout: seconds to wait for a connection when the pool is exhausted
+    :type checkout_timeout: int
+    """
+
+    log = LoggingMixin.log
+
+    def __init__(
+        self,
+        connect_fn: Callable,
+        ping_fn: Callable,
+        max_size: int = 5,
+        idle_timeout: int = 300,
+        checkout_timeout: int = 60,
+    ):
+        super().__init__()
+        self.connect_fn = connect_fn
+        self.ping_fn = ping_fn
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        # (connection, released at) - most recently released last
+        self._idle: List[tuple] = []
+        self._size: int = 0
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def _close(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _pop_idle(self) -> Optional[object]:
+        now = time.monotonic()
+        while self._idle:
+            conn, released_at = self._idle.pop()
+            if now - released_at <= self.idle_timeout:
+                return conn
+            self._size -= 1
+            self._close(conn)
+        return None
+
+    def get_conn(self) -> PooledConnection:
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._cond:
+            while True:
+                conn = self._pop_idle()
+                if conn is not None or self._size < self.max_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    raise Exception(
+                        f"connection pool exhausted ({self.max_size} connections in use)"
+                    )
+            if conn is None:
+                # reserve a slot for a new physical connection
+                self._size += 1
+        if conn is not None:
+            try:
+                self.ping_fn(conn)
+                return PooledConnection(self, conn)
+            except Exception as err:
+                # i.e. MySQLdb OperationalError (2006, 'MySQL server has gone away')
+                self.log.info(f"discarding dead pooled connection: {err}")
+                self._close(conn)
+        try:
+            return PooledConnection(self, self.connect_fn())
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, discard: bool = False) -> None:
+        if not discard:
+            try:
+                # end any transaction left open (i.e. by a server-side cursor)
+                conn.rollback()
+            except Exception:
+                discard = True
+        if discard:
+            self._close(conn)
+        with self._cond:
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def grow(self, max_size: int) -> None:
+        """
+        raise max_size, i.e. for a caller running more concurrent queries
+        than the pool was created for. The pool never shrinks
+        """
+        with self._cond:
+            if max_size > self.max_size:
+                self.log.info(f"growing connection pool to {max_size} connections")
+                self.max_size = max_size
+                self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            for conn, _ in self._idle:
+                self._size -= 1
+                self._close(conn)
+            self._idle = []
+
+
+_pools: Dict[Hashable, ConnectionPool] = dict()
+_pools_lock = threading.Lock()
+
+
+def get_pool(key: Hashable, **kwargs) -> ConnectionPool:
+    """
+    get the process wide pool registered under `key`, creating it with `kwargs` if needed.
+    An existing pool is grown to the requested max_size, if larger
+    """
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(**kwargs)
+        elif "max_size" in kwargs:
+            _pools[key].grow(kwargs["max_size"])
+        return _pools[key]
+
+
+def close_pools() -> None:
+    """close all idle connections of all pools"""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
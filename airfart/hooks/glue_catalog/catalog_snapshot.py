@@ -0,0 +1,208 @@
+import datetime
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterable, List, Optional, Tuple
+
+from airflow.utils.log.logging_mixin import LoggingMixin
+
+from airfart.hooks.glue_catalog.glue_catalog import GlueCatalogHook
+
+_SCHEMA = [
+    "CREATE TABLE snapshot (built_at TEXT, region TEXT)",
+    "CREATE TABLE tables ("
+    " database_name TEXT, table_name TEXT, location TEXT, table_type TEXT,"
+    " classification TEXT, update_time TEXT, version_id TEXT, partition_keys TEXT,"
+    " PRIMARY KEY (database_name, table_name))",
+    "CREATE TABLE columns ("
+    " database_name TEXT, table_name TEXT, column_name TEXT, column_type TEXT,"
+    " is_partition_key INTEGER)",
+    "CREATE INDEX tables_location ON tables (location)",
+    "CREATE INDEX tables_update_time ON tables (update_time)",
+    "CREATE INDEX columns_column_name ON columns (column_name)",
+]
+
+
+def _iso(value) -> Optional[str]:
+    # UTC, so update times compare as strings
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return value.isoformat()
+    return value
+
+
+class CatalogSnapshot(LoggingMixin):
+    """
+    A local SQLite snapshot of the Glue catalog - table locations, columns and
+    update times - indexed to answer audit questions offline in milliseconds, i.e.
+    which tables point under an S3 prefix, which tables have a column, or which
+    tables were not updated for 90 days.
+
+    Build it with CatalogSnapshot.build, open an existing one with CatalogSnapshot(path)
+
+    :param path: path of the SQLite file
+    :type path: str
+    """
+
+    log = LoggingMixin.log
+
+    def __init__(self, path: str):
+        super().__init__()
+        assert os.path.exists(path), f"no catalog snapshot at {path}"
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+
+    @classmethod
+    def build(
+        cls,
+        path: str,
+        databases: Optional[Iterable[str]] = None,
+        region: str = "us-west-2",
+        max_workers: int = 8,
+        hook: Optional[GlueCatalogHook] = None,
+    ) -> "CatalogSnapshot":
+        """
+        Crawl the catalog, one database per worker, into a new snapshot.
+        The snapshot replaces the file at `path` once complete
+
+        :param path: path of the SQLite file
+        :param databases: databases to crawl, all of them if not provided
+        :param region: AWS region of the catalog
+        :param max_workers: number of databases crawled concurrently
+        :param hook: hook to crawl with, a new one for the region if not provided
+        """
+        start = time.monotonic()
+        hook = hook or GlueCatalogHook(region=region)
+        databases = list(databases) if databases is not None else hook.get_databases()
+        tmp_path = f"{path}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        db = sqlite3.connect(tmp_path)
+        for statement in _SCHEMA:
+            db.execute(statement)
+        db.execute(
+            "INSERT INTO snapshot VALUES (?, ?)",
+            (_iso(datetime.datetime.now(datetime.timezone.utc)), hook.region),
+        )
+        tables = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            crawls = {
+                executor.submit(lambda d: list(hook.iter_tables(d)), name): name
+                for name in databases
+            }
+            # sqlite is written from this thread only
+            for future in as_completed(crawls):
+                tables += cls._insert(db, crawls[future], future.result())
+        db.commit()
+        db.close()
+        os.replace(tmp_path, path)
+        snapshot = cls(path)
+        snapshot.log.info(
+            f"snapshot of {tables} tables from {len(databases)} databases "
+            f"written to {path} in {time.monotonic() - start:.1f}s"
+        )
+        return snapshot
+
+    @staticmethod
+    def _insert(db: sqlite3.Connection, database: str, tables: List[dict]) -> int:
+        table_rows, column_rows = [], []
+        for table in tables:
+            name = table["Name"]
+            descriptor = table.get("StorageDescriptor", {})
+            partition_keys = table.get("PartitionKeys", [])
+            table_rows.append(
+                (
+                    database,
+                    name,
+                    descriptor.get("Location"),
+                    table.get("TableType"),
+                    table.get("Parameters", {}).get("classification"),
+                    _iso(table.get("UpdateTime") or table.get("CreateTime")),
+                    table.get("VersionId"),
+                    json.dumps([k["Name"] for k in partition_keys]),
+                )
+            )
+            for is_partition_key, columns in (
+                (0, descriptor.get("Columns", [])),
+                (1, partition_keys),
+            ):
+                column_rows.extend(
+                    (database, name, c["Name"], c.get("Type"), is_partition_key)
+                    for c in columns
+                )
+        db.executemany("INSERT INTO tables VALUES (?, ?, ?, ?, ?, ?, ?, ?)", table_rows)
+        db.executemany("INSERT INTO columns VALUES (?, ?, ?, ?, ?)", column_rows)
+        return len(table_rows)
+
+    @property
+    def built_at(self) -> datetime.datetime:
+        (built_at,) = self._db.execute("SELECT built_at FROM snapshot").fetchone()
+        return datetime.datetime.fromisoformat(built_at)
+
+    def query(self, sql: str, parameters: tuple = ()) -> List[tuple]:
+        """
+        run any query against the snapshot (tables `tables` and `columns`)
+        """
+        return self._db.execute(sql, parameters).fetchall()
+
+    def table_location(self, database: str, table: str) -> Optional[str]:
+        row = self._db.execute(
+            "SELECT location FROM tables WHERE database_name = ? AND table_name = ?",
+            (database, table),
+        ).fetchone()
+        return row[0] if row else None
+
+    def tables_under_prefix(self, prefix: str) -> List[Tuple[str, str, str]]:
+        """
+        :param prefix: S3 prefix, i.e. s3://bucket/database/
+        :return: (database, table, location) of the tables located under the prefix
+        """
+        # a range rather than LIKE, so the location index is used
+        return self.query(
+            "SELECT database_name, table_name, location FROM tables"
+            " WHERE location >= ? AND location < ? ORDER BY location",
+            (prefix, prefix + "\U0010ffff"),
+        )
+
+    def tables_with_column(
+        self, column: str, database: Optional[str] = None
+    ) -> List[Tuple[str, str, str]]:
+        """
+        :return: (database, table, column type) of the tables having the column
+            (or partition key)
+        """
+        sql = (
+            "SELECT database_name, table_name, column_type FROM columns"
+            " WHERE column_name = ?"
+        )
+        parameters: tuple = (column,)
+        if database:
+            sql += " AND database_name = ?"
+            parameters += (database,)
+        return self.query(sql + " ORDER BY database_name, table_name", parameters)
+
+    def tables_not_updated_since(
+        self, since: datetime.datetime
+    ) -> List[Tuple[str, str, str]]:
+        """
+        :return: (database, table, update time) of the tables last updated before `since`
+        """
+        return self.query(
+            "SELECT database_name, table_name, update_time FROM tables"
+            " WHERE update_time < ? ORDER BY update_time",
+            (_iso(since),),
+        )
+
+    def stale_tables(self, days: int) -> List[Tuple[str, str, str]]:
+        """
+        tables not updated in the `days` days before the snapshot was built
+        """
+        return self.tables_not_updated_since(
+            self.built_at - datetime.timedelta(days=days)
+        )
+
+    def close(self) -> None:
+        self._db.close()
@@ -1,16 +1,41 @@
 import inspect
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
 
 import boto3
 from airflow.utils.log.logging_mixin import LoggingMixin
 
+from airfart.hooks.glue_catalog.schema_evolution import (
+    SchemaEvolutionPlanner,
+    plan_columns,
+)
+from airfart.hooks.glue_catalog.table_cache import (
+    CacheKey,
+    TableCache,
+    table_revision,
+)
+from airfart.hooks.glue_catalog.table_version_cleaner import TableVersionCleaner
 from airfart.model.table_definitions import TableDef
 from airfart.utils.chunk import chunk_fn
 
 
 class GlueCatalogHook(LoggingMixin):
-    def __init__(self, region: str = "us-west-2"):
+    """
+    :param region: AWS region of the catalog
+    :type region: str
+    :param cache: cache of the table definitions read through get_table (and the
+        methods built on it), shared between hooks. Tables updated or created
+        through the hook are invalidated
+    :type cache: TableCache
+    """
+
+    # batch size of the batch delete calls, and number of table versions kept
+    _chunk_size: int = 100
+    _partition_chunk_size: int = 25
+
+    def __init__(self, region: str = "us-west-2", cache: Optional[TableCache] = None):
         self.region = region
+        self.cache = cache
         session = boto3.session.Session(region_name=self.region)
         self._client = session.client("glue")
 
@@ -56,16 +81,135 @@ class GlueCatalogHook(LoggingMixin):
                 return None
             raise e
 
+    def get_table_pages(self, db: str, **kwargs) -> Iterator[List[dict]]:
+        """
+        Yields the full table objects of the database, one `get_tables` page at a time,
+        so callers needing more than the table names don't have to `get_table` each of them
+
+        :param db: Name of hive database (schema)
+        :param kwargs: additional `get_tables` arguments, i.e. Expression
+        :rtype: Iterator[List[dict]]
+        """
+        paginator = self.get_conn().get_paginator("get_tables")
+        try:
+            for page in paginator.paginate(DatabaseName=db, **kwargs):
+                yield page["TableList"]
+        except Exception as e:
+            if "EntityNotFoundException" in str(e):
+                return
+            raise e
+
+    def iter_tables(self, db: str, **kwargs) -> Iterator[dict]:
+        """
+        Yields the full table objects of the database, see get_table_pages
+        """
+        for page in self.get_table_pages(db, **kwargs):
+            yield from page
+
     def get_table(self, db: str, table: str) -> dict:
         """
-        Get the information of the table
+        Get the information of the table. With a cache, an entry older than its
+        ttl costs a full get_table, see warm_cache to revalidate a whole database
 
         :param db: Name of hive database (schema) @table belongs to
         :param table: Name of hive table
         :rtype: dict
         """
-        result = self.get_conn().get_table(DatabaseName=db, Name=table)
-        return result["Table"]
+        if self.cache is None:
+            return self.get_conn().get_table(DatabaseName=db, Name=table)["Table"]
+        key = self._cache_key(db, table)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        result = self.get_conn().get_table(DatabaseName=db, Name=table)["Table"]
+        self.cache.put(key, result)
+        return result
+
+    def _cache_key(self, db: str, table: str) -> CacheKey:
+        return self.region, db, table
+
+    def _invalidate(self, db: str, table: str) -> None:
+        if self.cache is not None:
+            self.cache.invalidate(self._cache_key(db, table))
+
+    def warm_cache(self, db: str) -> int:
+        """
+        Load all the tables of the database into the cache, one `get_tables`
+        page (up to 100 tables) per call. The cached tables whose UpdateTime and
+        VersionId are unchanged only get their age reset, so calling it every `ttl`
+        revalidates the database without a get_table per table
+
+        :param db: Name of hive database (schema)
+        :return: number of cached tables
+        """
+        assert self.cache is not None, "the hook has no cache"
+        cached, changed = 0, 0
+        for table in self.iter_tables(db):
+            key = self._cache_key(db, table["Name"])
+            if not self.cache.touch(key, table_revision(table)):
+                self.cache.put(key, table)
+                changed += 1
+            cached += 1
+        self.log.info(f"cached {cached} tables of {db}, {changed} new or changed")
+        return cached
+
+    def get_partitions(
+        self, db: str, table: str, total_segments: int = 4, **kwargs
+    ) -> List[dict]:
+        """
+        Get all the partitions of the table, reading `total_segments` segments
+        of the partition list concurrently
+
+        :param db: Name of hive database (schema) @table belongs to
+        :param table: Name of hive table
+        :param total_segments: number of segments read in parallel (1 to 10)
+        :param kwargs: additional `get_partitions` arguments, i.e. Expression
+        :rtype: List[dict]
+        """
+        assert 1 <= total_segments <= 10, "total_segments should be between 1 and 10"
+
+        def get_segment(segment: int) -> list:
+            return self._paginate(
+                "get_partitions",
+                "Partitions",
+                DatabaseName=db,
+                TableName=table,
+                Segment=dict(SegmentNumber=segment, TotalSegments=total_segments),
+                **kwargs,
+            )
+
+        with ThreadPoolExecutor(max_workers=total_segments) as executor:
+            segments = executor.map(get_segment, range(total_segments))
+            return [partition for segment in segments for partition in segment]
+
+    def batch_delete_partitions(
+        self, db: str, table: str, partition_values: List[List[str]]
+    ) -> int:
+        """
+        Drop the partitions in chunks of 25, the batch_delete_partition limit
+
+        :param db: Name of hive database (schema) @table belongs to
+        :param table: Name of hive table
+        :param partition_values: values of the partitions to drop
+        :return: number of partitions which could not be dropped
+        """
+        failed = 0
+        for chunk in chunk_fn(partition_values, self._partition_chunk_size):
+            response = self.get_conn().batch_delete_partition(
+                DatabaseName=db,
+                TableName=table,
+                PartitionsToDelete=[dict(Values=list(values)) for values in chunk],
+            )
+            for error in response.get("Errors", []):
+                self.log.warning(
+                    f"unable to drop partition {error.get('PartitionValues')} "
+                    f"of {db}.{table}: {error.get('ErrorDetail', {}).get('ErrorMessage')}"
+                )
+                failed += 1
+        self.log.info(
+            f"dropped {len(partition_values) - failed} partitions from table {db}.{table}"
+        )
+        return failed
 
     def get_table_versions(self, db: str, table: str) -> Optional[list]:
         try:
@@ -85,6 +229,8 @@ class GlueCatalogHook(LoggingMixin):
             self.get_conn().batch_delete_table(
                 DatabaseName=db, TablesToDelete=list(map(lambda x: str(x), chunk))
             )
+            for table in chunk:
+                self._invalidate(db, str(table))
         self.log.info(f"dropped {len(tables_to_remove)} tables from database {db}")
 
     def delete_table_versions(self, db: str, table: str) -> None:
@@ -106,19 +252,51 @@ class GlueCatalogHook(LoggingMixin):
                 f"dropped {len(versions_to_drop)} versions out of {len(versions)} from table {db}.{table}"
             )
 
-    def delete_all_table_versions(self, db: str) -> None:
-        # check if database exists first
-        if self.get_database(db):
-            # filter table starting with `tmp_` -> temporary process_engine tables
-            tables = list(
-                filter(lambda x: not str(x).startswith("tmp_"), self.get_tables(db))
-            )
-            for table in tables:
-                self.delete_table_versions(db, table)
+    def delete_all_table_versions(
+        self, db: str, max_workers: int = 8, dry_run: bool = False
+    ) -> dict:
+        """
+        Drop all but the latest versions of every table of the database,
+        concurrently across tables. Tables starting with `tmp_` are skipped
+
+        :param db: Name of hive database (schema)
+        :param max_workers: number of concurrent Glue calls
+        :param dry_run: only log the versions that would be dropped
+        :return: totals of the cleanup, see TableVersionCleaner
+        """
+        cleaner = TableVersionCleaner(
+            self.get_conn(),
+            keep_versions=self._chunk_size,
+            chunk_size=self._chunk_size,
+            max_workers=max_workers,
+            dry_run=dry_run,
+        )
+        return cleaner.clean([db])
+
+    def evolve_tables(
+        self, database: str, desired: Dict[str, List[dict]], **kwargs
+    ) -> dict:
+        """
+        Bring the columns of the tables of a database to their desired schema,
+        one update_table call per changed table, see SchemaEvolutionPlanner
+
+        :param desired: desired Glue columns by table name, i.e.
+            {table_def.name: columns_from_table_def(table_def)}
+        :param kwargs: allow_drops, allow_reorder, max_workers, retries, dry_run,
+            raise_on_failure
+        :return: report of the changes
+        """
+        return SchemaEvolutionPlanner(self, **kwargs).evolve(database, desired)
 
     def get_table_input(self, database: str, table: str) -> dict:
         # Meaning, requesting to generate a request object to update a Table on AWS Data Catalog
-        table_result = self.get_table(database, table)
+        return self.to_table_input(self.get_table(database, table))
+
+    @staticmethod
+    def to_table_input(table_result: dict) -> dict:
+        """
+        the update_table input of a table returned by get_table / get_tables
+        """
         table_name = table_result["Name"]
         table_input = dict(
             Name=table_name, StorageDescriptor=table_result["StorageDescriptor"]
@@ -138,13 +316,23 @@ class GlueCatalogHook(LoggingMixin):
 
     def glue_add_columns(self, database, table, columns):
         table_schema = self.get_table_input(database, table)
-        table_schema["StorageDescriptor"]["Columns"].extend(columns)
+        current = table_schema["StorageDescriptor"]["Columns"]
+        # only the names missing from the table are added, the columns already in
+        # it are kept as they are (neither added again nor widened)
+        existing = {c["Name"].lower() for c in current}
+        new_columns = [c for c in columns if c["Name"].lower() not in existing]
+        plan = plan_columns(current, current + new_columns, allow_reorder=False)
+        if not plan["add"]:
+            self.log.info(f"no new column to add to the table: {database}.{table}")
+            return
+        columns = [c for c in columns if c["Name"] in plan["add"]]
+        table_schema["StorageDescriptor"]["Columns"] = plan["columns"]
         self.log.info(
             "\n\ntable_schema['StorageDescriptor']['Columns']:\n"
             + str(table_schema["StorageDescriptor"]["Columns"])
         )
         try:
-            self.get_conn().update_table(DatabaseName=database, TableInput=table_schema)
+            self.update_table(database, table_schema)
             self.log.info(
                 "Columns: {cols} added to the table: {db}.{tbl}".format(
                     db=database, tbl=table, cols=columns
@@ -174,19 +362,19 @@ class GlueCatalogHook(LoggingMixin):
         result = self.get_conn().create_table(
             DatabaseName=database_name, TableInput=table_input
         )
+        self._invalidate(database_name, table_input["Name"])
         return result
 
     def update_table(self, database_name, table_input):
         result = self.get_conn().update_table(
             DatabaseName=database_name, TableInput=table_input
         )
+        self._invalidate(database_name, table_input["Name"])
         return result
 
     def get_table_def(self, database_name: str, table_name: str) -> Optional[TableDef]:
         try:
-            table_def = self.get_table(
-                database_name=database_name, table_name=table_name
-            )
+            table_def = self.get_table(database_name, table_name)
             return TableDef.from_glue(table_def)
         except Exception as err:
             if "EntityNotFoundException" in str(err):
@@ -0,0 +1,294 @@
+import copy
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional
+
+from airflow.utils.log.logging_mixin import LoggingMixin
+
+from airfart.model.table_definitions import TableDef
+from airfart.utils.rate_limiter import AdaptiveRateLimiter
+
+# integer and floating point types, each one readable as any wider one
+_INTEGERS = ["tinyint", "smallint", "int", "bigint"]
+_FLOATS = ["float", "double"]
+_STRINGS = ("char", "varchar", "string")
+
+_TYPE = re.compile(r"^(\w+)(?:\((\d+)(?:,(\d+))?\))?$")
+
+
+def normalize_type(glue_type: str) -> str:
+    """
+    i.e. `DECIMAL((12, 4))` (as written by TableDef.to_glue from a schema dump) is
+    `decimal(12,4)`, `integer` is `int`
+    """
+    normalized = re.sub(r"\s+", "", glue_type.lower())
+    normalized = normalized.replace("((", "(").replace("))", ")")
+    if normalized.startswith("integer"):
+        normalized = "int" + normalized[len("integer") :]
+    return normalized
+
+
+def is_widening(current: str, desired: str) -> bool:
+    """
+    whether data written as `current` can be read as `desired`, i.e.
+    int to bigint, float to double, decimal(10,2) to decimal(12,2), char(3) to string
+    """
+    current_match, desired_match = _TYPE.match(current), _TYPE.match(desired)
+    if not current_match or not desired_match:
+        # complex types (array<...>, struct<...>) are never widened
+        return False
+    current_type, desired_type = current_match.group(1), desired_match.group(1)
+    for family in (_INTEGERS, _FLOATS):
+        if current_type in family and desired_type in family:
+            return family.index(desired_type) > family.index(current_type)
+    if current_type == desired_type == "decimal":
+        precision, scale = (int(current_match.group(i) or 0) for i in (2, 3))
+        new_precision, new_scale = (int(desired_match.group(i) or 0) for i in (2, 3))
+        return new_scale >= scale and new_precision - new_scale >= precision - scale
+    if current_type in _STRINGS and desired_type in _STRINGS:
+        if desired_type == "string":
+            return True
+        if current_type == "string":
+            return False
+        return int(desired_match.group(2) or 0) >= int(current_match.group(2) or 0)
+    return False
+
+
+def columns_from_table_def(table_def: TableDef) -> List[dict]:
+    """
+    the Glue columns of a table definition, i.e. from a schema dump
+    """
+    return table_def.to_glue("")["StorageDescriptor"]["Columns"]
+
+
+def columns_from_schema_file(columns: Iterable[dict]) -> List[dict]:
+    """
+    the Glue columns of an S3 schema file,
+    as read by S3ListAndDeleteOperator.get_s3_file_schema_list_columns
+    """
+    ordered = sorted(columns, key=lambda c: c.get("row_num") or 0)
+    return [dict(Name=c["Name"], Type=c["Type"]) for c in ordered]
+
+
+def plan_columns(
+    current: List[dict],
+    desired: List[dict],
+    allow_drops: bool = False,
+    allow_reorder: bool = True,
+) -> dict:
+    """
+    Diff the columns of a Glue table against the desired ones, by name,
+    in a single pass over each list
+
+    :param current: Glue columns of the table ({"Name": ..., "Type": ...})
+    :param desired: desired Glue columns, in the desired order
+    :param allow_drops: drop the current columns missing from `desired`,
+        otherwise they are kept, after the desired columns
+    :param allow_reorder: order the columns as `desired`,
+        otherwise the current order is kept and new columns are appended
+    :return: the plan - the names of the added, widened and dropped columns, the
+        type changes that are not widenings (never applied, the current type is kept),
+        whether the columns were reordered, and the resulting `columns`
+    """
+    by_name = {c["Name"].lower(): c for c in current}
+    plan = dict(add=[], widen=[], drop=[], incompatible=[], reordered=False, columns=[])
+    # name -> column of the result, current attributes (i.e. Comment) are kept
+    resulting: Dict[str, dict] = dict()
+    desired_names = []
+    for column in desired:
+        name = column["Name"].lower()
+        desired_names.append(name)
+        existing = by_name.get(name)
+        if existing is None:
+            plan["add"].append(column["Name"])
+            resulting[name] = dict(column, Type=normalize_type(column["Type"]))
+            continue
+        current_type, desired_type = (
+            normalize_type(existing["Type"]),
+            normalize_type(column["Type"]),
+        )
+        resulting[name] = existing
+        if current_type == desired_type:
+            continue
+        if is_widening(current_type, desired_type):
+            plan["widen"].append(
+                dict(name=existing["Name"], type=existing["Type"], to=column["Type"])
+            )
+            resulting[name] = dict(existing, Type=desired_type)
+        else:
+            plan["incompatible"].append(
+                dict(name=existing["Name"], type=existing["Type"], to=column["Type"])
+            )
+    desired_set = set(desired_names)
+    extra = [name for name in by_name if name not in desired_set]
+    if allow_drops:
+        plan["drop"] = [by_name[name]["Name"] for name in extra]
+    else:
+        resulting.update((name, by_name[name]) for name in extra)
+
+    kept = [name for name in by_name if name in resulting]
+    if allow_reorder:
+        order = [n for n in desired_names if n in resulting] + [
+            n for n in extra if n in resulting
+        ]
+        # the columns present before keep their relative order, or were reordered
+        plan["reordered"] = [n for n in order if n in by_name] != kept
+    else:
+        order = kept + [n for n in desired_names if n not in by_name]
+    plan["columns"] = [resulting[name] for name in order]
+    return plan
+
+
+def has_changes(plan: dict) -> bool:
+    return bool(plan["add"] or plan["widen"] or plan["drop"] or plan["reordered"])
+
+
+class SchemaEvolutionPlanner(LoggingMixin):
+    """
+    Evolves the columns of many Glue tables of a database towards their desired
+    schemas in one pass: the current tables are read with paginated GetTables
+    calls, every table is diffed by column name (see plan_columns), and each
+    changed table gets a single update_table call. The updates run on a pool of
+    `max_workers` threads sharing an AdaptiveRateLimiter.
+
+    Partition keys are never changed, desired columns matching a partition key
+    are ignored.
+
+    :param hook: Glue catalog hook
+    :type hook: airfart.hooks.glue_catalog.glue_catalog.GlueCatalogHook
+    :param allow_drops: drop the columns missing from the desired schema
+    :type allow_drops: bool
+    :param allow_reorder: order the columns as in the desired schema
+    :type allow_reorder: bool
+    :param max_workers: number of concurrent update_table calls
+    :type max_workers: int
+    :param retries: attempts of a throttled update_table call
+    :type retries: int
+    :param dry_run: only plan and log the changes
+    :type dry_run: bool
+    :param rate_limiter: limiter shared with other Glue clients, if any
+    :type rate_limiter: AdaptiveRateLimiter
+    :param raise_on_failure: raise once every table was attempted if any update failed
+    :type raise_on_failure: bool
+    """
+
+    log = LoggingMixin.log
+
+    def __init__(
+        self,
+        hook,
+        allow_drops: bool = False,
+        allow_reorder: bool = True,
+        max_workers: int = 8,
+        retries: int = 8,
+        dry_run: bool = False,
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        raise_on_failure: bool = True,
+    ):
+        super().__init__()
+        self.hook = hook
+        self.allow_drops = allow_drops
+        self.allow_reorder = allow_reorder
+        self.max_workers = max_workers
+        self.retries = retries
+        self.dry_run = dry_run
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.raise_on_failure = raise_on_failure
+
+    def plan_table(self, table: dict, desired: List[dict]) -> dict:
+        """
+        :param table: current Glue table
+        :param desired: desired Glue columns
+        """
+        partition_keys = {k["Name"].lower() for k in table.get("PartitionKeys", [])}
+        desired = [c for c in desired if c["Name"].lower() not in partition_keys]
+        return plan_columns(
+            table["StorageDescriptor"]["Columns"],
+            desired,
+            allow_drops=self.allow_drops,
+            allow_reorder=self.allow_reorder,
+        )
+
+    def plan(self, database: str, desired: Dict[str, List[dict]]) -> Dict[str, dict]:
+        """
+        :param desired: desired Glue columns by table name,
+            see columns_from_table_def and columns_from_schema_file
+        :return: plan by table name, for the tables existing in Glue
+        """
+        plans = dict()
+        for table in self.hook.iter_tables(database):
+            if table["Name"] in desired:
+                plan = self.plan_table(table, desired[table["Name"]])
+                plan["table"] = table
+                plans[table["Name"]] = plan
+        return plans
+
+    def _update(self, database: str, table: dict, columns: List[dict]) -> None:
+        table_input = self.hook.to_table_input(copy.deepcopy(table))
+        table_input["StorageDescriptor"]["Columns"] = columns
+        self.rate_limiter.call(
+            self.hook.update_table, database, table_input, retries=self.retries
+        )
+
+    def evolve(self, database: str, desired: Dict[str, List[dict]]) -> dict:
+        """
+        plan and apply the changes of the tables of a database
+
+        :param desired: desired Glue columns by table name
+        :return: report - the changes by updated table, the unchanged tables count,
+            the tables missing from Glue, the incompatible type changes and the
+            failed updates. Raises if any update failed, unless `raise_on_failure`
+            is unset
+        """
+        start = time.monotonic()
+        plans = self.plan(database, desired)
+        report = dict(
+            updated=dict(),
+            unchanged=0,
+            missing=sorted(set(desired) - set(plans)),
+            incompatible=dict(),
+            failed=dict(),
+            dry_run=self.dry_run,
+        )
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = dict()
+            for name, plan in plans.items():
+                if plan["incompatible"]:
+                    report["incompatible"][name] = plan["incompatible"]
+                if not has_changes(plan):
+                    report["unchanged"] += 1
+                    continue
+                changes = {
+                    k: plan[k] for k in ("add", "widen", "drop", "reordered") if plan[k]
+                }
+                self.log.info(f"{database}.{name}: {changes}")
+                if self.dry_run:
+                    report["updated"][name] = changes
+                    continue
+                future = executor.submit(
+                    self._update, database, plan["table"], plan["columns"]
+                )
+                futures[future] = (name, changes)
+            for future in as_completed(futures):
+                name, changes = futures[future]
+                try:
+                    future.result()
+                    report["updated"][name] = changes
+                except Exception as err:
+                    report["failed"][name] = str(err)
+        report.update(
+            throttled=self.rate_limiter.throttled,
+            seconds=round(time.monotonic() - start, 3),
+        )
+        self.log.info(
+            f"evolved {len(desired)} tables of {database}: "
+            f"{len(report['updated'])} updated, {report['unchanged']} unchanged, "
+            f"{len(report['missing'])} missing, {len(report['failed'])} failed"
+        )
+        if report["failed"] and self.raise_on_failure:
+            raise Exception(
+                f"failed to update {len(report['failed'])} tables of {database}: "
+                f"{report['failed']}. report: {dict(report, failed=len(report['failed']))}"
+            )
+        return report
@@ -0,0 +1,197 @@
+import copy
+import datetime
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+# (region, database, table)
+CacheKey = Tuple[str, str, str]
+
+
+def _encode(o: Any) -> Any:
+    # Glue responses hold datetimes (CreateTime, UpdateTime, ...)
+    if isinstance(o, datetime.datetime):
+        return {"__datetime__": o.isoformat()}
+    raise TypeError(f"{type(o)} is not JSON serializable")
+
+
+def _decode(d: dict) -> Any:
+    if "__datetime__" in d:
+        return datetime.datetime.fromisoformat(d["__datetime__"])
+    return d
+
+
+def table_revision(table: dict) -> Tuple[str, str]:
+    """
+    what identifies a revision of a Glue table: its UpdateTime and VersionId
+    """
+    return str(table.get("UpdateTime", "")), str(table.get("VersionId", ""))
+
+
+class TableCache(object):
+    """
+    Cache of Glue table definitions keyed by (region, database, table),
+    held in process and optionally in a SQLite file shared between processes
+    (i.e. by the DAG files of a scheduler querying schemas at parse time).
+
+    Entries are served without any Glue call for `ttl` seconds. Afterwards, a get_table
+    of the hook fetches the full table again, one call per table (Glue has no cheaper
+    call telling whether a single table changed). GlueCatalogHook.warm_cache revalidates
+    a whole database instead, one get_tables page per 100 tables: the entries whose
+    UpdateTime and VersionId did not change only get their age reset (see touch),
+    the changed tables are stored again. Writes through the hook invalidate the entry.
+
+    :param ttl: seconds an entry is served without asking Glue
+    :type ttl: int
+    :param max_size: maximum number of entries, the least recently used are evicted
+    :type max_size: int
+    :param path: path of the SQLite file, if the entries should also be kept on disk
+    :type path: str
+    """
+
+    def __init__(
+        self, ttl: int = 300, max_size: int = 1024, path: Optional[str] = None
+    ):
+        assert max_size > 0, "max_size should be positive"
+        self.ttl = ttl
+        self.max_size = max_size
+        self.path = path
+        self.hits: int = 0
+        self.misses: int = 0
+        self._lock = threading.RLock()
+        # key -> (table, revision, cached_at), least recently used first
+        self._entries: OrderedDict = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS glue_tables ("
+                " region TEXT, database_name TEXT, table_name TEXT,"
+                " body TEXT, update_time TEXT, version_id TEXT, cached_at REAL,"
+                " PRIMARY KEY (region, database_name, table_name))"
+            )
+            self._db.commit()
+
+    def _is_fresh(self, cached_at: float) -> bool:
+        return time.time() - cached_at < self.ttl
+
+    def _load(self, key: CacheKey) -> Optional[tuple]:
+        row = self._db.execute(
+            "SELECT body, update_time, version_id, cached_at FROM glue_tables"
+            " WHERE region = ? AND database_name = ? AND table_name = ?",
+            key,
+        ).fetchone()
+        if row is None:
+            return None
+        body, update_time, version_id, cached_at = row
+        return (
+            json.loads(body, object_hook=_decode),
+            (update_time, version_id),
+            cached_at,
+        )
+
+    def _remember(self, key: CacheKey, entry: tuple) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get(self, key: CacheKey, stale: bool = False) -> Optional[dict]:
+        """
+        :param key: (region, database, table)
+        :param stale: also return entries older than the ttl
+        :return: a copy of the cached table, if any
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                entry = self._load(key)
+                if entry is not None:
+                    self._remember(key, entry)
+            if entry is None or not (stale or self._is_fresh(entry[2])):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            # callers (i.e. get_table_input) modify the returned table
+            return copy.deepcopy(entry[0])
+
+    def touch(self, key: CacheKey, revision: Tuple[str, str]) -> bool:
+        """
+        reset the age of the entry if it holds `revision` of the table
+
+        :param key: (region, database, table)
+        :param revision: current revision of the table, see table_revision
+        :return: whether the entry is current, otherwise the table should be put again
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                entry = self._load(key)
+            if entry is None or entry[1] != revision:
+                return False
+            now = time.time()
+            self._remember(key, (entry[0], entry[1], now))
+            if self._db is not None:
+                self._db.execute(
+                    "UPDATE glue_tables SET cached_at = ?"
+                    " WHERE region = ? AND database_name = ? AND table_name = ?",
+                    (now, *key),
+                )
+                self._db.commit()
+            return True
+
+    def put(self, key: CacheKey, table: dict) -> None:
+        revision = table_revision(table)
+        now = time.time()
+        with self._lock:
+            previous = self._entries.get(key)
+            self._remember(key, (copy.deepcopy(table), revision, now))
+            if self._db is None:
+                return
+            updated = 0
+            if previous is not None and previous[1] == revision:
+                # unchanged table, only reset the age of the entry
+                updated = self._db.execute(
+                    "UPDATE glue_tables SET cached_at = ?"
+                    " WHERE region = ? AND database_name = ? AND table_name = ?",
+                    (now, *key),
+                ).rowcount
+            if not updated:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO glue_tables VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (*key, json.dumps(table, default=_encode), *revision, now),
+                )
+                self._db.execute(
+                    "DELETE FROM glue_tables WHERE rowid NOT IN"
+                    " (SELECT rowid FROM glue_tables ORDER BY cached_at DESC LIMIT ?)",
+                    (self.max_size,),
+                )
+            self._db.commit()
+
+    def invalidate(self, key: CacheKey) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+            if self._db is not None:
+                self._db.execute(
+                    "DELETE FROM glue_tables"
+                    " WHERE region = ? AND database_name = ? AND table_name = ?",
+                    key,
+                )
+                self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM glue_tables")
+                self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
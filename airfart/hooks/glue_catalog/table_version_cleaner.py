@@ -0,0 +1,213 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from airflow.utils.log.logging_mixin import LoggingMixin
+
+from airfart.utils.chunk import chunk_fn
+from airfart.utils.rate_limiter import AdaptiveRateLimiter
+
+
+class TableVersionCleaner(LoggingMixin):
+    """
+    Drops the old versions of Glue tables, keeping the latest `keep_versions`
+    versions of every table. Tables starting with `tmp_` are skipped.
+
+    Listing the versions of a table and deleting them (in chunks of `chunk_size`
+    version ids) run concurrently across tables on a pool of `max_workers` threads.
+    All Glue calls go through a shared AdaptiveRateLimiter, backing off
+    on ThrottlingException and speeding up again as calls succeed
+
+    :param client: boto3 glue client
+    :param keep_versions: number of latest versions to keep per table
+    :type keep_versions: int
+    :param chunk_size: number of versions dropped per batch_delete_table_version call
+    :type chunk_size: int
+    :param max_workers: number of concurrent Glue calls
+    :type max_workers: int
+    :param dry_run: only log the versions that would be dropped
+    :type dry_run: bool
+    :param rate_limiter: limiter shared with other Glue clients, if any
+    :type rate_limiter: AdaptiveRateLimiter
+    :param progress_every: log the progress every this many processed tables
+    :type progress_every: int
+    """
+
+    log = LoggingMixin.log
+    skip_prefix: str = "tmp_"
+
+    def __init__(
+        self,
+        client,
+        keep_versions: int = 100,
+        chunk_size: int = 100,
+        max_workers: int = 8,
+        dry_run: bool = False,
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        progress_every: int = 100,
+    ):
+        super().__init__()
+        assert keep_versions >= 1, "the current version of a table can not be dropped"
+        # batch_delete_table_version accepts at most 100 version ids
+        assert 1 <= chunk_size <= 100, "chunk_size should be between 1 and 100"
+        self.client = client
+        self.keep_versions = keep_versions
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.dry_run = dry_run
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.progress_every = progress_every
+        self._lock = threading.Lock()
+        self._totals: Dict[str, int] = dict()
+
+    def _call(self, operation: str, **kwargs) -> dict:
+        return self.rate_limiter.call(getattr(self.client, operation), **kwargs)
+
+    def _paginate(self, operation: str, page_key: str, **kwargs) -> Iterator[dict]:
+        # paginated by hand, so every page request is rate limited and retried
+        token = None
+        while True:
+            page = self._call(
+                operation, **kwargs, **(dict(NextToken=token) if token else {})
+            )
+            yield from page[page_key]
+            token = page.get("NextToken")
+            if not token:
+                return
+
+    def _count(self, **counts) -> None:
+        with self._lock:
+            for key, value in counts.items():
+                self._totals[key] = self._totals.get(key, 0) + value
+
+    def database_exists(self, db: str) -> bool:
+        try:
+            self._call("get_database", Name=db)
+            return True
+        except Exception as e:
+            if "EntityNotFoundException" in str(e):
+                return False
+            raise e
+
+    def get_databases(self) -> List[str]:
+        return [d["Name"] for d in self._paginate("get_databases", "DatabaseList")]
+
+    def get_tables(self, db: str) -> List[str]:
+        return [
+            t["Name"]
+            for t in self._paginate("get_tables", "TableList", DatabaseName=db)
+        ]
+
+    def get_versions(self, db: str, table: str) -> List[int]:
+        return sorted(
+            int(v["VersionId"])
+            for v in self._paginate(
+                "get_table_versions",
+                "TableVersions",
+                DatabaseName=db,
+                TableName=table,
+            )
+        )
+
+    def versions_to_drop(self, versions: List[int]) -> List[int]:
+        """
+        :param versions: sorted version ids of a table
+        :return: the version ids to drop, all but the latest `keep_versions`
+        """
+        return versions[: -self.keep_versions] if versions else []
+
+    def delete_versions(self, db: str, table: str, versions: List[int]) -> None:
+        if self.dry_run:
+            self.log.info(f"skipping drop due to dryRun: {db}.{table} -> {versions}")
+            # counted as dropped, so a dry run reports what a real run would drop
+            self._count(versions_dropped=len(versions))
+            return
+        response = self._call(
+            "batch_delete_table_version",
+            DatabaseName=db,
+            TableName=table,
+            VersionIds=list(map(lambda x: str(x), versions)),
+        )
+        errors = response.get("Errors", [])
+        for error in errors:
+            self.log.warning(
+                f"unable to drop version {error.get('VersionId')} of {db}.{table}: "
+                f"{error.get('ErrorDetail', {}).get('ErrorMessage')}"
+            )
+        self._count(
+            versions_dropped=len(versions) - len(errors), versions_failed=len(errors)
+        )
+
+    def _list_tables(self, databases: Iterable[str]) -> Iterator[Tuple[str, str]]:
+        for db in databases:
+            # check if database exists first
+            if not self.database_exists(db):
+                self.log.warning(f"database {db} not found, skipping")
+                continue
+            self._count(databases=1)
+            for table in self.get_tables(db):
+                # temporary process_engine tables
+                if str(table).startswith(self.skip_prefix):
+                    self._count(tables_skipped=1)
+                    continue
+                yield db, table
+
+    def clean(self, databases: Optional[Iterable[str]] = None) -> dict:
+        """
+        drop the old table versions of the databases
+        :param databases: databases to clean, all of them if not provided
+        :return: totals of the cleanup
+        """
+        start = time.monotonic()
+        self._totals = dict()
+        databases = sorted(self.get_databases()) if databases is None else databases
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            listings: Dict[Future, Tuple[str, str]] = {
+                executor.submit(self.get_versions, db, table): (db, table)
+                for db, table in self._list_tables(databases)
+            }
+            deletes: Dict[Future, Tuple[str, str]] = dict()
+            for processed, future in enumerate(as_completed(listings), 1):
+                db, table = listings[future]
+                try:
+                    versions = future.result()
+                except Exception as err:
+                    self.log.error(
+                        f"unable to list the versions of {db}.{table}: {err}"
+                    )
+                    self._count(tables_failed=1)
+                    continue
+                to_drop = self.versions_to_drop(versions)
+                self._count(tables=1, versions=len(versions))
+                if to_drop:
+                    self.log.info(
+                        f"dropping {len(to_drop)} versions out of {len(versions)} "
+                        f"from table {db}.{table}"
+                    )
+                    self._count(tables_cleaned=1)
+                    for chunk in chunk_fn(to_drop, self.chunk_size):
+                        deletes[
+                            executor.submit(self.delete_versions, db, table, chunk)
+                        ] = (db, table)
+                if processed % self.progress_every == 0:
+                    self.log.info(
+                        f"listed {processed}/{len(listings)} tables, "
+                        f"{len(deletes)} delete calls queued, "
+                        f"rate {self.rate_limiter.rate:.1f} calls/s"
+                    )
+            for future in as_completed(deletes):
+                try:
+                    future.result()
+                except Exception as err:
+                    db, table = deletes[future]
+                    self.log.error(f"unable to drop versions of {db}.{table}: {err}")
+                    self._count(delete_calls_failed=1)
+        totals = dict(
+            self._totals,
+            dry_run=self.dry_run,
+            throttled=self.rate_limiter.throttled,
+            seconds=round(time.monotonic() - start, 3),
+        )
+        self.log.info(f"table version cleanup done: {totals}")
+        return totals
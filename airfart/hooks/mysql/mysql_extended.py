@@ -12,8 +12,12 @@ class MySqlExtendedHook(DBHook):
     __default_session_variables: dict = dict()
 
     def __init__(self, *args, **kwargs) -> None:
-        super().__init__()
-        if self.__session_variables not in kwargs:
+        super().__init__(
+            pooled=kwargs.get("pooled", False),
+            pool_max_size=kwargs.get("pool_max_size", 5),
+            pool_idle_timeout=kwargs.get("pool_idle_timeout", 300),
+        )
+        if not kwargs.get(self.__session_variables):
             setattr(self, self.__session_variables, self.__default_session_variables)
         else:
             setattr(
@@ -29,18 +33,21 @@ class MySqlExtendedHook(DBHook):
             os.getenv("MYSQL_HOST"),
         )
 
-    def get_conn(self):
+    def on_connect(self, conn) -> None:
         """
-        create a database connection from scratch every call to get_conn()
+        Apply session variables once per physical connection.
+        without pooling, a connection is created from scratch every call to get_conn()
         since MariaDB fails with error MySQLdb._exceptions.OperationalError: (2006, '')
         on large queries
         """
-        conn = super().get_conn()
-        # Apply session variables if needed
         session_variables = getattr(self, self.__session_variables)
         if session_variables:
             with closing(conn.cursor()) as cur:
                 for k, v in session_variables.items():
                     set_session = f"SET SESSION {k}={v}"
                     cur.execute(set_session)
-        return conn
+
+    def pool_key(self) -> tuple:
+        # connections initialized with different session variables are not shared
+        session_variables = getattr(self, self.__session_variables)
+        return super().pool_key() + tuple(sorted(session_variables.items()))
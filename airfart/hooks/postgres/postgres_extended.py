@@ -1,4 +1,5 @@
 import os
+from contextlib import closing
 
 from dotenv import load_dotenv
 
@@ -7,8 +8,10 @@ from airfart.model.db import DB, DBType
 
 
 class PostgresExtendedHook(DBHook):
-    def __init__(self) -> None:
-        super().__init__()
+    __copy_formats = ["csv", "text", "binary"]
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
         load_dotenv()
         self.db = DB(
             DBType.PostgreSQL,
@@ -18,3 +21,40 @@ class PostgresExtendedHook(DBHook):
             int(os.getenv("POSTGRES_PORT")),
             os.getenv("POSTGRES_HOST"),
         )
+
+    def copy_to_file(
+        self,
+        sql: str,
+        file_obj,
+        copy_format: str = "csv",
+        include_headers: bool = True,
+        size: int = 1024 * 1024,
+    ) -> int:
+        """
+        Executes the sql with `COPY (sql) TO STDOUT` and streams the raw
+        output bytes into `file_obj`, without building python objects per row
+
+        :param sql: the select statement to be executed
+        :type sql: str
+        :param file_obj: a writable (binary) file-like object, i.e. a smart_open S3 writer
+        :param copy_format: COPY output format, one of csv, text or binary
+        :type copy_format: str
+        :param include_headers: whether to write a header line (csv only)
+        :type include_headers: bool
+        :param size: size of the buffer used to read from the server
+        :type size: int
+        :return: number of rows copied
+        """
+        assert (
+            copy_format in self.__copy_formats
+        ), f"copy_format should be one of {self.__copy_formats}"
+        options = [f"FORMAT {copy_format}"]
+        if copy_format == "csv" and include_headers:
+            options.append("HEADER true")
+        # COPY does not accept a trailing semicolon inside the sub query
+        query = sql.strip().rstrip(";")
+        copy_sql = f"COPY ({query}) TO STDOUT WITH ({', '.join(options)})"
+        with closing(self.get_conn()) as conn:
+            with closing(conn.cursor()) as cur:
+                cur.copy_expert(copy_sql, file_obj, size=size)
+                return cur.rowcount
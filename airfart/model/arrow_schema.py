@@ -0,0 +1,101 @@
+import re
+from typing import Iterable, Optional
+
+from airfart.model.table_definitions import ColumnDef, TableDef
+
+# pyarrow is imported in the functions, as in the parquet sink, so the table
+# definitions do not require it
+
+# DECIMAL precision / scale, i.e. (10,2) from the schema dump or decimal(10,2) from Glue
+_ARGUMENTS = re.compile(r"\(\s*(\d+)\s*(?:,\s*(\d+)\s*)?\)")
+
+# MySQL DECIMAL defaults
+_DEFAULT_PRECISION = 10
+_DEFAULT_SCALE = 0
+
+
+def _decimal_type(data_type: str, data_length: Optional[str]):
+    import pyarrow as pa
+
+    match = _ARGUMENTS.search(data_length or "") or _ARGUMENTS.search(data_type)
+    precision, scale = _DEFAULT_PRECISION, _DEFAULT_SCALE
+    if match:
+        precision = int(match.group(1))
+        scale = int(match.group(2) or 0)
+    if precision > 38:
+        return pa.decimal256(precision, scale)
+    return pa.decimal128(precision, scale)
+
+
+def _arrow_types() -> dict:
+    import pyarrow as pa
+
+    string = pa.string()
+    return {
+        # numerics
+        "bigint": pa.int64(),
+        "int": pa.int32(),
+        "integer": pa.int32(),
+        "mediumint": pa.int32(),
+        "smallint": pa.int16(),
+        "tinyint": pa.int8(),
+        "double": pa.float64(),
+        "float": pa.float32(),
+        "boolean": pa.bool_(),
+        # dates. in microseconds, the precision of DATETIME(6) / TIMESTAMP(6):
+        # a coarser unit fails the conversion of any sub-millisecond value
+        "date": pa.date32(),
+        "timestamp": pa.timestamp("us"),
+        "datetime": pa.timestamp("us"),
+        "precision_datetime": pa.timestamp("us"),
+        "precision_timestamp": pa.timestamp("us"),
+        # characters
+        "char": string,
+        "varchar": string,
+        "string": string,
+        "text": string,
+        "tinytext": string,
+        "mediumtext": string,
+        "longtext": string,
+        "longblob": pa.binary(),
+        "binary": pa.binary(),
+        # specials, a handful of distinct values per column
+        "enum": pa.dictionary(pa.int32(), string),
+    }
+
+
+def to_arrow_type(column: ColumnDef):
+    """
+    the pyarrow type of a column, from its MySQL (or Glue) data type and length
+
+    :raises ValueError: for a data type with no pyarrow equivalent
+    """
+    # Glue types hold their arguments, i.e. decimal(10,2) or varchar(255)
+    data_type = column.data_type.lower().split("(")[0].strip()
+    if data_type == "decimal":
+        return _decimal_type(column.data_type, column.data_length)
+    arrow_type = _arrow_types().get(data_type)
+    if arrow_type is None:
+        raise ValueError(
+            f"no arrow type for column {column.name} of type {column.data_type}"
+        )
+    return arrow_type
+
+
+def to_arrow_schema(table: TableDef, exclude: Optional[Iterable[str]] = None):
+    """
+    The pyarrow schema of a table, its columns in ordinal position order.
+    Exports given this schema convert every batch straight to it, instead of
+    inferring the types of the first batch
+
+    :param table: table definition, i.e. from TableDef.from_query or TableDef.from_glue
+    :param exclude: columns left out of the schema, i.e. the partition columns
+    :return: pyarrow.Schema
+    """
+    import pyarrow as pa
+
+    exclude = set(exclude or [])
+    columns = sorted(table.columns or [], key=lambda c: c.ordinal_position)
+    return pa.schema(
+        [pa.field(c.name, to_arrow_type(c)) for c in columns if c.name not in exclude]
+    )
@@ -24,3 +24,13 @@ class DB:
         self.schema = schema
         self.port = port or 5432 if db_type == DBType.PostgreSQL else 3306
         self.host = host or "127.0.0.1"
+
+    def key(self) -> tuple:
+        return (
+            self.db_type,
+            self.login,
+            self.password,
+            self.schema,
+            self.port,
+            self.host,
+        )
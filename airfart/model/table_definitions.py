@@ -1,8 +1,9 @@
+import hashlib
 import json
+import sys
 from abc import ABC
-from typing import List, Any, Optional
-
-from airfart.utils.remove_empty_elements import remove_empty_elements
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional
 
 
 class DatabaseType(object):
@@ -75,19 +76,81 @@ class DataTypeConverter(ABC):
         return DataTypeConverter._mapping.get(data_type)
 
 
-class BaseColumnDef(object):
+# one read-only instance of every distinct type mapping, shared by all the columns
+_mappings: Dict[tuple, Mapping[str, str]] = dict()
+
+
+def intern_mapping(mapping: Optional[Mapping[str, str]]) -> Optional[Mapping[str, str]]:
+    if mapping is None:
+        return None
+    key = tuple(mapping.items())
+    interned = _mappings.get(key)
+    if interned is None:
+        # the same mapping in another key order is the same instance
+        normalized = tuple(sorted(key))
+        interned = _mappings.get(normalized)
+        if interned is None:
+            interned = _mappings.setdefault(
+                normalized, MappingProxyType(dict(normalized))
+            )
+        _mappings[key] = interned
+    return interned
+
+
+class _Immutable(object):
+    """
+    Base of the slotted, immutable definitions. Use replace() to get a modified copy
+    """
+
+    __slots__ = ()
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} is immutable, use replace()")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def _kwargs(self) -> dict:
+        raise NotImplementedError
+
+    def __reduce__(self):
+        return _rebuild, (self.__class__, self._kwargs())
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self._kwargs()})"
+
+    def replace(self, **changes):
+        return self.__class__(**dict(self._kwargs(), **changes))
+
+
+def _rebuild(cls, kwargs: dict):
+    return cls(**kwargs)
+
+
+class BaseColumnDef(_Immutable):
+    __slots__ = ("name", "ordinal_position")
+
     def __init__(self, name: str, ordinal_position: int):
-        self.name: str = name
-        self.ordinal_position: int = ordinal_position
+        object.__setattr__(self, "name", sys.intern(name))
+        object.__setattr__(self, "ordinal_position", ordinal_position)
+
+    def _kwargs(self) -> dict:
+        return dict(name=self.name, ordinal_position=self.ordinal_position)
+
+    def _key(self) -> tuple:
+        return self.name, self.ordinal_position
 
     def __eq__(self, other):
-        if isinstance(other, BaseColumnDef):
-            return (
-                self.name == other.name
-                and self.ordinal_position == other.ordinal_position
-            )
+        if other.__class__ is self.__class__:
+            return self._key() == other._key()
         return False
 
+    def __hash__(self):
+        return hash(self._key())
+
+    def to_dict(self) -> dict:
+        return self._kwargs()
+
     @classmethod
     def from_query(cls, data: dict):
         return cls.from_json(
@@ -103,29 +166,71 @@ class BaseColumnDef(object):
 
 
 class ColumnDef(BaseColumnDef):
+    __slots__ = ("data_type", "data_length", "mapping")
+
     def __init__(
         self,
         name: str,
         ordinal_position: int,
         data_type: str,
         data_length: str,
-        mapping: dict = None,
+        mapping: Mapping[str, str] = None,
     ):
-        super(ColumnDef, self).__init__(name, ordinal_position)
-        self.data_type: str = data_type
-        self.data_length: str = data_length
-        self.mapping = mapping if mapping else DataTypeConverter.get_mapping(data_type)
+        # not through BaseColumnDef.__init__, as columns are built by the thousands
+        setattr_ = object.__setattr__
+        setattr_(self, "name", sys.intern(name))
+        setattr_(self, "ordinal_position", ordinal_position)
+        setattr_(self, "data_type", sys.intern(data_type))
+        setattr_(self, "data_length", data_length)
+        setattr_(
+            self,
+            "mapping",
+            intern_mapping(
+                mapping if mapping else DataTypeConverter.get_mapping(data_type)
+            ),
+        )
+
+    def _kwargs(self) -> dict:
+        return dict(
+            name=self.name,
+            ordinal_position=self.ordinal_position,
+            data_type=self.data_type,
+            data_length=self.data_length,
+            mapping=self.mapping,
+        )
+
+    def _key(self) -> tuple:
+        # interned mappings are equal only if they are the same object
+        return (
+            self.name,
+            self.ordinal_position,
+            self.data_type,
+            self.data_length,
+            id(self.mapping),
+        )
 
     def __eq__(self, other):
-        if isinstance(other, ColumnDef):
-            return (
-                self.name == other.name
-                and self.ordinal_position == other.ordinal_position
-                and self.data_type == other.data_type
-                and self.data_length == other.data_length
-                and self.mapping == other.mapping
-            )
-        return False
+        # spelled out rather than comparing _key() tuples, it runs per column
+        return self is other or (
+            other.__class__ is self.__class__
+            and self.name == other.name
+            and self.ordinal_position == other.ordinal_position
+            and self.data_type == other.data_type
+            and self.data_length == other.data_length
+            and self.mapping is other.mapping
+        )
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def to_dict(self) -> dict:
+        d = self._kwargs()
+        d["mapping"] = dict(self.mapping) if self.mapping is not None else None
+        return d
+
+    def __reduce__(self):
+        # mapping proxies can not be pickled
+        return _rebuild, (self.__class__, self.to_dict())
 
     @classmethod
     def from_json(cls, data: dict):
@@ -143,7 +248,22 @@ class ColumnDef(BaseColumnDef):
         )
 
 
-class TableDef(object):
+class TableDef(_Immutable):
+    """
+    Slotted, immutable definition of a table. Its hash (and fingerprint) is computed
+    once, so comparing two definitions of an unchanged table is O(1)
+    """
+
+    __slots__ = (
+        "name",
+        "table_type",
+        "classification",
+        "columns",
+        "primary_keys",
+        "unique_keys",
+        "_hash",
+        "_fingerprint",
+    )
     _parquet_package: str = "org.apache.hadoop.hive.ql.io.parquet"
 
     def __init__(
@@ -155,30 +275,53 @@ class TableDef(object):
         primary_keys: List[BaseColumnDef] = None,
         unique_keys: List[BaseColumnDef] = None,
     ):
-        self.name = name
-        self.table_type = table_type
-        self.classification = classification
-        self.columns = columns
-        self.primary_keys = primary_keys
-        self.unique_keys = unique_keys
+        setattr_ = object.__setattr__
+        setattr_(self, "name", name)
+        setattr_(self, "table_type", table_type)
+        setattr_(self, "classification", classification)
+        setattr_(self, "columns", tuple(columns) if columns is not None else None)
+        setattr_(
+            self,
+            "primary_keys",
+            tuple(primary_keys) if primary_keys is not None else None,
+        )
+        setattr_(
+            self, "unique_keys", tuple(unique_keys) if unique_keys is not None else None
+        )
+        setattr_(self, "_hash", None)
+        setattr_(self, "_fingerprint", None)
+
+    def _kwargs(self) -> dict:
+        return dict(
+            name=self.name,
+            table_type=self.table_type,
+            classification=self.classification,
+            columns=self.columns,
+            primary_keys=self.primary_keys,
+            unique_keys=self.unique_keys,
+        )
 
-    def __eq__(self, other):
-        def compare(l1, l2) -> bool:
-            _l1 = l1 if l1 else []
-            _l2 = l2 if l2 else []
-            if len(_l1) == len(_l2):
-                return all(map(lambda x, y: x == y, _l1, _l2))
-            return False
+    def _key(self) -> tuple:
+        # None and empty are equal
+        return (
+            self.name,
+            self.table_type or "",
+            self.classification or "",
+            self.columns or (),
+            self.primary_keys or (),
+            self.unique_keys or (),
+        )
 
+    def __hash__(self):
+        if self._hash is None:
+            object.__setattr__(self, "_hash", hash(self._key()))
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
         if isinstance(other, TableDef):
-            return (
-                self.name == other.name
-                and compare(self.table_type, other.table_type)
-                and compare(self.classification, other.classification)
-                and compare(self.columns, other.columns)
-                and compare(self.primary_keys, other.primary_keys)
-                and compare(self.unique_keys, other.unique_keys)
-            )
+            return hash(self) == hash(other) and self._key() == other._key()
         return False
 
     @classmethod
@@ -228,34 +371,29 @@ class TableDef(object):
 
     @staticmethod
     def _build_from_parameters(data, key, fn) -> list:
-        if data["Parameters"].get(key):
-            return list(map(lambda x: fn(x), json.loads(data["Parameters"][key])))
+        value = (data.get("Parameters") or {}).get(key)
+        if value:
+            return [fn(x) for x in json.loads(value)]
         return []
 
     @staticmethod
     def _from_storage_descriptor(table) -> list:
         cols = table["StorageDescriptor"]["Columns"]
-        columns = []
-        for i in range(len(cols)):
-            col = cols[i]
-            ordinal_position = i + 1
-            data_type = col["Type"]
-            columns.append(
-                ColumnDef(
-                    name=col["Name"],
-                    ordinal_position=ordinal_position,
-                    data_type=data_type,
-                    data_length=None,
-                    mapping=DataTypeConverter.get_mapping(data_type),
-                )
+        return [
+            ColumnDef(
+                name=col["Name"],
+                ordinal_position=i + 1,
+                data_type=col["Type"],
+                data_length=None,
             )
-            return columns
+            for i, col in enumerate(cols)
+        ]
 
     @classmethod
     def from_glue(cls, table):
         table_name = table["Name"]
         table_type = table.get("TableType", "EXTERNAL_TABLE")
-        classification = table.get("Parameters", {}).get("classification")
+        classification = (table.get("Parameters") or {}).get("classification")
         columns = TableDef._build_from_parameters(table, "columns", ColumnDef.from_json)
         if not columns:
             columns = TableDef._from_storage_descriptor(table)
@@ -269,16 +407,42 @@ class TableDef(object):
             table_name, table_type, classification, columns, primary_keys, unique_keys
         )
 
+    def to_dict(self) -> dict:
+        d = self._kwargs()
+        for key in ("columns", "primary_keys", "unique_keys"):
+            if d[key] is not None:
+                d[key] = [c.to_dict() for c in d[key]]
+        return d
+
     def to_json(self):
-        return TableDef._to_json(self)
+        return json.dumps(self.to_dict())
+
+    def fingerprint(self) -> str:
+        """
+        A digest of the table schema - type, classification, the name, type, length
+        and position of every column, and the key columns. Two tables with the same
+        fingerprint get the same Glue definition, so comparing fingerprints is enough
+        to tell whether a table has to be updated. Unlike hash(), it is stable across
+        processes
+        """
+        if self._fingerprint is None:
+            schema = [
+                self.table_type,
+                self.classification,
+                [
+                    [c.name, c.ordinal_position, c.data_type, c.data_length]
+                    for c in self.columns or []
+                ],
+                [[c.name, c.ordinal_position] for c in self.primary_keys or []],
+                [[c.name, c.ordinal_position] for c in self.unique_keys or []],
+            ]
+            digest = hashlib.sha1(json.dumps(schema).encode("utf8")).hexdigest()
+            object.__setattr__(self, "_fingerprint", digest)
+        return self._fingerprint
 
     @staticmethod
     def _to_json(data: Any) -> str:
-        return (
-            json.dumps(data, default=lambda o: remove_empty_elements(o).__dict__)
-            if data
-            else "[]"
-        )
+        return json.dumps(data, default=lambda o: o.to_dict()) if data else "[]"
 
     def to_glue(self, database: str) -> dict:
         glue_columns = list(
@@ -1,12 +1,34 @@
-import json
+import time
 from abc import ABC
 from datetime import timedelta
-from typing import Optional
+from typing import Any, List, Optional
 
-import smart_open
+from airflow.exceptions import AirflowException
 from airflow.utils.log.logging_mixin import LoggingMixin
 
+from airfart.model.arrow_schema import to_arrow_schema
 from airfart.model.output_format import OutputFormat
+from airfart.model.table_definitions import TableDef
+from airfart.s3_utils import get_last_execution, set_last_execution
+from airfart.sinks.partitioned_sink import PartitionedS3Sink
+from airfart.sinks.rolling_sink import RollingS3Sink
+from airfart.sinks.s3_sink import BaseS3Sink, get_sink
+from airfart.utils.stage_stats import StageStats
+
+
+def _is_missing_watermark(err: Exception) -> bool:
+    """
+    whether reading the last_execution file failed because there is no watermark
+    (no such key / file), rather than i.e. a permission or network error
+    """
+    if isinstance(err, KeyError):
+        return True
+    while err is not None:
+        code = getattr(err, "response", {}).get("Error", {}).get("Code")
+        if code in ("NoSuchKey", "404") or "NoSuchKey" in str(err):
+            return True
+        err = err.__cause__ or err.__context__
+    return False
 
 
 class BaseDataToS3Operator(LoggingMixin, ABC):
@@ -29,7 +51,59 @@ class BaseDataToS3Operator(LoggingMixin, ABC):
         this task instance, if it goes beyond it will raise and fail.
         Default is set to 5 minutes. (based on max of 6s, of 12 runs)
     :type execution_timeout: datetime.timedelta
+    :param stream: fetch the results through a server-side cursor and write
+        them batch by batch, instead of loading the whole result set into memory
+    :type stream: bool
+    :param batch_size: number of rows fetched and written per batch when streaming
+    :type batch_size: int
+    :param parquet_row_group_size: number of rows per parquet row group.
+        If not provided, every fetched batch is written as its own row group
+    :type parquet_row_group_size: int
+    :param parquet_compression: parquet compression codec
+    :type parquet_compression: str
+    :param parquet_dictionary_columns: columns to dictionary-encode in parquet outputs
+    :type parquet_dictionary_columns: List[str]
+    :param table_def: definition of the exported table, i.e. a TableDef.from_query
+        row of the schema dump. Parquet outputs convert every batch to its arrow
+        schema (decimals with their precision, timestamps, tinyint, enums as
+        dictionaries) instead of inferring the types of the first batch, so every
+        file of the export gets the same schema
+    :type table_def: TableDef
+    :param max_rows_per_file: start a new part file (file_name-00000, file_name-00001, ...)
+        once this many rows were written, and write a manifest of the parts
+    :type max_rows_per_file: int
+    :param max_bytes_per_file: start a new part file once about this many
+        compressed bytes were written, and write a manifest of the parts
+    :type max_bytes_per_file: int
+    :param partition_columns: write the rows to Hive style partitions
+        (i.e. post_db_path/date_=2021-03-08/hour=05/file_name.json.gz) by these columns,
+        so a query spanning many partitions is exported in a single pass.
+        The partition columns are removed from the written rows
+    :type partition_columns: List[str]
+    :param max_open_partitions: maximum number of partition files open at the same time
+    :type max_open_partitions: int
+    :param pooled: reuse pooled, health-checked database connections
+        instead of connecting on every query
+    :type pooled: bool
+    :param watermark_column: enables the incremental mode. The last high-water mark
+        (i.e. max updated_at or id exported so far) is read from the last_execution
+        file in s3://bucket/[watermark_prefix]/last_execution and bound to the query
+        as the `watermark` parameter, i.e. `WHERE updated_at > %(watermark)s`.
+        The max value of this column in the exported rows is stored as the new
+        watermark once the upload succeeded
+    :type watermark_column: str
+    :param watermark_prefix: prefix of the last_execution file. Defaults to database/file_name
+    :type watermark_prefix: str
+    :param watermark_key: key of the watermark in the last_execution file.
+        Defaults to the watermark column
+    :type watermark_key: str
+    :param initial_watermark: watermark to use when none was stored yet.
+        Required for the first run, as the query compares the column to it
+    :type initial_watermark: str
 
+    Every export records the wall time, rows and bytes of its stages (connect, execute,
+    fetch, transform, serialize, compress, upload). They are logged as a summary table
+    and returned by execute, so they end up in the task XCom
     """
 
     __ALLOWED_FORMATS = [OutputFormat.JSON, OutputFormat.PARQUET, OutputFormat.CSV]
@@ -48,6 +122,21 @@ class BaseDataToS3Operator(LoggingMixin, ABC):
         include_csv_headers: bool = True,
         records_transform_fn: callable = None,
         execution_timeout: timedelta = timedelta(minutes=5),
+        stream: bool = False,
+        batch_size: int = 10000,
+        parquet_row_group_size: Optional[int] = None,
+        parquet_compression: str = "snappy",
+        parquet_dictionary_columns: Optional[List[str]] = None,
+        table_def: Optional[TableDef] = None,
+        max_rows_per_file: Optional[int] = None,
+        max_bytes_per_file: Optional[int] = None,
+        partition_columns: Optional[List[str]] = None,
+        max_open_partitions: int = 32,
+        pooled: bool = False,
+        watermark_column: Optional[str] = None,
+        watermark_prefix: Optional[str] = None,
+        watermark_key: Optional[str] = None,
+        initial_watermark: Optional[str] = None,
         **kwargs,
     ):
         super().__init__()
@@ -65,26 +154,63 @@ class BaseDataToS3Operator(LoggingMixin, ABC):
         self.include_csv_headers = include_csv_headers
         self.records_transform_fn = records_transform_fn
         self.execution_timeout = execution_timeout
+        self.stream = stream
+        self.batch_size = batch_size
+        self.parquet_row_group_size = parquet_row_group_size
+        self.parquet_compression = parquet_compression
+        self.parquet_dictionary_columns = parquet_dictionary_columns
+        self.table_def = table_def
+        self._arrow_schema = None
+        self.max_rows_per_file = max_rows_per_file
+        self.max_bytes_per_file = max_bytes_per_file
+        self.partition_columns = partition_columns
+        self.max_open_partitions = max_open_partitions
+        self.pooled = pooled
+        self.watermark_column = watermark_column
+        self.watermark_prefix = watermark_prefix or "/".join([database, file_name])
+        self.watermark_key = watermark_key or watermark_column
+        self.initial_watermark = initial_watermark
+        self.parameters: Optional[dict] = None
+        self.stats: Optional[StageStats] = None
 
     def get_hook(self):
         raise NotImplementedError
 
+    def get_instrumented_hook(self):
+        """
+        get a hook recording its stages in the stats of the current export
+        """
+        hook = self.get_hook()
+        hook.stats = self.stats
+        return hook
+
     def get_pandas_df(self):
         """
         get records from the hook
         :return: list of records
         """
-        return self.get_hook().get_pandas_df(self.sql)
+        return self.get_instrumented_hook().get_pandas_df(self.sql, self.parameters)
 
     def get_records(self):
         """
         get records from the hook
         :return: list of records
         """
-        return self.get_hook().get_records(self.sql)
+        return self.get_instrumented_hook().get_records(self.sql, self.parameters)
+
+    def get_pandas_df_batches(self):
+        """
+        stream records from the hook in batches of `batch_size` rows
+        :return: iterator of dataframes
+        """
+        return self.get_instrumented_hook().get_pandas_df_batches(
+            self.sql, self.parameters, batch_size=self.batch_size
+        )
 
-    def execute(self):
-        # Generate write destination
+    def get_uri(self) -> str:
+        """
+        Generate write destination (without the output format suffix)
+        """
         path_components = [
             "s3:/",
             self.bucket,
@@ -95,55 +221,148 @@ class BaseDataToS3Operator(LoggingMixin, ABC):
         path_components = [
             p_c for p_c in path_components if p_c
         ]  # removing None segments
-        if self.output_format == OutputFormat.JSON:
-            suffix = ".json.gz"
-        elif self.output_format == OutputFormat.CSV:
-            suffix = ".csv"
-        else:  # OutputFormat.PARQUET
-            suffix = ".parquet"
-        uri = "/".join(path_components) + suffix
+        return "/".join(path_components)
+
+    def get_sink(self, uri: str) -> BaseS3Sink:
+        if self.partition_columns:
+            return PartitionedS3Sink(
+                uri,
+                self.partition_columns,
+                self.get_partition_sink,
+                max_open_writers=self.max_open_partitions,
+            )
+        return self.get_partition_sink(uri)
+
+    def get_partition_sink(self, uri: str) -> BaseS3Sink:
+        if self.max_rows_per_file or self.max_bytes_per_file:
+            return RollingS3Sink(
+                uri,
+                self.get_file_sink,
+                max_rows=self.max_rows_per_file,
+                max_bytes=self.max_bytes_per_file,
+            )
+        return self.get_file_sink(uri)
+
+    def get_arrow_schema(self):
+        """
+        the arrow schema of table_def, without the partition columns
+        (which are not written), if any
+        """
+        if self.table_def is None or self.output_format != OutputFormat.PARQUET:
+            return None
+        if self._arrow_schema is None:
+            self._arrow_schema = to_arrow_schema(
+                self.table_def, exclude=self.partition_columns
+            )
+        return self._arrow_schema
+
+    def get_file_sink(self, uri: str) -> BaseS3Sink:
+        sink = get_sink(
+            self.output_format,
+            uri,
+            records_transform_fn=self.records_transform_fn,
+            include_csv_headers=self.include_csv_headers,
+            row_group_size=self.parquet_row_group_size,
+            compression=self.parquet_compression,
+            dictionary_columns=self.parquet_dictionary_columns,
+            schema=self.get_arrow_schema(),
+        )
+        sink.stats = self.stats
+        return sink
+
+    def get_watermark(self) -> str:
+        """
+        read the last stored high-water mark, initial_watermark if none was stored.
+        Errors other than a missing watermark are raised, rather than exporting
+        everything again
+        """
+        try:
+            return get_last_execution(
+                self.bucket, self.watermark_prefix, self.watermark_key
+            )
+        except Exception as e:
+            if not _is_missing_watermark(e):
+                raise
+            missing = e
+        if self.initial_watermark is None:
+            raise AirflowException(
+                f"no watermark found in {self.watermark_prefix} ({missing}) and "
+                f"no initial_watermark, the query would not match any row"
+            )
+        self.log.info(
+            f"no watermark found in {self.watermark_prefix} ({missing}), "
+            f"using {self.initial_watermark}"
+        )
+        return self.initial_watermark
+
+    def set_watermark(self, value: str) -> None:
+        set_last_execution(
+            self.bucket, self.watermark_prefix, self.watermark_key, value
+        )
+        self.log.info(
+            f"Updated {self.watermark_prefix} {self.watermark_key} to {value}"
+        )
+
+    def write_batches(self, sink: BaseS3Sink, batches) -> Optional[Any]:
+        """
+        write the batches to the sink
+        :return: the max value of watermark_column written, if any
+        """
+        watermark = None
+        for df in batches:
+            if self.watermark_column and not df.empty:
+                batch_watermark = df[self.watermark_column].max()
+                # skip NaN / NaT
+                if batch_watermark == batch_watermark and (
+                    watermark is None or batch_watermark > watermark
+                ):
+                    watermark = batch_watermark
+            sink.write(df)
+        return watermark
+
+    def report(self, start: float, rows: int, bytes_written: int) -> dict:
+        """
+        log the stage stats of the export
+        :param start: time.perf_counter() at the start of the export
+        :return: the totals and per stage stats, as a dict
+        """
+        seconds = time.perf_counter() - start
+        self.log.info(
+            f"exported {rows} rows ({bytes_written} bytes) in {seconds:.3f}s\n"
+            f"{self.stats.summary()}"
+        )
+        return dict(
+            rows=rows,
+            bytes=bytes_written,
+            seconds=round(seconds, 6),
+            rows_per_sec=round(rows / seconds, 1) if seconds else None,
+            stages=self.stats.to_dict(),
+        )
+
+    def execute(self, context=None):
+        start = time.perf_counter()
+        self.stats = StageStats()
+        uri = self.get_uri()
         self.log.debug(f"\nGenerated destination: {uri}\n")
 
+        if self.watermark_column:
+            self.parameters = dict(watermark=self.get_watermark())
+            self.log.info(f"exporting rows after watermark {self.parameters}")
+
         # Query logging
         self.log.debug("\nExecuting the following query: %s\n", self.sql)
 
-        df = self.get_pandas_df()
-
-        if not df.empty:
-            if self.output_format == OutputFormat.PARQUET:
-                if self.records_transform_fn:
-                    df = self.records_transform_fn(df)
-                df.to_parquet(uri, engine="pyarrow", allow_truncated_timestamps=True)
-            else:
-                if self.output_format == OutputFormat.JSON:
-                    columns = df.select_dtypes(include=["datetime64"]).columns
-                    for column in columns:
-                        df[column] = df[column].astype(str)
-                    records = df.to_dict(orient="records")
-                else:  # self.CSV
-                    records = df.to_csv(
-                        index=False, header=self.include_csv_headers
-                    ).split("\n")
-
-                # Copy to S3
-                self.log.info(f"about to write to file {uri}")
-                with smart_open.smart_open(uri, "wb") as s3_file:
-                    for record in records:
-                        if not record:
-                            continue
-                        record_to_write = (
-                            self.records_transform_fn(record)
-                            if self.records_transform_fn
-                            else record
-                        )
-                        s3_file.write(
-                            (
-                                json.dumps(
-                                    record_to_write, default=lambda o: o.__dict__
-                                )
-                                + "\n"
-                            ).encode("utf8")
-                        )
-        else:
+        batches = (
+            self.get_pandas_df_batches() if self.stream else [self.get_pandas_df()]
+        )
+
+        with self.get_sink(uri) as sink:
+            watermark = self.write_batches(sink, batches)
+
+        # the sink is closed, so all files were uploaded
+        if watermark is not None:
+            self.set_watermark(str(watermark))
+        if sink.rows == 0:
             self.log.warn("No data found")
         self.log.info("All done")
+        return self.report(start, sink.rows, sink.bytes)
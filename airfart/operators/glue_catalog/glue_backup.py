@@ -1,4 +1,6 @@
-from typing import List
+import json
+from contextlib import ExitStack
+from typing import Dict, List, Optional
 
 import pendulum
 import smart_open
@@ -7,8 +9,75 @@ from airflow.utils.log.logging_mixin import LoggingMixin
 from airfart.hooks.glue_catalog.glue_catalog import GlueCatalogHook
 from airfart.model.table_definitions import TableDef
 
+BACKUP_PREFIX = "glue-catalog-backup"
+
+
+def _manifest_uri(bucket: str, db: str) -> str:
+    return f"s3://{bucket}/{BACKUP_PREFIX}/manifest/db={db}/manifest.json"
+
+
+def read_manifest(bucket: str, db: str) -> Optional[dict]:
+    """
+    read the manifest of the incremental backups of the database, if any
+    """
+    try:
+        with smart_open.open(_manifest_uri(bucket, db), "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _read_tables(uri: str) -> List[TableDef]:
+    with smart_open.open(uri, "r") as f:
+        return [TableDef.from_json(json.loads(line)) for line in f if line.strip()]
+
+
+def restore_database(bucket: str, db: str) -> Dict[str, TableDef]:
+    """
+    Rebuild the last backed up state of the database: the full (base) backup,
+    merged with every delta written since, in order, minus the dropped tables
+
+    :param bucket: bucket of the backups
+    :param db: Name of hive database (schema)
+    :return: table definitions by table name
+    """
+    manifest = read_manifest(bucket, db)
+    assert manifest, f"no incremental backup found for database {db}"
+    tables = {t.name: t for t in _read_tables(manifest["base"]["uri"])}
+    for delta in manifest["deltas"]:
+        if delta.get("uri"):
+            tables.update((t.name, t) for t in _read_tables(delta["uri"]))
+        if delta.get("tombstones_uri"):
+            with smart_open.open(delta["tombstones_uri"], "r") as f:
+                for table in json.load(f):
+                    tables.pop(table, None)
+    return tables
+
 
 class GlueBackupOperator(LoggingMixin):
+    """
+    Backs up the table definitions of Glue databases to
+    s3://bucket/glue-catalog-backup/date_=YYYY-MM-DD/db=database/YYYY-MM-DD_database.json.gz
+
+    :param bucket: destination bucket
+    :type bucket: str
+    :param include_databases: databases to back up, all of them if not provided
+    :type include_databases: List[str]
+    :param exclude_tables: tables to skip (tables starting with tmp_ are always skipped)
+    :type exclude_tables: List[str]
+    :param region: AWS region of the catalog
+    :type region: str
+    :param incremental: only back up the tables created or updated since the last backup.
+        Each database keeps a manifest of the UpdateTime / VersionId of its tables
+        (glue-catalog-backup/manifest/db=database/manifest.json). Changed tables are
+        written to a delta file (..._database.delta-HHmmss.json.gz), dropped tables to a
+        tombstone list (..._database.tombstones-HHmmss.json). The first backup, and every
+        backup after `max_deltas` deltas, is a full one. See restore_database
+    :type incremental: bool
+    :param max_deltas: number of deltas after which a new full backup is written
+    :type max_deltas: int
+    """
+
     template_fields = ("bucket", "exclude_databases", "exclude_tables")
 
     ui_color = "#b025ae"
@@ -20,6 +89,8 @@ class GlueBackupOperator(LoggingMixin):
         include_databases: List[str] = None,
         exclude_tables: List[str] = None,
         region: str = "us-west-2",
+        incremental: bool = False,
+        max_deltas: int = 30,
         **kwargs,
     ):
         super(GlueBackupOperator, self).__init__(**kwargs)
@@ -27,37 +98,98 @@ class GlueBackupOperator(LoggingMixin):
         self.exclude_tables = exclude_tables if exclude_tables else []
         self.include_databases = include_databases if include_databases else []
         self.region = region
+        self.incremental = incremental
+        self.max_deltas = max_deltas
 
     def get_hook(self):
         return GlueCatalogHook(region=self.region)
 
+    def _uri(self, date: str, db: str, suffix: str) -> str:
+        return f"s3://{self.bucket}/{BACKUP_PREFIX}/date_={date}/db={db}/{date}_{db}{suffix}"
+
+    def backup_database(
+        self, hook: GlueCatalogHook, db: str, now: pendulum.DateTime
+    ) -> None:
+        date = now.format("YYYY-MM-DD")
+        manifest = read_manifest(self.bucket, db) if self.incremental else None
+        if manifest and len(manifest["deltas"]) >= self.max_deltas:
+            manifest = None
+        # previous UpdateTime / VersionId by table, None for a full backup
+        previous: Optional[Dict[str, list]] = manifest["tables"] if manifest else None
+        run = now.format("HHmmss")
+        uri = self._uri(
+            date, db, ".json.gz" if previous is None else f".delta-{run}.json.gz"
+        )
+
+        revisions: Dict[str, list] = dict()
+        backed_up: int = 0
+        s3_file = None
+        # an exception terminates the upload instead of committing a partial
+        # backup over the good one of the day
+        with ExitStack() as stack:
+            # the table pages already hold the full table objects,
+            # every page is written as soon as it arrives
+            for tables in hook.get_table_pages(db):
+                lines: List[str] = []
+                for glue_table in tables:
+                    table = glue_table["Name"]
+                    # skip tables
+                    if table in self.exclude_tables or table.startswith("tmp_"):
+                        self.log.warning(f"skipping table {db}.{table}")
+                        continue
+                    revision = [
+                        str(glue_table.get("UpdateTime", "")),
+                        str(glue_table.get("VersionId", "")),
+                    ]
+                    revisions[table] = revision
+                    if previous is not None and previous.get(table) == revision:
+                        continue
+                    self.log.debug(f"backing up table {db}.{table}")
+                    table_for_backup = TableDef.from_glue(glue_table)
+                    lines.append(TableDef.to_json(table_for_backup) + "\n")
+                # a full backup is always written, a delta only when something changed
+                if s3_file is None and (lines or previous is None):
+                    s3_file = stack.enter_context(smart_open.open(uri, "wb"))
+                if lines:
+                    s3_file.write("".join(lines).encode("utf8"))
+                    backed_up += len(lines)
+
+        if previous is None:
+            self.log.info(f"exported {backed_up} tables from database [{db}]")
+            manifest = dict(base=dict(date=date, uri=uri), deltas=[])
+        else:
+            dropped = sorted(set(previous) - set(revisions))
+            tombstones_uri = None
+            if dropped:
+                tombstones_uri = self._uri(date, db, f".tombstones-{run}.json")
+                with smart_open.open(tombstones_uri, "wb") as f:
+                    f.write(json.dumps(dropped).encode("utf8"))
+            self.log.info(
+                f"exported {backed_up} changed tables and {len(dropped)} dropped "
+                f"tables out of {len(revisions)} from database [{db}]"
+            )
+            if backed_up or dropped:
+                manifest["deltas"].append(
+                    dict(
+                        date=date,
+                        uri=uri if backed_up else None,
+                        tombstones_uri=tombstones_uri,
+                        changed=backed_up,
+                        dropped=len(dropped),
+                    )
+                )
+        if self.incremental:
+            # written last, once the backup files were uploaded
+            manifest["tables"] = revisions
+            with smart_open.open(_manifest_uri(self.bucket, db), "wb") as f:
+                f.write(json.dumps(manifest).encode("utf8"))
+
     def execute(self):
-        date = pendulum.Date.today().format("YYYY-MM-DD")
+        now = pendulum.now()
         hook = self.get_hook()
         databases = (
             self.include_databases if self.include_databases else hook.get_databases()
         )
         for db in databases:
-            uri = f"s3://{self.bucket}/glue-catalog-backup/date_={date}/db={db}/{date}_{db}.json.gz"
-            with smart_open.smart_open(uri, "wb") as s3_file:
-                tables: List[str] = hook.get_tables(db)
-                if tables:
-                    backed_up: int = 0
-                    for table in tables:
-                        # skip tables
-                        if table not in self.exclude_tables and (
-                            not table.startswith("tmp_")
-                        ):
-                            self.log.debug(f"backing up table {db}.{table}")
-                            glue_table = hook.get_table(db, table)
-                            table_for_backup = TableDef.from_glue(glue_table)
-                            s3_file.write(
-                                (TableDef.to_json(table_for_backup) + "\n").encode(
-                                    "utf8"
-                                )
-                            )
-                            backed_up += 1
-                        else:
-                            self.log.warning(f"skipping table {db}.{table}")
-                    self.log.info(f"exported {backed_up} tables from database [{db}]")
+            self.backup_database(hook, db, now)
         self.log.info("export done")
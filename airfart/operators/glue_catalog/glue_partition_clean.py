@@ -1,51 +1,211 @@
-import itertools
-from typing import Set
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Iterable, List, Optional, Set
+from urllib.parse import unquote
+
+from airflow.utils.log.logging_mixin import LoggingMixin
 
 from airfart.hooks.glue_catalog.glue_catalog import GlueCatalogHook
 from airfart.s3 import AwsS3Hook
+from airfart.utils.listing_snapshot import PARTITIONS, ListingSnapshot
+
+
+class GluePartitionCleanOperator(LoggingMixin):
+    """
+    Drops the partitions of a Glue table with no parquet file left in S3.
 
+    The partitions are read with segment-parallel get_partitions calls, the
+    table location is listed once (one listing per top level partition
+    prefix, in parallel) into the set of partition prefixes holding data,
+    and the orphan partitions - the set difference - are dropped with
+    batch_delete_partition calls of 25 partitions.
+
+    :param database_name: Glue database
+    :type database_name: str
+    :param table_name: Glue table
+    :type table_name: str
+    :param region: AWS region of the catalog
+    :type region: str
+    :param total_segments: number of get_partitions segments read in parallel (1 to 10)
+    :type total_segments: int
+    :param max_workers: number of concurrent S3 listings
+    :type max_workers: int
+    :param dry_run: only log the orphan partitions
+    :type dry_run: bool
+    :param listing_snapshot: If provided, path (local or s3://) of the listing
+        snapshot of the table location. Every run then only lists the new and the
+        newest top level partition prefixes, and drops the removed ones from the
+        snapshot (see ListingSnapshot). As a backfilled older partition is not
+        noticed by the snapshot, the top level prefixes of the orphan partitions
+        are listed again, live, before dropping them
+    :type listing_snapshot: str
+    :param listing_snapshot_max_age: age after which the table location is listed
+        in full again
+    :type listing_snapshot_max_age: timedelta
+    """
 
-class GluePartitionCleanOperator:
     def __init__(
-        self, database_name: str, table_name: str, region: str, **kwargs
+        self,
+        database_name: str,
+        table_name: str,
+        region: str,
+        total_segments: int = 4,
+        max_workers: int = 8,
+        dry_run: bool = False,
+        listing_snapshot: Optional[str] = None,
+        listing_snapshot_max_age: timedelta = timedelta(days=7),
+        **kwargs,
     ) -> None:
         super().__init__(**kwargs)
         self.database_name = database_name
         self.table_name = table_name
         self.region = region
+        self.total_segments = total_segments
+        self.max_workers = max_workers
+        self.dry_run = dry_run
+        self.listing_snapshot = listing_snapshot
+        self.listing_snapshot_max_age = listing_snapshot_max_age
 
-    def execute(self, context=None):
-        glue_hook = GlueCatalogHook(region=self.region)
-        table = glue_hook.get_table(
-            database_name=self.database_name, table_name=self.table_name
+    @staticmethod
+    def _partition_prefix(partition_keys: List[str], values: List[str]) -> str:
+        return "/".join(f"{key}={value}" for key, value in zip(partition_keys, values))
+
+    @staticmethod
+    def _partition_prefixes(
+        objects: Iterable[dict], table_prefix: str, depth: int
+    ) -> Set[str]:
+        """
+        the partition prefixes (relative to the table location) holding parquet files
+        """
+        prefixes = set()
+        for obj in objects:
+            if "parquet" not in obj["Key"]:
+                continue
+            parts = obj["Key"][len(table_prefix) :].split("/")
+            # the partition directories, followed by the file name
+            if len(parts) > depth:
+                prefixes.add("/".join(unquote(p) for p in parts[:depth]))
+        return prefixes
+
+    def _list_partition_prefixes(
+        self,
+        s3_hook: AwsS3Hook,
+        bucket: str,
+        table_prefix: str,
+        depth: int,
+        top_level_prefixes: List[str],
+    ) -> Set[str]:
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            listings = executor.map(
+                lambda p: self._partition_prefixes(
+                    s3_hook.list_keys(bucket, p), table_prefix, depth
+                ),
+                top_level_prefixes,
+            )
+            return set().union(*listings)
+
+    def get_s3_partition_prefixes(
+        self, s3_hook: AwsS3Hook, bucket: str, table_prefix: str, depth: int
+    ) -> Set[str]:
+        if self.listing_snapshot:
+            snapshot = ListingSnapshot(
+                s3_hook.get_conn(),
+                bucket,
+                table_prefix,
+                self.listing_snapshot,
+                mode=PARTITIONS,
+                max_age=self.listing_snapshot_max_age,
+                max_workers=self.max_workers,
+            )
+            return self._partition_prefixes(
+                snapshot.refresh().objects(), table_prefix, depth
+            )
+        return self._list_partition_prefixes(
+            s3_hook,
+            bucket,
+            table_prefix,
+            depth,
+            s3_hook.list_prefixes(bucket, table_prefix),
         )
-        partition_keys = list(map(lambda x: x["Name"], table["Table"]["PartitionKeys"]))
-        location: str = table["Table"]["StorageDescriptor"]["Location"]
+
+    def verify_orphans(
+        self,
+        s3_hook: AwsS3Hook,
+        bucket: str,
+        table_prefix: str,
+        depth: int,
+        orphans: List[str],
+    ) -> List[str]:
+        """
+        list again, live, the top level prefixes of the orphans found in the
+        listing snapshot, which only lists again the newest ones
+        :return: the orphans without data in S3
+        """
+        touched = {orphan.split("/")[0] for orphan in orphans}
+        top_level_prefixes = [
+            p
+            for p in s3_hook.list_prefixes(bucket, table_prefix)
+            if unquote(p[len(table_prefix) :].rstrip("/")) in touched
+        ]
+        live = self._list_partition_prefixes(
+            s3_hook, bucket, table_prefix, depth, top_level_prefixes
+        )
+        verified = [orphan for orphan in orphans if orphan not in live]
+        if len(verified) < len(orphans):
+            self.log.warning(
+                f"{len(orphans) - len(verified)} partitions missing from the listing "
+                f"snapshot have data in S3, not dropping them"
+            )
+        return verified
+
+    def execute(self, context=None) -> dict:
+        glue_hook = GlueCatalogHook(region=self.region)
+        table = glue_hook.get_table(self.database_name, self.table_name)
+        partition_keys = list(map(lambda x: x["Name"], table["PartitionKeys"]))
+        location: str = table["StorageDescriptor"]["Location"]
         location_parts = location.split("/")
         bucket = location_parts[2]
-        bucket_prefix = "/".join([location_parts[3], location_parts[4]])
-        partitions: Set[tuple] = glue_hook.get_partitions(
-            database_name=self.database_name,
-            table_name=self.table_name,
-            page_size=100,
-            max_items=100,
-        )
+        table_prefix = "/".join(location_parts[3:]).rstrip("/") + "/"
 
+        partitions = glue_hook.get_partitions(
+            self.database_name, self.table_name, total_segments=self.total_segments
+        )
+        glue_prefixes = {
+            self._partition_prefix(partition_keys, p["Values"]): p["Values"]
+            for p in partitions
+        }
         s3_hook = AwsS3Hook()
-        for partition in partitions:
-            # convert tuple to array
-            partition_values = list(itertools.chain(partition))
-            prefix = [bucket_prefix]
-            for i in range(0, len(partition_values)):
-                prefix.append(f"{partition_keys[i]}={partition_values[i]}")
+        s3_prefixes = self.get_s3_partition_prefixes(
+            s3_hook, bucket, table_prefix, len(partition_keys)
+        )
+        orphans = sorted(set(glue_prefixes) - s3_prefixes)
+        if self.listing_snapshot and orphans and not self.dry_run:
+            orphans = self.verify_orphans(
+                s3_hook, bucket, table_prefix, len(partition_keys), orphans
+            )
+        self.log.info(
+            f"{len(orphans)} of {len(glue_prefixes)} partitions of "
+            f"{self.database_name}.{self.table_name} have no data in {location}"
+        )
 
-            if not s3_hook.validate_key(bucket, "/".join(prefix)):
-                glue_hook.drop_partition(
-                    database_name=self.database_name,
-                    table_name=self.table_name,
-                    partition_values=partition_values,
-                )
+        failed = 0
+        if self.dry_run:
+            for prefix in orphans:
+                self.log.info(f"skipping drop due to dryRun: {prefix}")
+        elif orphans:
+            failed = glue_hook.batch_delete_partitions(
+                self.database_name,
+                self.table_name,
+                [glue_prefixes[prefix] for prefix in orphans],
+            )
+        return dict(
+            partitions=len(glue_prefixes),
+            orphans=len(orphans),
+            dropped=0 if self.dry_run else len(orphans) - failed,
+            failed=failed,
+            dry_run=self.dry_run,
+        )
 
 
 if __name__ == "__main__":
-    GluePartitionCleanOperator("dbl", "page_events").execute()
+    GluePartitionCleanOperator("dbl", "page_events", "us-west-2").execute()
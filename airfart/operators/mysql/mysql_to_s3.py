@@ -1,11 +1,52 @@
-from typing import Any
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Tuple
+
+import boto3
 
 from airfart.hooks.mysql.mysql_extended import MySqlExtendedHook
 from airfart.model.output_format import OutputFormat
 from airfart.operators.base_data_to_s3 import BaseDataToS3Operator
+from airfart.sinks.s3_sink import remove_file
+from airfart.utils.split_ranges import (
+    minmax_boundaries,
+    quantile_boundaries,
+    to_ranges,
+)
+from airfart.utils.stage_stats import StageStats
 
 
 class MySQLToS3Operator(BaseDataToS3Operator):
+    """
+    Exports the results of a MySQL/MariaDB query to S3, see BaseDataToS3Operator
+
+    :param session_variables: session variables to set on every connection
+    :type session_variables: dict
+    :param split_column: numeric or date column of the query results to split the
+        export by. When provided, the query is executed as `num_partitions` range
+        sub-queries running concurrently, each written to its own part file
+        (file_name-00000, file_name-00001, ...) under the same prefix. The range
+        files of a previous run beyond this run's ranges, i.e. after lowering
+        `num_partitions`, are deleted once every range was exported
+    :type split_column: str
+    :param num_partitions: number of key ranges to split the export into
+    :type num_partitions: int
+    :param max_workers: number of concurrent sub-queries (connections).
+        Defaults to `num_partitions`
+    :type max_workers: int
+    :param split_method: how key ranges are computed - `minmax` splits
+        [MIN, MAX] of `split_column` evenly, `quantiles` splits by quantiles
+        of a random sample, which evens out skewed keys
+    :type split_method: str
+    :param sample_rate: fraction of rows sampled for the `quantiles` split method
+    :type sample_rate: float
+    """
+
+    MINMAX: str = "minmax"
+    QUANTILES: str = "quantiles"
+    __ALLOWED_SPLIT_METHODS = [MINMAX, QUANTILES]
+
     def __init__(
         self,
         *,
@@ -19,7 +60,12 @@ class MySQLToS3Operator(BaseDataToS3Operator):
         post_db_path: str = None,
         records_transform_fn: callable = None,
         session_variables: dict = None,
-        **kwargs
+        split_column: Optional[str] = None,
+        num_partitions: int = 4,
+        max_workers: Optional[int] = None,
+        split_method: str = MINMAX,
+        sample_rate: float = 0.001,
+        **kwargs,
     ) -> None:
         super(MySQLToS3Operator, self).__init__(
             sql=sql,
@@ -31,14 +77,147 @@ class MySQLToS3Operator(BaseDataToS3Operator):
             include_csv_headers=include_csv_headers,
             post_db_path=post_db_path,
             records_transform_fn=records_transform_fn,
-            **kwargs
+            **kwargs,
         )
+        assert (
+            split_method in self.__ALLOWED_SPLIT_METHODS
+        ), f"split_method should be either {self.MINMAX} or {self.QUANTILES}! "
         self.session_variables = session_variables
+        self.split_column = split_column
+        self.num_partitions = num_partitions
+        self.max_workers = max_workers or num_partitions
+        self.split_method = split_method
+        self.sample_rate = sample_rate
 
     def get_hook(self):
         return MySqlExtendedHook(
-            mysql_conn_id=self.db_conn_id, session_variables=self.session_variables
+            mysql_conn_id=self.db_conn_id,
+            session_variables=self.session_variables,
+            pooled=self.pooled,
+            # one connection per concurrent range sub-query
+            pool_max_size=self.max_workers,
+        )
+
+    def _split_sql(self, columns: str, where: str = "") -> str:
+        """
+        wrap the query. The wrapped queries are always run with (pyformat)
+        parameters, so the literal % of a query without parameters are escaped
+        """
+        sql = self.sql if self.parameters is not None else self.sql.replace("%", "%%")
+        return f"SELECT {columns} FROM ({sql}) AS airfart_split {where}".strip()
+
+    def _split_parameters(self, **kwargs) -> dict:
+        return dict(self.parameters or {}, **kwargs)
+
+    def get_split_ranges(self, hook) -> List[Tuple[Optional[Any], Optional[Any]]]:
+        """
+        compute the key ranges of `split_column`
+        :return: list of [lower, upper) ranges, None meaning unbounded
+        """
+        col = self.split_column
+        boundaries = []
+        if self.split_method == self.QUANTILES:
+            sample = hook.get_records(
+                self._split_sql(
+                    col, f"WHERE {col} IS NOT NULL AND RAND() < %(sample_rate)s"
+                ),
+                self._split_parameters(sample_rate=self.sample_rate),
+            )
+            boundaries = quantile_boundaries(
+                [r[0] for r in sample], self.num_partitions
+            )
+        if not boundaries:
+            # minmax, or the sample was too small to compute quantiles
+            low, high = hook.get_records(
+                self._split_sql(f"MIN({col}), MAX({col})"), self._split_parameters()
+            )[0]
+            boundaries = minmax_boundaries(low, high, self.num_partitions)
+        return to_ranges(boundaries)
+
+    def _range_sql(self, lower: Any, upper: Any) -> Tuple[str, dict]:
+        col = self.split_column
+        predicates = []
+        parameters = self._split_parameters()
+        if lower is not None:
+            predicates.append(f"{col} >= %(split_lower)s")
+            parameters.update(split_lower=lower)
+        if upper is not None:
+            predicates.append(f"{col} < %(split_upper)s")
+            parameters.update(split_upper=upper)
+        where = " AND ".join(predicates)
+        if lower is None:
+            # rows with a NULL key are exported with the first range
+            where = f"({where} OR {col} IS NULL)" if where else ""
+        return self._split_sql("*", f"WHERE {where}" if where else ""), parameters
+
+    def _export_range(self, hook, part: int, lower: Any, upper: Any) -> tuple:
+        sql, parameters = self._range_sql(lower, upper)
+        uri = f"{self.get_uri()}-{part:05d}"
+        self.log.info(f"exporting {self.split_column} in [{lower}, {upper}) to {uri}")
+        if self.stream:
+            batches = hook.get_pandas_df_batches(
+                sql, parameters, batch_size=self.batch_size
+            )
+        else:
+            batches = [hook.get_pandas_df(sql, parameters)]
+        with self.get_sink(uri) as sink:
+            watermark = self.write_batches(sink, batches)
+        return sink.rows, sink.bytes, watermark
+
+    def remove_stale_ranges(self, count: int) -> None:
+        """
+        delete the files of the ranges numbered `count` and above, left by a
+        previous run that exported more ranges. Covers the parts and manifests
+        of rolling range files (file_name-00004-00000, _file_name-00004.manifest.json)
+        """
+        bucket, key = self.get_uri()[len("s3://") :].split("/", 1)
+        prefix, _, file_name = key.rpartition("/")
+        range_number = re.compile(rf"_?{re.escape(file_name)}-(\d{{5}})(?!\d)")
+        client = boto3.client("s3")
+        paginator = client.get_paginator("list_objects_v2")
+        stale = []
+        for listed in (f"{key}-", f"{prefix}/_{file_name}-"):
+            for page in paginator.paginate(Bucket=bucket, Prefix=listed):
+                for obj in page.get("Contents", []):
+                    match = range_number.match(obj["Key"].rpartition("/")[2])
+                    if match and int(match.group(1)) >= count:
+                        stale.append(obj["Key"])
+        if stale:
+            self.log.info(f"deleting {len(stale)} files of the previous run's ranges")
+        for stale_key in stale:
+            remove_file(f"s3://{bucket}/{stale_key}")
+
+    def execute_partitioned(self) -> dict:
+        start = time.perf_counter()
+        # the stats are shared by the concurrent sub-queries,
+        # so the stage times add up to more than the elapsed time
+        self.stats = StageStats()
+        hook = self.get_instrumented_hook()
+        if self.watermark_column:
+            self.parameters = dict(watermark=self.get_watermark())
+        ranges = self.get_split_ranges(hook)
+        self.log.info(
+            f"exporting {len(ranges)} ranges of {self.split_column} "
+            f"with {self.max_workers} workers"
         )
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                executor.submit(self._export_range, hook, part, lower, upper)
+                for part, (lower, upper) in enumerate(ranges)
+            ]
+            results = [f.result() for f in futures]
+        self.remove_stale_ranges(len(ranges))
+        rows = sum(r[0] for r in results)
+        watermarks = [r[2] for r in results if r[2] is not None]
+        # all parts were uploaded
+        if watermarks:
+            self.set_watermark(str(max(watermarks)))
+        if rows == 0:
+            self.log.warn("No data found")
+        self.log.info("All done")
+        return self.report(start, rows, sum(r[1] for r in results))
 
     def execute(self, context: Any):
-        super().execute(context)
+        if self.split_column:
+            return self.execute_partitioned()
+        return super().execute(context)
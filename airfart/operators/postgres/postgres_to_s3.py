@@ -1,11 +1,28 @@
+import gzip
+import time
 from datetime import timedelta
+from typing import Any
+
+import smart_open
 
 from airfart.hooks.postgres.postgres_extended import PostgresExtendedHook
 from airfart.model.output_format import OutputFormat
 from airfart.operators.base_data_to_s3 import BaseDataToS3Operator
+from airfart.sinks.s3_sink import CountingWriter
+from airfart.utils.stage_stats import StageStats
 
 
 class PostgresToS3Operator(BaseDataToS3Operator):
+    """
+    Exports the results of a Postgres query to S3, see BaseDataToS3Operator
+
+    :param use_copy: export CSV outputs with `COPY (sql) TO STDOUT`, piping the
+        bytes straight to S3 instead of building a dataframe
+    :type use_copy: bool
+    :param compress: gzip the COPY output (file_name.csv.gz)
+    :type compress: bool
+    """
+
     def __init__(
         self,
         sql: str,
@@ -18,7 +35,9 @@ class PostgresToS3Operator(BaseDataToS3Operator):
         post_db_path: str = None,
         records_transform_fn: callable = None,
         execution_timeout: timedelta = timedelta(minutes=5),
-        **kwargs
+        use_copy: bool = False,
+        compress: bool = False,
+        **kwargs,
     ) -> None:
         super(PostgresToS3Operator, self).__init__(
             sql=sql,
@@ -31,8 +50,69 @@ class PostgresToS3Operator(BaseDataToS3Operator):
             post_db_path=post_db_path,
             records_transform_fn=records_transform_fn,
             execution_timeout=execution_timeout,
-            **kwargs
+            **kwargs,
         )
+        assert (
+            not use_copy or output_format == OutputFormat.CSV
+        ), f"use_copy is only supported with output_format {OutputFormat.CSV}"
+        assert (
+            not use_copy or records_transform_fn is None
+        ), "records_transform_fn can not be applied when use_copy is set"
+        assert (
+            not use_copy or not self.watermark_column
+        ), "the incremental (watermark) mode is not supported when use_copy is set"
+        assert (
+            not use_copy or not self.partition_columns
+        ), "partition_columns can not be applied when use_copy is set"
+        assert not use_copy or not (
+            self.max_rows_per_file or self.max_bytes_per_file
+        ), "max_rows_per_file and max_bytes_per_file can not be applied when use_copy is set"
+        self.use_copy = use_copy
+        self.compress = compress
 
     def get_hook(self):
-        return PostgresExtendedHook()
+        return PostgresExtendedHook(pooled=self.pooled)
+
+    def execute(self, context: Any = None):
+        if not self.use_copy:
+            return super().execute(context)
+
+        start = time.perf_counter()
+        self.stats = StageStats()
+        uri = self.get_uri() + (".csv.gz" if self.compress else ".csv")
+        self.log.debug("\nExecuting the following query: %s\n", self.sql)
+        self.log.info(f"about to copy to file {uri}")
+        # compressed here rather than in smart_open, to count the compressed bytes
+        s3_file = smart_open.open(uri, "wb", compression="disable")
+        # an error terminates the upload, so no partial file is committed
+        with s3_file:
+            raw = CountingWriter(s3_file)
+            out = (
+                CountingWriter(gzip.GzipFile(fileobj=raw, mode="wb"))
+                if self.compress
+                else raw
+            )
+            copy_start = time.perf_counter()
+            rows = self.get_instrumented_hook().copy_to_file(
+                self.sql, out, include_headers=self.include_csv_headers
+            )
+            # less the time spent in the compression and S3 layers
+            fetch_seconds = time.perf_counter() - copy_start - out.seconds
+            if self.compress:
+                # writes the gzip trailer, s3_file is closed by the with
+                out.close()
+            close_start = time.perf_counter()
+        upload_seconds = raw.seconds + time.perf_counter() - close_start
+        # COPY executes, fetches and serializes on the server
+        self.stats.add("fetch", fetch_seconds, rows=rows, bytes_out=out.bytes)
+        if self.compress:
+            self.stats.add(
+                "compress",
+                out.seconds - raw.seconds,
+                rows=rows,
+                bytes_in=out.bytes,
+                bytes_out=raw.bytes,
+            )
+        self.stats.add("upload", upload_seconds, bytes_in=raw.bytes)
+        self.log.info("All done")
+        return self.report(start, rows, raw.bytes)
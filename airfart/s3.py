@@ -1,9 +1,11 @@
+from typing import Iterator, List
+
 from airfart.base_aws_hook import BaseAwsHook
 
 
 class AwsS3Hook(BaseAwsHook):
     def __init__(self) -> None:
-        super().__init__("s3")
+        super().__init__(conn_id=None, client_type="s3")
 
     def validate_key(self, bucket: str, prefix: str) -> bool:
         keys = self.get_conn().list_objects(Bucket=bucket, MaxKeys=10, Prefix=prefix)
@@ -13,3 +15,25 @@ class AwsS3Hook(BaseAwsHook):
             )
             return len(filtered_keys) > 0
         return False
+
+    def list_keys(self, bucket: str, prefix: str) -> Iterator[dict]:
+        """
+        Yields the objects (Key, Size, LastModified, ...) under the prefix
+        """
+        paginator = self.get_conn().get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            yield from page.get("Contents", [])
+
+    def list_prefixes(
+        self, bucket: str, prefix: str, delimiter: str = "/"
+    ) -> List[str]:
+        """
+        List the "sub directories" of the prefix, i.e. its common prefixes
+        """
+        paginator = self.get_conn().get_paginator("list_objects_v2")
+        prefixes = []
+        for page in paginator.paginate(
+            Bucket=bucket, Prefix=prefix, Delimiter=delimiter
+        ):
+            prefixes.extend(p["Prefix"] for p in page.get("CommonPrefixes", []))
+        return prefixes
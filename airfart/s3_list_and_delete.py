@@ -2,9 +2,8 @@ import hashlib
 import json
 import os
 from datetime import timedelta
-from typing import Callable, List, Dict, Iterable, Optional
+from typing import Callable, List, Dict, Iterable, Iterator, Optional
 
-import pendulum
 from airflow import AirflowException
 from airflow.providers.amazon.aws.hooks.glue_catalog import AwsGlueCatalogHook
 from airflow.providers.amazon.aws.hooks.s3 import S3Hook
@@ -12,7 +11,11 @@ from airflow.utils.log.logging_mixin import LoggingMixin
 from dotenv import load_dotenv
 from pendulum import DateTime
 
-from airfart.utils.chunk import chunk_fn
+from airfart.utils.listing_snapshot import ListingSnapshot
+from airfart.utils.retention import RetentionFilter
+from airfart.utils.s3_copier import ParallelS3Copier
+from airfart.utils.s3_deleter import PipelinedS3Deleter
+from airfart.utils.s3_lister import ConcurrentS3Lister
 
 
 class S3ListAndDeleteOperator(LoggingMixin):
@@ -45,6 +48,26 @@ class S3ListAndDeleteOperator(LoggingMixin):
         won't cause the table `table_to_check` in the database `database_to_check`
         loosing (some) data in all S3 prefixes under the table's location.
     :type table_to_check: str
+    :param max_list_workers: number of prefixes (and sub-prefixes of large
+        prefixes) listed concurrently
+    :type max_list_workers: int
+    :param max_delete_in_flight: number of concurrent DeleteObjects calls
+        of 1000 keys
+    :type max_delete_in_flight: int
+    :param dry_run: only count the keys that would be deleted
+    :type dry_run: bool
+    :param listing_snapshot_dir: If provided, directory (local or s3://) of the
+        listing snapshots of the prefixes. Every run then only lists the keys after
+        the last key of the previous listing (see ListingSnapshot), and removes the
+        deleted keys from the snapshots. The table location of `table_to_check` is
+        always listed live
+    :type listing_snapshot_dir: str
+    :param listing_snapshot_max_age: age after which the prefixes are listed in
+        full again, to notice the keys deleted by others
+    :type listing_snapshot_max_age: timedelta
+    :param raise_on_failure: raise once every key was attempted (and the listing
+        snapshots updated) if any key failed to delete
+    :type raise_on_failure: bool
     :param execution_timeout: max time allowed for the execution of
         this task instance, if it goes beyond it will raise and fail.
         Default is set to 5 minutes. (based on max of 1m:2s, of 309323 runs)
@@ -99,6 +122,12 @@ class S3ListAndDeleteOperator(LoggingMixin):
         delimiter: str = "",
         database_to_check: str = None,
         table_to_check: str = None,
+        max_list_workers: int = 16,
+        max_delete_in_flight: int = 8,
+        dry_run: bool = False,
+        listing_snapshot_dir: str = None,
+        listing_snapshot_max_age: timedelta = timedelta(days=7),
+        raise_on_failure: bool = True,
         *args,
         **kwargs,
     ):
@@ -111,46 +140,57 @@ class S3ListAndDeleteOperator(LoggingMixin):
         self.retention_fn = retention_fn
         self.database_to_check = database_to_check
         self.table_to_check = table_to_check
+        self.max_list_workers = max_list_workers
+        self.max_delete_in_flight = max_delete_in_flight
+        self.dry_run = dry_run
+        self.listing_snapshot_dir = listing_snapshot_dir
+        self.listing_snapshot_max_age = listing_snapshot_max_age
+        self.raise_on_failure = raise_on_failure
+        self._listing_snapshots: List[ListingSnapshot] = []
         self.hook = S3Hook()
 
     @staticmethod
-    def __keys_to_cleanup(keys, cleanup_up_to_date):
-        result = []
+    def _record(keys: Iterable[str], recorded: List[str]) -> Iterator[str]:
         for key in keys:
-            if "date" in key:
-                if "$folder$" in key:
-                    result.append(key)
-                else:
-                    d = key.split("date_")[-1].split("/")[0].split("=")[-1]
-                    if "T" in d:
-                        d = d.split("T")[0]
-                    else:
-                        if d.count("-") > 2:  # if date pattern is YYYY-MM-DD-HH24-MI
-                            d = "-".join(d.split("-")[:3])
-                    key_date = pendulum.parse(d, tz="America/New_York")
-                    if key_date <= cleanup_up_to_date:
-                        result.append(key)
-        return result
+            recorded.append(key)
+            yield key
 
     @staticmethod
-    def __table_location(database, table):
+    def __keys_to_cleanup(keys, cleanup_up_to_date) -> Iterator[str]:
+        return RetentionFilter(cleanup_up_to_date, tz="America/New_York").filter(keys)
+
+    def __table_location(self, database, table):
+        # the deletion safety check needs the current location, not a snapshot's
         glue_hook = AwsGlueCatalogHook()
         response = glue_hook.get_table(database, table)
         table_location = response["StorageDescriptor"]["Location"]
         return table_location
 
-    def __s3_prefixes_within_location(self, location, hook):
+    def __s3_prefixes_within_location(self, location):
         components = location.split("/")
         bucket = components[2]
         prefix = "/".join(components[3:])
-        keys = hook.list_keys_in_prefix_list(bucket, [prefix], self.delimiter)
+        # always a live listing: a listing snapshot misses the keys deleted (or
+        # backfilled) since, and the table could lose its last data
+        lister = ConcurrentS3Lister(
+            self.hook.get_conn(), max_workers=self.max_list_workers
+        )
+        keys = (o["Key"] for o in lister.list(bucket, [prefix], self.delimiter))
         prefixes = {"/".join(key.split("/")[:-1]) for key in keys}
         return prefixes
 
-    def chunk_delete_objects(self, bucket, keys, n=1000):
-        key_chunks = chunk_fn(keys, n)
-        for chunk in key_chunks:
-            self.delete_objects(bucket=bucket, keys=chunk)
+    def chunk_delete_objects(self, bucket, keys: Iterable[str], n=1000) -> dict:
+        """
+        delete the keys in batches of n, `max_delete_in_flight` batches at a time
+        :return: report of the deleted, failed and skipped keys, see PipelinedS3Deleter
+        """
+        deleter = PipelinedS3Deleter(
+            self.hook.get_conn(),
+            batch_size=n,
+            max_in_flight=self.max_delete_in_flight,
+            dry_run=self.dry_run,
+        )
+        return deleter.delete(bucket, keys)
 
     def get_s3_file_schema_list_columns(self, s3_file_path, bucket) -> list:
         s3_file_schema = self.read_key(key=s3_file_path, bucket_name=bucket)
@@ -183,59 +223,120 @@ class S3ListAndDeleteOperator(LoggingMixin):
         else:
             return keys[0]
 
-    def list_keys_in_prefix_list(
+    def get_listing_snapshot(self, bucket: str, prefix: str) -> ListingSnapshot:
+        name = hashlib.md5(f"{bucket}/{prefix}".encode("UTF-8")).hexdigest()
+        return ListingSnapshot(
+            self.hook.get_conn(),
+            bucket,
+            prefix,
+            f"{self.listing_snapshot_dir.rstrip('/')}/{name}.parquet",
+            max_age=self.listing_snapshot_max_age,
+            max_workers=self.max_list_workers,
+        )
+
+    def iter_objects_in_prefix_list(
         self, bucket: str, prefix_list: List[str], delimiter: str = ""
-    ) -> List[str]:
-        keys: List[str] = []
+    ) -> Iterator[dict]:
+        """
+        Stream the objects under the prefixes, listed concurrently
+        (see ConcurrentS3Lister), as soon as their listing page arrives,
+        or from their refreshed listing snapshots
+        :return: generator of dict(Key, Size, ETag, LastModified)
+        """
         assert prefix_list is not None
+        self.log.info(
+            "Listing files from bucket: %s in %s prefixes (Delimiter {%s)",
+            bucket,
+            len(prefix_list),
+            delimiter,
+        )
+        if self.listing_snapshot_dir and not delimiter:
+            return self._iter_snapshot_objects(bucket, prefix_list)
+        lister = ConcurrentS3Lister(
+            self.hook.get_conn(), max_workers=self.max_list_workers
+        )
+        return lister.list(bucket, prefix_list, delimiter)
+
+    def _iter_snapshot_objects(
+        self, bucket: str, prefix_list: List[str]
+    ) -> Iterator[dict]:
         for prefix in prefix_list:
+            snapshot = self.get_listing_snapshot(bucket, prefix)
+            self._listing_snapshots.append(snapshot)
+            yield from snapshot.refresh().objects()
+
+    def remove_from_listing_snapshots(self, keys: List[str], report: dict) -> None:
+        """
+        remove the deleted keys from the listing snapshots
+        """
+        if report["dry_run"] or not self._listing_snapshots:
+            return
+        if report["failed"] > len(report["failed_keys"]):
+            # the failed keys are not all known, the deleted keys stay in the
+            # snapshots and are deleted again (a no-op) by the next run
+            self.log.warning("not updating the listing snapshots")
+            return
+        failed = set(report["failed_keys"])
+        deleted = [key for key in keys if key not in failed]
+        for snapshot in self._listing_snapshots:
+            snapshot.remove(deleted)
+
+    def list_keys_in_prefix_list(
+        self, bucket: str, prefix_list: List[str], delimiter: str = ""
+    ) -> List[str]:
+        keys: List[str] = [
+            o["Key"]
+            for o in self.iter_objects_in_prefix_list(bucket, prefix_list, delimiter)
+        ]
+        if not keys:
             self.log.info(
-                "Listing files from bucket: %s in prefix: %s (Delimiter {%s)",
+                "No files in bucket: %s in prefixes: %s (Delimiter {%s)",
                 bucket,
-                prefix,
+                prefix_list,
                 delimiter,
             )
-
-            keys_found = self.hook.list_keys(
-                bucket_name=bucket,
-                prefix=prefix,
-                delimiter=delimiter,
-            )
-
-            if keys_found:
-                self.log.debug(
-                    "Following files listed for deletion:\n %s\nbucket: %s prefix: %s (Delimiter {%s))",
-                    keys_found,
-                    bucket,
-                    prefix,
-                    delimiter,
-                )
-                keys.extend(keys_found)
-            else:
-                self.log.info(
-                    "No files in bucket: %s in prefix: %s (Delimiter {%s)",
-                    bucket,
-                    prefix,
-                    delimiter,
-                )
-
         return keys
 
+    @staticmethod
+    def copy_dest_key(key: str, dest_prefix: str) -> str:
+        # the file name, prefixed by the md5 of its "directory"
+        key_split: List[str] = key.rsplit("/", 1)
+        filename: str = key_split[-1]
+        filename_prefix: str = hashlib.md5(key_split[0].encode("UTF-8")).hexdigest()
+        new_filename: str = "-".join([filename_prefix, filename])
+        return "/".join([dest_prefix, new_filename])
+
     def copy_keys(
         self,
         source_bucket: str,
         source_keys: List[str],
         dest_bucket: str,
         dest_prefix: str,
-    ) -> None:
+        max_workers: int = 16,
+        checkpoint: Optional[str] = None,
+        sizes: Optional[Dict[str, int]] = None,
+    ) -> dict:
+        """
+        Server-side copy of the keys to dest_prefix, renamed to
+        [md5 of the key "directory"]-[file name], see ParallelS3Copier
+
+        :param max_workers: number of objects copied concurrently
+        :param checkpoint: path or s3:// uri of the checkpoint of the copied keys,
+            to resume an interrupted copy
+        :param sizes: sizes of the source keys, if known from their listing
+        :return: report of the copy. Raises if any key failed to copy, once the
+            others were copied (and checkpointed)
+        """
         assert source_keys is not None
-        for key in source_keys:
-            key_split: List[str] = key.rsplit("/", 1)
-            filename: str = key_split[-1]
-            filename_prefix: str = hashlib.md5(key_split[0].encode("UTF-8")).hexdigest()
-            new_filename: str = "-".join([filename_prefix, filename])
-            dest_key: str = "/".join([dest_prefix, new_filename])
-            self.copy_object(key, dest_key, source_bucket, dest_bucket)
+        copier = ParallelS3Copier(
+            self.hook.get_conn(), max_workers=max_workers, checkpoint=checkpoint
+        )
+        return copier.copy(
+            source_bucket,
+            ((key, self.copy_dest_key(key, dest_prefix)) for key in source_keys),
+            dest_bucket,
+            sizes=sizes,
+        )
 
     def get_prefixes_size(self, prefixes: Iterable[list], bucket: str):
         size = 0
@@ -263,8 +364,12 @@ class S3ListAndDeleteOperator(LoggingMixin):
             self.prefix_fn(context) if self.prefix_fn else [self.prefix]
         )
 
-        keys: List[str] = self.list_keys_in_prefix_list(
-            self.bucket, prefix_list, self.delimiter
+        # keys are deleted while the listing goes on
+        keys: Iterable[str] = (
+            o["Key"]
+            for o in self.iter_objects_in_prefix_list(
+                self.bucket, prefix_list, self.delimiter
+            )
         )
 
         if self.retention_fn:
@@ -276,26 +381,42 @@ class S3ListAndDeleteOperator(LoggingMixin):
             cleanup_up_to_date = execution_date.subtract(days=self.retention.days)
             keys = self.__keys_to_cleanup(keys, cleanup_up_to_date)
 
-        if len(keys) == 0:
-            self.log.info(
-                f'No files in bucket: {self.bucket}\n prefix: {prefix_list} (Delimiter: "{self.delimiter}")'
-            )
-            return
-
         if self.database_to_check and self.table_to_check:
+            # every key to delete has to be known before deleting any
+            keys = list(keys)
             table_location = self.__table_location(
                 self.database_to_check, self.table_to_check
             )
-            table_prefixes = self.__s3_prefixes_within_location(table_location, hook)
+            table_prefixes = self.__s3_prefixes_within_location(table_location)
             prefixes_to_delete = {"/".join(key.split("/")[:-1]) for key in keys}
             intact_prefixes = table_prefixes - prefixes_to_delete
-            if intact_prefixes:
-                self.log.info(
-                    f"The following S3 prefixes are intact after the purge process: {intact_prefixes}"
+            if not intact_prefixes:
+                self.log.warning(
+                    f"Not deleting {len(keys)} keys, no S3 prefix of "
+                    f"{self.database_to_check}.{self.table_to_check} would be left"
                 )
-                hook.chunk_delete_objects(bucket=self.bucket, keys=keys)
-        else:
-            hook.chunk_delete_objects(bucket=self.bucket, keys=keys)
+                return dict(deleted=0, failed=0, skipped=len(keys))
+            self.log.info(
+                f"The following S3 prefixes are intact after the purge process: {intact_prefixes}"
+            )
+
+        listed: List[str] = []
+        if self.listing_snapshot_dir:
+            # the deleted keys are removed from the snapshots afterwards
+            keys = self._record(keys, listed)
+        report = self.chunk_delete_objects(bucket=self.bucket, keys=keys)
+        self.remove_from_listing_snapshots(listed, report)
+        if not (report["deleted"] or report["failed"] or report["skipped"]):
+            self.log.info(
+                f'No files in bucket: {self.bucket}\n prefix: {prefix_list} (Delimiter: "{self.delimiter}")'
+            )
+        if report["failed"] and self.raise_on_failure:
+            raise AirflowException(
+                f"failed to delete {report['failed']} objects from {self.bucket}, "
+                f"errors: {report['errors']}, failed keys: {report['failed_keys']}. "
+                f"report: {dict(report, failed_keys=len(report['failed_keys']))}"
+            )
+        return report
 
 
 if __name__ == "__main__":
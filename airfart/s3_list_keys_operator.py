@@ -1,5 +1,7 @@
 import boto3
-from typing import List
+from typing import List, Optional
+
+from airfart.utils.listing_snapshot import START_AFTER, ListingSnapshot
 
 
 class S3ListKeysOperator:
@@ -51,6 +53,29 @@ class S3ListKeysOperator:
         if has_results:
             return keys
 
+    def list_keys_from_snapshot(
+        self, bucket_name: str, prefix: str, snapshot_path: str, mode: str = START_AFTER
+    ) -> Optional[List[str]]:
+        """
+        Lists keys in a bucket under prefix, refreshing the listing snapshot of the
+        prefix instead of listing it again in full (see ListingSnapshot)
+
+        :param bucket_name: the name of the bucket
+        :type bucket_name: str
+        :param prefix: a key prefix
+        :type prefix: str
+        :param snapshot_path: path (local or s3://) of the listing snapshot
+        :type snapshot_path: str
+        :param mode: start_after or partitions
+        :type mode: str
+        """
+        snapshot = ListingSnapshot(
+            self.get_conn(), bucket_name, prefix, snapshot_path, mode=mode
+        )
+        keys = snapshot.refresh().keys
+        if keys:
+            return keys
+
     def list_keys_in_prefix_list(
         self, bucket: str, prefix_list: List[str], delimiter: str = ""
     ) -> List[str]:
@@ -0,0 +1,133 @@
+from collections import OrderedDict
+from typing import Callable, List
+from urllib.parse import quote
+
+from airfart.sinks.s3_sink import BaseS3Sink
+
+
+class PartitionedS3Sink(BaseS3Sink):
+    """
+    Fans the written rows out to Hive style partitions, i.e.
+    s3://bucket/database/post_db_path/date_=2021-03-08/hour=05/file_name.json.gz
+
+    Every batch is grouped by `partition_columns` and each group is written to the
+    sink of its partition. At most `max_open_writers` partition sinks are kept open,
+    the least recently used one is closed when another partition shows up.
+    A partition showing up again after its sink was closed is written to a new
+    file (file_name-00001.json.gz, ...), since S3 objects can not be appended to.
+    When aborted, the open partition sinks are aborted and the files of the closed
+    ones are deleted
+
+    :param uri: destination, without suffix (partitions are added before the file name)
+    :type uri: str
+    :param partition_columns: columns to partition by, in path order
+    :type partition_columns: List[str]
+    :param sink_factory: creates the sink of a single partition from its uri (without suffix)
+    :type sink_factory: Callable[[str], BaseS3Sink]
+    :param max_open_writers: maximum number of partition sinks open at the same time
+    :type max_open_writers: int
+    :param drop_partition_columns: whether to remove the partition columns from
+        the written rows, as their values are already part of the path
+    :type drop_partition_columns: bool
+    """
+
+    default_partition: str = "__HIVE_DEFAULT_PARTITION__"
+
+    def __init__(
+        self,
+        uri: str,
+        partition_columns: List[str],
+        sink_factory: Callable[[str], BaseS3Sink],
+        max_open_writers: int = 32,
+        drop_partition_columns: bool = True,
+    ):
+        super().__init__(uri)
+        assert partition_columns, "partition_columns should be provided"
+        self.partition_columns = list(partition_columns)
+        self.sink_factory = sink_factory
+        self.max_open_writers = max_open_writers
+        self.drop_partition_columns = drop_partition_columns
+        self.partitions: List[dict] = []
+        self._bytes: int = 0
+        self._sinks: OrderedDict = OrderedDict()
+        self._closed_sinks: List[BaseS3Sink] = []
+        # number of files written per partition
+        self._files: dict = dict()
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes + sum(sink.bytes for sink in self._sinks.values())
+
+    def _partition_path(self, values: tuple) -> str:
+        return "/".join(
+            f"{column}="
+            + (self.default_partition if value is None else quote(str(value), " "))
+            for column, value in zip(self.partition_columns, values)
+        )
+
+    def _close_sink(self, values: tuple) -> None:
+        sink = self._sinks.pop(values)
+        sink.close()
+        self._closed_sinks.append(sink)
+        self._bytes += sink.bytes
+        self.partitions.append(dict(uri=sink.uri, rows=sink.rows, bytes=sink.bytes))
+
+    def _get_sink(self, values: tuple) -> BaseS3Sink:
+        if values in self._sinks:
+            self._sinks.move_to_end(values)
+            return self._sinks[values]
+        if len(self._sinks) >= self.max_open_writers:
+            self._close_sink(next(iter(self._sinks)))
+        prefix, file_name = self.uri.rsplit("/", 1)
+        files = self._files.get(values, 0)
+        if files:
+            file_name = f"{file_name}-{files:05d}"
+        self._files[values] = files + 1
+        sink = self.sink_factory(f"{prefix}/{self._partition_path(values)}/{file_name}")
+        self._sinks[values] = sink
+        return sink
+
+    def write(self, df) -> None:
+        import pandas as pd
+
+        if df.empty:
+            return
+        for values, group in df.groupby(
+            self.partition_columns, sort=False, dropna=False
+        ):
+            if not isinstance(values, tuple):
+                values = (values,)
+            # NaN / NaT / NA partition values
+            values = tuple(None if pd.isna(v) else v for v in values)
+            if self.drop_partition_columns:
+                group = group.drop(columns=self.partition_columns)
+            self._get_sink(values).write(group)
+            self.rows += len(group)
+
+    def _write(self, df) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        try:
+            while self._sinks:
+                self._close_sink(next(iter(self._sinks)))
+        except Exception:
+            self.abort()
+            raise
+
+    def abort(self) -> None:
+        while self._sinks:
+            _, sink = self._sinks.popitem(last=False)
+            sink.abort()
+        if self._closed_sinks:
+            self.log.warning(
+                f"aborted, deleting the {len(self._closed_sinks)} written partition files"
+            )
+        for sink in self._closed_sinks:
+            try:
+                sink.remove()
+            except Exception as err:
+                self.log.warning(f"failed to delete {sink.uri}: {err}")
+        self._closed_sinks = []
+        self.partitions = []
+        self._bytes = 0
@@ -0,0 +1,183 @@
+import json
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import smart_open
+
+from airfart.sinks.s3_sink import BaseS3Sink, remove_file
+
+
+class RollingS3Sink(BaseS3Sink):
+    """
+    Splits the written rows into numbered part files
+    (file_name-00000.json.gz, file_name-00001.json.gz, ...), starting a new part
+    once `max_rows` rows or `max_bytes` compressed bytes were written to the current one.
+
+    Finished parts are closed (their upload completed) in the background while
+    the next part is being written. On close, a manifest listing every part with its
+    row count and size is written next to the parts (_file_name.manifest.json, the
+    leading underscore keeps Athena / Hive from reading it as data). The parts of the
+    previous manifest that were not rewritten, i.e. when a rerun writes fewer parts,
+    are deleted before the new manifest is written.
+    When aborted, the part being written is terminated, the complete parts are
+    deleted and no manifest is written
+
+    :param uri: destination, without part number and suffix
+    :type uri: str
+    :param sink_factory: creates the sink of a single part from its uri (without suffix)
+    :type sink_factory: Callable[[str], BaseS3Sink]
+    :param max_rows: maximum number of rows per part
+    :type max_rows: int
+    :param max_bytes: target compressed size per part. checked after every write,
+        so a part may exceed it by up to one batch
+    :type max_bytes: int
+    :param write_manifest: whether to write the manifest. without it, the stale parts
+        of a previous run are not deleted
+    :type write_manifest: bool
+    """
+
+    manifest_suffix: str = ".manifest.json"
+
+    def __init__(
+        self,
+        uri: str,
+        sink_factory: Callable[[str], BaseS3Sink],
+        max_rows: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        write_manifest: bool = True,
+    ):
+        super().__init__(uri)
+        assert max_rows or max_bytes, "either max_rows or max_bytes should be provided"
+        self.sink_factory = sink_factory
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.write_manifest = write_manifest
+        self.parts: List[dict] = []
+        self._bytes: int = 0
+        self._sink: Optional[BaseS3Sink] = None
+        self._closing: List[Tuple[BaseS3Sink, Future]] = []
+        self._executor: Optional[ThreadPoolExecutor] = ThreadPoolExecutor(max_workers=1)
+        self._manifest_written: bool = False
+
+    @property
+    def manifest_uri(self) -> str:
+        prefix, _, file_name = self.uri.rpartition("/")
+        return f"{prefix}/_{file_name}{self.manifest_suffix}"
+
+    def _read_manifest(self) -> Optional[dict]:
+        try:
+            with smart_open.open(self.manifest_uri, "r") as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes + (self._sink.bytes if self._sink else 0)
+
+    def _roll(self) -> None:
+        if self._sink is not None:
+            self._closing.append((self._sink, self._executor.submit(self._sink.close)))
+            self._sink = None
+
+    def write(self, df) -> None:
+        offset = 0
+        while offset < len(df):
+            if self._sink is None:
+                part_uri = f"{self.uri}-{len(self.parts) + len(self._closing):05d}"
+                self._sink = self.sink_factory(part_uri)
+            batch = (
+                df.iloc[offset : offset + self.max_rows - self._sink.rows]
+                if self.max_rows
+                else df
+            )
+            self._sink.write(batch)
+            offset += len(batch)
+            self.rows += len(batch)
+            if (self.max_rows and self._sink.rows >= self.max_rows) or (
+                self.max_bytes and self._sink.bytes >= self.max_bytes
+            ):
+                self._roll()
+            self._collect()
+
+    def _write(self, df) -> None:
+        raise NotImplementedError
+
+    def _collect(self, wait: bool = False) -> None:
+        """
+        record the parts whose upload has completed
+        """
+        pending = []
+        for sink, future in self._closing:
+            if wait or future.done():
+                future.result()
+                self._bytes += sink.bytes
+                self.parts.append(dict(uri=sink.uri, rows=sink.rows, bytes=sink.bytes))
+            else:
+                pending.append((sink, future))
+        self._closing = pending
+
+    def close(self) -> None:
+        if self._executor is None:
+            return
+        try:
+            self._roll()
+            self._collect(wait=True)
+        except Exception:
+            self.abort()
+            raise
+        self._executor.shutdown()
+        self._executor = None
+        self.parts.sort(key=lambda p: p["uri"])
+        if not self.write_manifest:
+            return
+        previous = self._read_manifest()
+        if previous:
+            written = {part["uri"] for part in self.parts}
+            stale = [p["uri"] for p in previous["parts"] if p["uri"] not in written]
+            if stale:
+                self.log.info(f"deleting {len(stale)} parts of the previous run")
+            for uri in stale:
+                remove_file(uri)
+        if self.parts:
+            manifest = dict(rows=self.rows, bytes=self._bytes, parts=self.parts)
+            with smart_open.open(self.manifest_uri, "wb") as f:
+                f.write(json.dumps(manifest).encode("utf8"))
+            self._manifest_written = True
+            self.log.info(
+                f"wrote {len(self.parts)} parts, manifest {self.manifest_uri}"
+            )
+        elif previous:
+            remove_file(self.manifest_uri)
+
+    def abort(self) -> None:
+        if self._executor is None:
+            return
+        if self._sink is not None:
+            self._sink.abort()
+            self._sink = None
+        # parts already being closed complete their upload, then are deleted
+        for sink, future in self._closing:
+            try:
+                future.result()
+                self.parts.append(dict(uri=sink.uri, rows=sink.rows, bytes=sink.bytes))
+            except Exception as err:
+                self.log.warning(f"failed to upload part {sink.uri}: {err}")
+        self._closing = []
+        self._executor.shutdown()
+        self._executor = None
+        if self.parts:
+            self.log.warning(f"aborted, deleting the {len(self.parts)} written parts")
+        self.remove()
+
+    def remove(self) -> None:
+        for part in self.parts:
+            try:
+                remove_file(part["uri"])
+            except Exception as err:
+                self.log.warning(f"failed to delete part {part['uri']}: {err}")
+        if self._manifest_written:
+            remove_file(self.manifest_uri)
+            self._manifest_written = False
+        self.parts = []
+        self._bytes = 0
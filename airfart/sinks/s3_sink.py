@@ -0,0 +1,472 @@
+import gzip
+import os
+import time
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+import boto3
+import smart_open
+from airflow.utils.log.logging_mixin import LoggingMixin
+
+from airfart.model.output_format import OutputFormat
+from airfart.utils.ndjson import datetimes_to_str, encode_df, encode_records
+from airfart.utils.stage_stats import StageStats
+
+
+class CountingWriter(object):
+    """
+    Counts the bytes written through to the wrapped (binary) file object,
+    and the time spent writing them. When `file_obj` writes to another
+    CountingWriter (`wrapped`, i.e. under a GzipFile, which does not close the
+    file object it wraps), closing closes both, within the measured time
+    """
+
+    def __init__(self, file_obj, wrapped: Optional["CountingWriter"] = None):
+        self._file_obj = file_obj
+        self._wrapped = wrapped
+        self.bytes: int = 0
+        self.seconds: float = 0.0
+        self._terminated: bool = False
+
+    def write(self, data) -> int:
+        if self._terminated:
+            # the layers above a terminated upload may still flush into it
+            return len(data)
+        start = time.perf_counter()
+        self.bytes += len(data)
+        written = self._file_obj.write(data)
+        self.seconds += time.perf_counter() - start
+        return written
+
+    def tell(self) -> int:
+        return self.bytes
+
+    def flush(self) -> None:
+        self._file_obj.flush()
+
+    @property
+    def closed(self) -> bool:
+        return self._terminated or self._file_obj.closed
+
+    def close(self) -> None:
+        if self._terminated:
+            return
+        start = time.perf_counter()
+        self._file_obj.close()
+        if self._wrapped is not None and not self._wrapped.closed:
+            self._wrapped.close()
+        self.seconds += time.perf_counter() - start
+
+    def terminate(self) -> None:
+        """
+        abort the upload of a smart_open S3 writer instead of completing it,
+        so no (partial) object is committed. Other files are just closed
+        """
+        self._terminated = True
+        terminate = getattr(self._file_obj, "terminate", None)
+        if terminate is not None:
+            terminate()
+        elif not self._file_obj.closed:
+            self._file_obj.close()
+
+
+class BaseS3Sink(LoggingMixin, ABC):
+    """
+    Writes pandas dataframes to a single S3 object as they arrive.
+
+    The S3 object is opened lazily on the first non-empty batch, so an empty
+    result set does not produce an empty file.
+
+    :param uri: destination, i.e. s3://bucket/database/post_db_path/file_name.json.gz
+    :type uri: str
+    :param records_transform_fn: optional transformation applied to the written data
+    :type records_transform_fn: callable
+
+    When `stats` is set, the time spent in every write is split into serialize,
+    compress (.gz only) and upload stages, based on the time spent in the
+    compression and S3 file layers.
+
+    Used as a context manager, the sink is closed when the block succeeds and
+    aborted when it raises: the upload is terminated, as smart_open does, so a
+    failed export does not commit a truncated object
+    """
+
+    suffix: str = ""
+    log = LoggingMixin.log
+
+    def __init__(self, uri: str, records_transform_fn: callable = None):
+        super().__init__()
+        self.uri = uri
+        self.records_transform_fn = records_transform_fn
+        self.rows: int = 0
+        self._file = None
+        self._raw: Optional[CountingWriter] = None
+        self.stats: Optional[StageStats] = None
+
+    @property
+    def bytes(self) -> int:
+        """
+        number of (compressed) bytes written to S3 so far
+        """
+        return self._raw.bytes if self._raw else 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def _open(self):
+        self.log.info(f"about to write to file {self.uri}")
+        # compress here rather than in smart_open, to count the compressed bytes
+        self._raw = CountingWriter(
+            smart_open.open(self.uri, "wb", compression="disable")
+        )
+        if self.uri.endswith(".gz"):
+            return CountingWriter(
+                gzip.GzipFile(fileobj=self._raw, mode="wb"), wrapped=self._raw
+            )
+        return self._raw
+
+    def _timed(self, fn, rows: int = 0) -> None:
+        """
+        call fn, recording the time spent in it per stage
+        """
+        if not self.stats:
+            fn()
+            return
+        file_seconds, file_bytes = self._file.seconds, self._file.bytes
+        raw_seconds, raw_bytes = self._raw.seconds, self._raw.bytes
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        file_seconds = self._file.seconds - file_seconds
+        file_bytes = self._file.bytes - file_bytes
+        raw_seconds = self._raw.seconds - raw_seconds
+        raw_bytes = self._raw.bytes - raw_bytes
+        self.stats.add(
+            "serialize", elapsed - file_seconds, rows=rows, bytes_out=file_bytes
+        )
+        if self._file is not self._raw:
+            self.stats.add(
+                "compress",
+                file_seconds - raw_seconds,
+                rows=rows,
+                bytes_in=file_bytes,
+                bytes_out=raw_bytes,
+            )
+        self.stats.add("upload", raw_seconds, bytes_in=raw_bytes)
+
+    def write(self, df) -> None:
+        """
+        write a batch of rows to the sink
+        :param df: pandas dataframe
+        """
+        if df.empty:
+            return
+        if self._file is None:
+            self._file = self._open()
+        self._timed(lambda: self._write(df), rows=len(df))
+        self.rows += len(df)
+
+    @abstractmethod
+    def _write(self, df) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        if self._file is not None:
+            try:
+                self._timed(self._close_file)
+            except Exception:
+                self.abort()
+                raise
+            self._file = None
+
+    def _close_file(self) -> None:
+        # closes the S3 file (completing its upload) too, within the timed close
+        self._file.close()
+
+    def abort(self) -> None:
+        """
+        discard the file being written: its upload is terminated rather than
+        completed, so nothing is committed to S3
+        """
+        if self._file is None:
+            return
+        try:
+            self._raw.terminate()
+            self._discard_file()
+        except Exception as err:
+            self.log.warning(f"failed to abort the upload of {self.uri}: {err}")
+        self._file = None
+        self.log.warning(f"aborted the upload of {self.uri}")
+
+    def remove(self) -> None:
+        """
+        delete the file committed by the sink, i.e. a complete part of an aborted export
+        """
+        if self.rows:
+            remove_file(self.uri)
+
+    def _discard_file(self) -> None:
+        # the layers above the terminated S3 file only release their resources
+        if self._file is not self._raw:
+            self._file.close()
+
+
+class JsonS3Sink(BaseS3Sink):
+    suffix = ".json.gz"
+
+    def _write(self, df) -> None:
+        # every batch is serialized to a single buffer
+        if self.records_transform_fn:
+            records = datetimes_to_str(df).to_dict(orient="records")
+            self._file.write(encode_records(map(self.records_transform_fn, records)))
+        else:
+            self._file.write(encode_df(df))
+
+
+class CsvS3Sink(BaseS3Sink):
+    suffix = ".csv"
+
+    def __init__(
+        self,
+        uri: str,
+        records_transform_fn: callable = None,
+        include_csv_headers: bool = True,
+    ):
+        super().__init__(uri, records_transform_fn)
+        self.include_csv_headers = include_csv_headers
+
+    def _write(self, df) -> None:
+        # headers are written once, with the first batch
+        header = self.include_csv_headers and self.rows == 0
+        lines = df.to_csv(index=False, header=header).split("\n")
+        for line in lines:
+            if not line:
+                continue
+            line_to_write = (
+                self.records_transform_fn(line) if self.records_transform_fn else line
+            )
+            self._file.write(f"{line_to_write}\n".encode("utf8"))
+
+
+class ParquetS3Sink(BaseS3Sink):
+    """
+    Appends every batch to a single parquet file through an incremental
+    pyarrow writer. The schema is inferred from the first batches, unless provided:
+    the writer is only opened once every column holds a non-null value, or once
+    `null_type_rows` rows were buffered, the columns still only holding nulls
+    then being written as strings.
+
+    Batches are buffered until `row_group_size` rows are available and then
+    written as one row group, so memory is bounded by the row group size and
+    the resulting file can be split and pruned by Athena per row group.
+
+    :param row_group_size: number of rows per row group. If not provided,
+        every incoming batch is written as its own row group
+    :type row_group_size: int
+    :param compression: parquet compression codec (snappy, gzip, zstd, ...)
+    :type compression: str
+    :param dictionary_columns: columns to dictionary-encode.
+        If not provided, all columns are dictionary-encoded (pyarrow default)
+    :type dictionary_columns: List[str]
+    :param schema: pyarrow schema every batch is converted to, i.e. from
+        airfart.model.arrow_schema.to_arrow_schema. Columns missing from the
+        schema are not written
+    :type schema: pyarrow.Schema
+    """
+
+    suffix = ".parquet"
+    # rows buffered, at most, to infer the type of the columns only holding nulls
+    null_type_rows: int = 100000
+
+    def __init__(
+        self,
+        uri: str,
+        records_transform_fn: callable = None,
+        row_group_size: Optional[int] = None,
+        compression: str = "snappy",
+        dictionary_columns: Optional[List[str]] = None,
+        schema=None,
+    ):
+        super().__init__(uri, records_transform_fn)
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.dictionary_columns = dictionary_columns
+        self.row_groups: int = 0
+        self._writer = None
+        self._schema = schema
+        self._buffer: list = []
+        self._buffered_rows: int = 0
+        # the tables written before the writer is opened
+        self._pending: list = []
+        self._pending_rows: int = 0
+        self._string_columns: List[str] = []
+
+    def _write(self, df) -> None:
+        import pyarrow as pa
+
+        if self.records_transform_fn:
+            df = self.records_transform_fn(df)
+        if self._string_columns:
+            df = df.copy()
+            for column in self._string_columns:
+                df[column] = df[column].map(_to_str)
+        table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+        if self._writer is not None:
+            self._append(table)
+            return
+        self._pending.append(table)
+        self._pending_rows += table.num_rows
+        if (
+            self._schema is None
+            and self._null_fields(self._inferred_schema(self._pending))
+            and self._pending_rows < self.null_type_rows
+        ):
+            return
+        self._open_writer()
+
+    @staticmethod
+    def _null_fields(schema) -> List[str]:
+        import pyarrow as pa
+
+        return [f.name for f in schema if pa.types.is_null(f.type)]
+
+    def _inferred_schema(self, tables: list):
+        """
+        the schema of the first table, with the type of its null columns
+        taken from the first table where they hold values
+        """
+        import pyarrow as pa
+
+        schema = tables[0].schema
+        for name in self._null_fields(schema):
+            for table in tables[1:]:
+                field = table.schema.field(name)
+                if not pa.types.is_null(field.type):
+                    schema = schema.set(schema.get_field_index(name), field)
+                    break
+        return schema
+
+    def _open_writer(self) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        tables, self._pending = self._pending, []
+        if self._schema is None:
+            schema = self._inferred_schema(tables)
+            self._string_columns = self._null_fields(schema)
+            if self._string_columns:
+                self.log.warning(
+                    f"{self._string_columns} only hold nulls in the first "
+                    f"{self._pending_rows} rows, written as strings"
+                )
+                for name in self._string_columns:
+                    schema = schema.set(
+                        schema.get_field_index(name), pa.field(name, pa.string())
+                    )
+            tables = [table.cast(schema) for table in tables]
+            self._schema = schema
+        self._pending_rows = 0
+        self._writer = pq.ParquetWriter(
+            self._file,
+            self._schema,
+            compression=self.compression,
+            use_dictionary=self.dictionary_columns or True,
+            allow_truncated_timestamps=True,
+        )
+        for table in tables:
+            self._append(table)
+
+    def _append(self, table) -> None:
+        if not self.row_group_size:
+            self._write_row_group(table)
+            return
+        self._buffer.append(table)
+        self._buffered_rows += table.num_rows
+        while self._buffered_rows >= self.row_group_size:
+            self._flush(self.row_group_size)
+
+    def _write_row_group(self, table) -> None:
+        self._writer.write_table(table, row_group_size=table.num_rows)
+        self.row_groups += 1
+
+    def _flush(self, num_rows: int) -> None:
+        import pyarrow as pa
+
+        buffered = pa.concat_tables(self._buffer)
+        self._write_row_group(buffered.slice(0, num_rows))
+        remainder = buffered.slice(num_rows)
+        self._buffer = [remainder] if remainder.num_rows else []
+        self._buffered_rows = remainder.num_rows
+
+    def _close_file(self) -> None:
+        if self._writer is None and self._pending:
+            self._open_writer()
+        if self._writer is not None:
+            if self._buffered_rows:
+                self._flush(self._buffered_rows)
+            self._writer.close()
+            self._writer = None
+        super()._close_file()
+
+    def _discard_file(self) -> None:
+        self._buffer = []
+        self._buffered_rows = 0
+        self._pending = []
+        self._pending_rows = 0
+        if self._writer is not None:
+            writer, self._writer = self._writer, None
+            writer.close()
+        super()._discard_file()
+
+
+def _to_str(value) -> Optional[str]:
+    # keeps the nulls (None, NaN, NaT, pd.NA) of a column written as strings
+    try:
+        if value is None or value != value:
+            return None
+    except TypeError:
+        return None
+    return str(value)
+
+
+def remove_file(uri: str) -> None:
+    """
+    delete a file written by a sink, i.e. a complete part of an aborted export
+    """
+    if uri.startswith("s3://"):
+        bucket, key = uri[len("s3://") :].split("/", 1)
+        boto3.client("s3").delete_object(Bucket=bucket, Key=key)
+    elif os.path.exists(uri):
+        os.remove(uri)
+
+
+def get_sink(
+    output_format: str,
+    uri: str,
+    records_transform_fn: callable = None,
+    include_csv_headers: bool = True,
+    **parquet_options,
+) -> BaseS3Sink:
+    """
+    build the sink matching `output_format`
+    :param output_format: one of OutputFormat
+    :param uri: destination uri, without suffix
+    :param parquet_options: row_group_size, compression, dictionary_columns and schema
+        passed to the ParquetS3Sink
+    """
+    if output_format == OutputFormat.JSON:
+        return JsonS3Sink(uri + JsonS3Sink.suffix, records_transform_fn)
+    elif output_format == OutputFormat.CSV:
+        return CsvS3Sink(
+            uri + CsvS3Sink.suffix, records_transform_fn, include_csv_headers
+        )
+    # OutputFormat.PARQUET
+    return ParquetS3Sink(
+        uri + ParquetS3Sink.suffix, records_transform_fn, **parquet_options
+    )
@@ -0,0 +1,308 @@
+import bisect
+import datetime
+import json
+import os
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import smart_open
+from airflow.utils.log.logging_mixin import LoggingMixin
+
+from airfart.utils.s3_lister import ConcurrentS3Lister
+
+# key -> (size, etag, last modified)
+Objects = Dict[str, Tuple[int, Optional[str], datetime.datetime]]
+
+START_AFTER = "start_after"
+PARTITIONS = "partitions"
+
+_METADATA_KEY = b"listing_snapshot"
+
+
+class ListingIndex(object):
+    """
+    In-memory index of the objects of a listing, sorted by key
+    """
+
+    def __init__(self, objects: Objects):
+        self._objects = objects
+        self.keys: List[str] = sorted(objects)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._objects
+
+    def _object(self, key: str) -> dict:
+        size, etag, last_modified = self._objects[key]
+        return dict(Key=key, Size=size, ETag=etag, LastModified=last_modified)
+
+    def get(self, key: str) -> Optional[dict]:
+        return self._object(key) if key in self._objects else None
+
+    def _range(self, prefix: str) -> Tuple[int, int]:
+        return (
+            bisect.bisect_left(self.keys, prefix),
+            bisect.bisect_left(self.keys, prefix + "\U0010ffff"),
+        )
+
+    def keys_under(self, prefix: str = "") -> List[str]:
+        start, end = self._range(prefix)
+        return self.keys[start:end]
+
+    def objects(self, prefix: str = "") -> Iterator[dict]:
+        """
+        :return: generator of dict(Key, Size, ETag, LastModified), sorted by key
+        """
+        return (self._object(key) for key in self.keys_under(prefix))
+
+    def size(self, prefix: str = "") -> int:
+        return sum(self._objects[key][0] for key in self.keys_under(prefix))
+
+
+class ListingSnapshot(LoggingMixin):
+    """
+    The listing of an S3 prefix, kept between runs in a Parquet file
+    (key, size, etag, last_modified) - local or on S3 - and refreshed incrementally:
+
+    - `start_after` lists only the keys after the last key of the snapshot
+      (ListObjectsV2 StartAfter). For append-only layouts whose new keys sort
+      last, i.e. date_=YYYY-MM-DD/hour=HH partitions. Deleted keys are not noticed
+    - `partitions` lists the sub-prefixes of the prefix ("sub directories",
+      i.e. date_=2021-03-08/), and only lists again the new ones and the
+      `refresh_last` newest known ones. Dropped sub-prefixes are removed from the
+      snapshot, so are the objects removed from the refreshed ones
+
+    Without a snapshot, when the snapshot is of another prefix, or once the last full
+    listing is older than `max_age`, the prefix is listed in full (concurrently,
+    see ConcurrentS3Lister). Call `remove` with the keys deleted by the caller.
+
+    :param client: boto3 s3 client
+    :param bucket: S3 bucket
+    :type bucket: str
+    :param prefix: S3 prefix
+    :type prefix: str
+    :param path: path or s3:// uri of the Parquet snapshot
+    :type path: str
+    :param mode: start_after or partitions
+    :type mode: str
+    :param refresh_last: number of newest known sub-prefixes listed again (partitions)
+    :type refresh_last: int
+    :param max_age: age after which the prefix is listed in full again
+    :type max_age: datetime.timedelta
+    :param max_workers: number of concurrent listings
+    :type max_workers: int
+    """
+
+    log = LoggingMixin.log
+    __ALLOWED_MODES = [START_AFTER, PARTITIONS]
+
+    def __init__(
+        self,
+        client,
+        bucket: str,
+        prefix: str,
+        path: str,
+        mode: str = START_AFTER,
+        refresh_last: int = 1,
+        max_age: Optional[datetime.timedelta] = None,
+        max_workers: int = 16,
+    ):
+        super().__init__()
+        assert (
+            mode in self.__ALLOWED_MODES
+        ), f"mode should be either {START_AFTER} or {PARTITIONS}! "
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.path = path
+        self.mode = mode
+        self.refresh_last = refresh_last
+        self.max_age = max_age
+        self.max_workers = max_workers
+        self.index: Optional[ListingIndex] = None
+        # objects listed from S3 by the last refresh
+        self.listed: int = 0
+        self._full_listed_at: Optional[str] = None
+
+    @staticmethod
+    def _now() -> datetime.datetime:
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    def load(self) -> Optional[Tuple[Objects, dict]]:
+        """
+        :return: the objects and the metadata of the stored snapshot, if any
+        """
+        import pyarrow.parquet as pq
+
+        try:
+            with smart_open.open(self.path, "rb") as f:
+                table = pq.read_table(f)
+        except (IOError, OSError, ValueError):
+            return None
+        metadata = json.loads((table.schema.metadata or {}).get(_METADATA_KEY, "{}"))
+        objects = dict(
+            zip(
+                table.column("key").to_pylist(),
+                zip(
+                    table.column("size").to_pylist(),
+                    table.column("etag").to_pylist(),
+                    table.column("last_modified").to_pylist(),
+                ),
+            )
+        )
+        return objects, metadata
+
+    def save(self) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        index = self.index
+        objects = [index._objects[key] for key in index.keys]
+        table = pa.table(
+            {
+                "key": pa.array(index.keys, pa.string()),
+                "size": pa.array([o[0] for o in objects], pa.int64()),
+                "etag": pa.array([o[1] for o in objects], pa.string()),
+                "last_modified": pa.array(
+                    [o[2] for o in objects], pa.timestamp("ms", tz="UTC")
+                ),
+            }
+        )
+        metadata = dict(
+            bucket=self.bucket,
+            prefix=self.prefix,
+            mode=self.mode,
+            listed_at=self._now().isoformat(),
+            full_listed_at=self._full_listed_at,
+        )
+        table = table.replace_schema_metadata({_METADATA_KEY: json.dumps(metadata)})
+        if self.path.startswith("s3://"):
+            with smart_open.open(self.path, "wb") as f:
+                pq.write_table(table, f, compression="zstd")
+            return
+        # replaced once complete, a failed run keeps the previous snapshot
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        pq.write_table(table, tmp_path, compression="zstd")
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _entry(o: dict) -> tuple:
+        return o["Size"], o.get("ETag"), o["LastModified"]
+
+    def _list_full(self) -> Objects:
+        lister = ConcurrentS3Lister(self.client, max_workers=self.max_workers)
+        return {
+            o["Key"]: self._entry(o) for o in lister.list(self.bucket, [self.prefix])
+        }
+
+    def _list_after(self, objects: Objects, last_key: Optional[str]) -> int:
+        kwargs = dict(Bucket=self.bucket, Prefix=self.prefix)
+        if last_key:
+            kwargs["StartAfter"] = last_key
+        listed = 0
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(**kwargs):
+            for o in page.get("Contents", []):
+                objects[o["Key"]] = self._entry(o)
+                listed += 1
+        return listed
+
+    def _sub_prefix(self, key: str) -> Optional[str]:
+        separator = key.find("/", len(self.prefix))
+        return key[: separator + 1] if separator >= 0 else None
+
+    def _list_partitions(self, objects: Objects, keys: List[str]) -> int:
+        # the sub-prefixes of the snapshot, from its sorted keys
+        known = dict()
+        for key in keys:
+            sub_prefix = self._sub_prefix(key)
+            known[sub_prefix] = known.get(sub_prefix, 0) + 1
+        direct, current = [], []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(
+            Bucket=self.bucket, Prefix=self.prefix, Delimiter="/"
+        ):
+            direct.extend(page.get("Contents", []))
+            current.extend(p["Prefix"] for p in page.get("CommonPrefixes", []))
+        current_set = set(current)
+        newest = sorted(p for p in current if p in known)[-self.refresh_last :]
+        if not self.refresh_last:
+            newest = []
+        refreshed = set(p for p in current if p not in known) | set(newest)
+        # dropped sub-prefixes, refreshed ones and direct objects are replaced
+        dropped = {p for p in known if p is not None and p not in current_set}
+        for key in keys:
+            sub_prefix = self._sub_prefix(key)
+            if sub_prefix is None or sub_prefix in refreshed or sub_prefix in dropped:
+                del objects[key]
+        for o in direct:
+            objects[o["Key"]] = self._entry(o)
+        listed = len(direct)
+        if refreshed:
+            lister = ConcurrentS3Lister(self.client, max_workers=self.max_workers)
+            for o in lister.list(self.bucket, sorted(refreshed)):
+                objects[o["Key"]] = self._entry(o)
+                listed += 1
+        self.log.info(
+            f"listed {len(refreshed)} of {len(current)} sub-prefixes of "
+            f"s3://{self.bucket}/{self.prefix}, {len(dropped)} dropped"
+        )
+        return listed
+
+    def _is_stale(self, metadata: dict) -> bool:
+        if (
+            metadata.get("bucket") != self.bucket
+            or metadata.get("prefix") != self.prefix
+        ):
+            return True
+        full_listed_at = metadata.get("full_listed_at")
+        if not full_listed_at:
+            return True
+        if self.max_age is None:
+            return False
+        age = self._now() - datetime.datetime.fromisoformat(full_listed_at)
+        return age > self.max_age
+
+    def refresh(self) -> ListingIndex:
+        """
+        update the snapshot from S3 and store it
+        :return: the index of the current listing
+        """
+        start = time.monotonic()
+        loaded = self.load()
+        if loaded is None or self._is_stale(loaded[1]):
+            objects = self._list_full()
+            self.listed = len(objects)
+            self._full_listed_at = self._now().isoformat()
+            how = "in full"
+        else:
+            objects, metadata = loaded
+            self._full_listed_at = metadata["full_listed_at"]
+            keys = sorted(objects)
+            if self.mode == START_AFTER:
+                self.listed = self._list_after(objects, keys[-1] if keys else None)
+            else:
+                self.listed = self._list_partitions(objects, keys)
+            how = f"incrementally ({self.mode})"
+        self.index = ListingIndex(objects)
+        self.save()
+        self.log.info(
+            f"listed s3://{self.bucket}/{self.prefix} {how}: {self.listed} objects "
+            f"listed, {len(self.index)} in the snapshot, "
+            f"in {time.monotonic() - start:.1f}s"
+        )
+        return self.index
+
+    def remove(self, keys: Iterable[str]) -> None:
+        """
+        remove deleted keys from the snapshot, and store it
+        """
+        assert self.index is not None, "refresh the snapshot first"
+        objects = self.index._objects
+        for key in keys:
+            objects.pop(key, None)
+        self.index = ListingIndex(objects)
+        self.save()
@@ -0,0 +1,170 @@
+import datetime
+import json
+from decimal import Decimal
+from typing import Any, Iterable
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(o: Any) -> Any:
+    # str() keeps the "YYYY-MM-DD HH:MM:SS" format pandas' astype(str) produces
+    if isinstance(o, (datetime.datetime, datetime.date, datetime.time)):
+        return str(o)
+    # the exact digits, a float would round DECIMAL(38, x) values
+    if isinstance(o, Decimal):
+        return str(o)
+    # numpy scalars
+    if hasattr(o, "item"):
+        return o.item()
+    # slotted models, i.e. TableDef
+    if hasattr(o, "to_dict"):
+        return o.to_dict()
+    return o.__dict__
+
+
+def _json_dumps(data: Any) -> bytes:
+    """serialize a single document"""
+    return json.dumps(data, default=_default).encode("utf8")
+
+
+def _json_encode_records(records: Iterable[Any]) -> bytes:
+    """
+    serialize records to a single newline-delimited JSON buffer, skipping empty records
+    """
+    encoder = json.JSONEncoder(default=_default)
+    return "".join(
+        encoder.encode(record) + "\n" for record in records if record
+    ).encode("utf8")
+
+
+def _orjson_dumps(data: Any) -> bytes:
+    """serialize a single document"""
+    return orjson.dumps(data, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+def _orjson_encode_records(records: Iterable[Any]) -> bytes:
+    """
+    serialize records to a single newline-delimited JSON buffer, skipping empty records
+    """
+    option = (
+        orjson.OPT_APPEND_NEWLINE
+        | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_SERIALIZE_NUMPY
+        | orjson.OPT_NON_STR_KEYS
+    )
+    return b"".join(
+        orjson.dumps(record, default=_default, option=option)
+        for record in records
+        if record
+    )
+
+
+# the most digits pandas' to_json writes, counted after the decimal point
+_DOUBLE_PRECISION = 15
+
+
+def _pandas_encode_df(df) -> bytes:
+    # pandas' columnar (ujson based) encoder, faster than any per-record encoder
+    # since it skips building a python dict per row
+    buffer = df.to_json(
+        orient="records",
+        lines=True,
+        force_ascii=False,
+        default_handler=_default,
+        double_precision=_DOUBLE_PRECISION,
+    )
+    return (buffer.rstrip("\n") + "\n").encode("utf8") if buffer else b""
+
+
+def _floats_round_trip(df) -> bool:
+    """
+    whether pandas' to_json writes every float of the dataframe without rounding
+    """
+    import numpy as np
+
+    columns = df.select_dtypes(include=["floating"]).columns
+    if not len(columns):
+        return True
+    values = df[columns].to_numpy(dtype="float64")
+    encoded = df[columns].to_json(orient="values", double_precision=_DOUBLE_PRECISION)
+    decoded = np.array(json.loads(encoded), dtype="float64").reshape(values.shape)
+    return np.array_equal(values, decoded, equal_nan=True)
+
+
+# orjson is an optional dependency, used when installed
+dumps = _orjson_dumps if orjson else _json_dumps
+encode_records = _orjson_encode_records if orjson else _json_encode_records
+
+
+def _format_datetimes(values):
+    # the per-value str() format, "YYYY-MM-DD HH:MM:SS[.ffffff][+HH:MM]", so a
+    # column reads the same in every batch; astype(str) drops the time part
+    # when all values of a batch are at midnight. NaT stays null
+    text = values.dt.strftime("%Y-%m-%d %H:%M:%S")
+    microseconds = values.dt.microsecond.fillna(0).astype("int64")
+    fractional = microseconds != 0
+    if fractional.any():
+        text = text.where(~fractional, text + "." + microseconds.map("{:06d}".format))
+    if values.dt.tz is not None:
+        offset = values.dt.strftime("%z")
+        text = text + offset.str[:3] + ":" + offset.str[3:]
+    return text
+
+
+def datetimes_to_str(df):
+    """
+    convert the datetime columns of a pandas dataframe to strings, column-wise
+    """
+    columns = df.select_dtypes(include=["datetime64", "datetimetz"]).columns
+    if len(columns):
+        df = df.copy()
+        for column in columns:
+            df[column] = _format_datetimes(df[column])
+    return df
+
+
+_DATETIME_TYPES = (datetime.datetime, datetime.date, datetime.time)
+
+
+def _str_datetime(value: Any) -> Any:
+    return str(value) if isinstance(value, _DATETIME_TYPES) else value
+
+
+def _objects_to_json_types(df):
+    # DECIMAL columns arrive as object columns of Decimal values, DATE and TIME
+    # columns as object columns of datetime.date / datetime.time values, which
+    # pandas' to_json would write as epoch milliseconds
+    decimals, datetimes = [], []
+    for column in df.select_dtypes(include=["object"]).columns:
+        values = df[column].dropna()
+        if not len(values):
+            continue
+        if isinstance(values.iloc[0], Decimal):
+            decimals.append(column)
+        elif isinstance(values.iloc[0], _DATETIME_TYPES):
+            datetimes.append(column)
+    if decimals or datetimes:
+        df = df.copy()
+        for column in decimals:
+            # as str(), like encode_records, keeping every digit
+            df[column] = df[column].map(str, na_action="ignore")
+        for column in datetimes:
+            # as str(), like encode_records
+            df[column] = df[column].map(_str_datetime)
+    return df
+
+
+def encode_df(df) -> bytes:
+    """
+    serialize a pandas dataframe to a single newline-delimited JSON buffer
+    """
+    df = _objects_to_json_types(datetimes_to_str(df))
+    if _floats_round_trip(df):
+        return _pandas_encode_df(df)
+    # to_json would round some floats, the record encoders write the shortest
+    # repr that reads back the same value; nulls as null, like to_json
+    records = df.astype(object).where(df.notna(), None).to_dict(orient="records")
+    return encode_records(records)
@@ -0,0 +1,105 @@
+import random
+import threading
+import time
+from typing import Callable
+
+
+def is_throttling(err: Exception) -> bool:
+    """
+    whether the error is an AWS throttling error (botocore ClientError or its message)
+    """
+    code = getattr(err, "response", {}).get("Error", {}).get("Code", "")
+    return code in AdaptiveRateLimiter.throttling_codes or any(
+        c in str(err) for c in AdaptiveRateLimiter.throttling_codes
+    )
+
+
+class AdaptiveRateLimiter(object):
+    """
+    A thread-safe limiter of the rate of API calls, shared by all the workers
+    calling the same API.
+
+    Calls are spaced out to at most `rate` per second. The rate is cut by
+    `decrease_factor` on every throttling error and raised by `increase_step`
+    on every successful call (AIMD), so it settles just below the rate the
+    service accepts.
+
+    :param rate: initial calls per second
+    :type rate: float
+    :param min_rate: lowest calls per second
+    :type min_rate: float
+    :param max_rate: highest calls per second
+    :type max_rate: float
+    :param increase_step: calls per second added after a successful call
+    :type increase_step: float
+    :param decrease_factor: factor applied to the rate after a throttling error
+    :type decrease_factor: float
+    """
+
+    throttling_codes = (
+        "ThrottlingException",
+        "TooManyRequestsException",
+        "RequestLimitExceeded",
+        "SlowDown",
+    )
+
+    def __init__(
+        self,
+        rate: float = 10.0,
+        min_rate: float = 0.5,
+        max_rate: float = 50.0,
+        increase_step: float = 0.2,
+        decrease_factor: float = 0.5,
+    ):
+        assert 0 < min_rate <= rate <= max_rate, "min_rate <= rate <= max_rate"
+        assert 0 < decrease_factor < 1, "decrease_factor should be in (0, 1)"
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.throttled: int = 0
+        self._next_call = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        wait for the next call slot
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_call)
+            self._next_call = slot + 1.0 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            # push the pending slots back as well
+            self._next_call = max(self._next_call, time.monotonic()) + 1.0 / self.rate
+
+    def call(self, fn: Callable, *args, retries: int = 8, **kwargs):
+        """
+        call fn once a call slot is available, retrying throttling errors
+        with a jittered exponential backoff
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as err:
+                if not is_throttling(err) or attempt >= retries:
+                    raise err
+                self.on_throttle()
+                attempt += 1
+                time.sleep(random.uniform(0, min(30.0, 0.1 * 2**attempt)))
+                continue
+            self.on_success()
+            return result
@@ -0,0 +1,94 @@
+import datetime
+import re
+from typing import Dict, Iterable, Iterator, Optional
+
+import pendulum
+
+# the last date_= / date= partition of a key, i.e. db/table/date_=2021-03-08/hour=05/x
+_DATE_PARTITION = re.compile(r".*date_?=([^/]*)")
+_ISO_DATE = re.compile(r"(\d{4})-(\d{2})-(\d{2})$")
+
+
+def _legacy_partition_value(key: str) -> str:
+    # keys holding "date" but no date_= / date= partition
+    return key.split("date_")[-1].split("/")[0].split("=")[-1]
+
+
+class RetentionFilter(object):
+    """
+    Selects the S3 keys of the date partitions up to a cutoff date - the keys
+    holding "date" whose date_= (or date=) partition value is at most the cutoff
+    date in `tz`, and the $folder$ markers.
+
+    Partition values may be dates (YYYY-MM-DD), dates with a time (YYYY-MM-DDTHH...)
+    or YYYY-MM-DD-HH24-MI, only their date is compared. Every distinct value is
+    parsed once, to its ordinal, and keys are compared to the ordinal of the cutoff
+    date, so millions of keys sharing a few hundred partitions are filtered
+    at the cost of a regex match each.
+
+    :param cutoff: keys up to this (timezone aware) datetime are selected
+    :type cutoff: datetime.datetime
+    :param tz: timezone of the partition dates
+    :type tz: str
+    """
+
+    def __init__(self, cutoff: datetime.datetime, tz: str = "America/New_York"):
+        self.tz = tz
+        # a partition date is selected if its midnight in tz is not after the cutoff
+        self.cutoff_ordinal = (
+            pendulum.instance(cutoff).in_timezone(tz).date().toordinal()
+        )
+        self._ordinals: Dict[str, int] = dict()
+
+    def partition_ordinal(self, value: str) -> int:
+        """
+        the date ordinal of a partition value, i.e. 2021-03-08, 2021-03-08T05 or
+        2021-03-08-05-30
+        """
+        ordinal: Optional[int] = self._ordinals.get(value)
+        if ordinal is None:
+            d = value.rsplit("=", 1)[-1]
+            if "T" in d:
+                d = d.split("T")[0]
+            elif d.count("-") > 2:  # if date pattern is YYYY-MM-DD-HH24-MI
+                d = "-".join(d.split("-")[:3])
+            match = _ISO_DATE.match(d)
+            if match:
+                ordinal = datetime.date(*map(int, match.groups())).toordinal()
+            else:
+                ordinal = pendulum.parse(d, tz=self.tz).date().toordinal()
+            self._ordinals[value] = ordinal
+        return ordinal
+
+    def _partition_value(self, key: str) -> str:
+        match = _DATE_PARTITION.match(key)
+        return match.group(1) if match else _legacy_partition_value(key)
+
+    def is_expired(self, key: str) -> bool:
+        if "date" not in key:
+            return False
+        if "$folder$" in key:
+            return True
+        return self.partition_ordinal(self._partition_value(key)) <= self.cutoff_ordinal
+
+    def filter(self, keys: Iterable[str]) -> Iterator[str]:
+        """
+        :return: generator of the keys up to the cutoff
+        """
+        # is_expired, inlined as it runs for every listed key
+        match_partition = _DATE_PARTITION.match
+        ordinals = self._ordinals
+        cutoff_ordinal = self.cutoff_ordinal
+        for key in keys:
+            if "date" not in key:
+                continue
+            if "$folder$" in key:
+                yield key
+                continue
+            match = match_partition(key)
+            value = match.group(1) if match else _legacy_partition_value(key)
+            ordinal = ordinals.get(value)
+            if ordinal is None:
+                ordinal = self.partition_ordinal(value)
+            if ordinal <= cutoff_ordinal:
+                yield key
@@ -0,0 +1,291 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlencode
+
+import smart_open
+from airflow.exceptions import AirflowException
+from airflow.utils.log.logging_mixin import LoggingMixin
+
+from airfart.utils.rate_limiter import AdaptiveRateLimiter
+
+MB = 1024 * 1024
+GB = 1024 * MB
+# CopyObject copies objects of up to 5GB
+MAX_COPY_OBJECT_SIZE = 5 * GB
+MIN_PART_SIZE = 5 * MB
+MAX_PARTS = 10000
+# the head_object attributes of the source CopyObject keeps, set on the multipart upload
+COPIED_ATTRIBUTES = (
+    "CacheControl",
+    "ContentDisposition",
+    "ContentEncoding",
+    "ContentLanguage",
+    "ContentType",
+    "Expires",
+    "Metadata",
+    "ServerSideEncryption",
+    "SSEKMSKeyId",
+    "BucketKeyEnabled",
+    "StorageClass",
+    "WebsiteRedirectLocation",
+)
+
+
+class ParallelS3Copier(LoggingMixin):
+    """
+    Server-side copies of many S3 objects on a pool of `max_workers` threads.
+
+    Objects up to `multipart_threshold` bytes are copied with a single CopyObject
+    call. Larger ones (CopyObject is limited to 5GB) are copied with a multipart
+    upload whose parts are copied by UploadPartCopy calls of `part_size` bytes,
+    `max_part_workers` at a time, keeping the attributes of the source - content
+    headers, metadata, encryption, storage class and tags - as CopyObject does.
+
+    With a `checkpoint` (local path or s3:// uri), the copied destinations are
+    recorded every `checkpoint_every` copies and at the end, and skipped by the
+    next run, so an interrupted copy resumes where it stopped. Unless
+    `raise_on_failure` is unset, copy raises once every key was attempted if any
+    of them failed, so a partial copy is not followed by i.e. deleting the sources.
+
+    :param client: boto3 s3 client
+    :param max_workers: number of objects copied concurrently
+    :type max_workers: int
+    :param multipart_threshold: size from which objects are copied in parts
+    :type multipart_threshold: int
+    :param part_size: size of the copied parts
+    :type part_size: int
+    :param max_part_workers: number of parts copied concurrently
+    :type max_part_workers: int
+    :param checkpoint: path or s3:// uri of the checkpoint of the copied keys
+    :type checkpoint: str
+    :param checkpoint_every: number of copies between two checkpoint writes
+    :type checkpoint_every: int
+    :param rate_limiter: limiter of the S3 calls
+    :type rate_limiter: AdaptiveRateLimiter
+    :param raise_on_failure: raise if any key failed to copy
+    :type raise_on_failure: bool
+    """
+
+    log = LoggingMixin.log
+
+    def __init__(
+        self,
+        client,
+        max_workers: int = 16,
+        multipart_threshold: int = 1 * GB,
+        part_size: int = 256 * MB,
+        max_part_workers: int = 16,
+        checkpoint: Optional[str] = None,
+        checkpoint_every: int = 100,
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        raise_on_failure: bool = True,
+    ):
+        super().__init__()
+        assert (
+            MIN_PART_SIZE <= multipart_threshold <= MAX_COPY_OBJECT_SIZE
+        ), "multipart_threshold should be between 5MB and 5GB"
+        assert MIN_PART_SIZE <= part_size <= 5 * GB, "part_size should be 5MB to 5GB"
+        self.client = client
+        self.max_workers = max_workers
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self.max_part_workers = max_part_workers
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter(rate=50, max_rate=500)
+        self.raise_on_failure = raise_on_failure
+        self._part_executor: Optional[ThreadPoolExecutor] = None
+
+    def _call(self, fn, **kwargs):
+        return self.rate_limiter.call(fn, **kwargs)
+
+    def read_checkpoint(self) -> Set[str]:
+        """
+        :return: the copied destinations (bucket/key) recorded in the checkpoint
+        """
+        try:
+            with smart_open.open(self.checkpoint, "r") as f:
+                return {line.rstrip("\n") for line in f if line.strip()}
+        except (IOError, OSError, ValueError):
+            return set()
+
+    def write_checkpoint(self, done: Set[str]) -> None:
+        with smart_open.open(self.checkpoint, "w") as f:
+            f.write("".join(f"{d}\n" for d in sorted(done)))
+
+    def _part_ranges(self, size: int) -> List[Tuple[int, int]]:
+        # at most 10000 parts per upload
+        part_size = max(self.part_size, -(-size // MAX_PARTS))
+        return [
+            (start, min(start + part_size, size) - 1)
+            for start in range(0, size, part_size)
+        ]
+
+    def _copy_multipart(
+        self, source: dict, dest_bucket: str, dest_key: str, head: dict
+    ) -> None:
+        extra = {key: head[key] for key in COPIED_ATTRIBUTES if head.get(key)}
+        if head.get("TagCount"):
+            tags = self._call(self.client.get_object_tagging, **source)["TagSet"]
+            extra["Tagging"] = urlencode({t["Key"]: t["Value"] for t in tags})
+        upload_id = self._call(
+            self.client.create_multipart_upload,
+            Bucket=dest_bucket,
+            Key=dest_key,
+            **extra,
+        )["UploadId"]
+        try:
+
+            def copy_part(part_number: int, first: int, last: int) -> dict:
+                response = self._call(
+                    self.client.upload_part_copy,
+                    Bucket=dest_bucket,
+                    Key=dest_key,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    CopySource=source,
+                    CopySourceRange=f"bytes={first}-{last}",
+                )
+                return dict(
+                    PartNumber=part_number, ETag=response["CopyPartResult"]["ETag"]
+                )
+
+            futures = [
+                self._part_executor.submit(copy_part, number, first, last)
+                for number, (first, last) in enumerate(
+                    self._part_ranges(head["ContentLength"]), start=1
+                )
+            ]
+            # in part number order
+            parts = [future.result() for future in futures]
+            self._call(
+                self.client.complete_multipart_upload,
+                Bucket=dest_bucket,
+                Key=dest_key,
+                UploadId=upload_id,
+                MultipartUpload=dict(Parts=parts),
+            )
+        except Exception:
+            self.client.abort_multipart_upload(
+                Bucket=dest_bucket, Key=dest_key, UploadId=upload_id
+            )
+            raise
+
+    def _copy_one(
+        self,
+        source_bucket: str,
+        source_key: str,
+        dest_bucket: str,
+        dest_key: str,
+        size: Optional[int] = None,
+    ) -> Tuple[int, bool]:
+        """
+        :return: the copied bytes (if known) and whether it was a multipart copy
+        """
+        source = dict(Bucket=source_bucket, Key=source_key)
+        head = None
+        if size is None:
+            head = self._call(self.client.head_object, **source)
+            size = head["ContentLength"]
+        if size <= self.multipart_threshold:
+            self._call(
+                self.client.copy_object,
+                Bucket=dest_bucket,
+                Key=dest_key,
+                CopySource=source,
+            )
+            return size, False
+        if head is None:
+            head = self._call(self.client.head_object, **source)
+        self._copy_multipart(source, dest_bucket, dest_key, head)
+        return size, True
+
+    def copy(
+        self,
+        source_bucket: str,
+        keys: Iterable[Tuple[str, str]],
+        dest_bucket: str,
+        sizes: Optional[Dict[str, int]] = None,
+    ) -> dict:
+        """
+        :param source_bucket: bucket of the source keys
+        :param keys: (source key, destination key) pairs
+        :param dest_bucket: destination bucket
+        :param sizes: sizes of the source keys, i.e. from their listing,
+            saving a HeadObject call per (small) object
+        :return: report - copied, skipped (checkpoint), multipart, failed keys,
+            copied bytes
+        """
+        start = time.monotonic()
+        sizes = sizes or dict()
+        done = self.read_checkpoint() if self.checkpoint else set()
+        report = dict(copied=0, skipped=0, multipart=0, bytes=0, failed=dict())
+        since_checkpoint = 0
+
+        # future -> (source key, destination)
+        in_flight: Dict[Future, Tuple[str, str]] = dict()
+
+        def collect(futures: Set[Future]) -> None:
+            nonlocal since_checkpoint
+            for future in futures:
+                source_key, destination = in_flight.pop(future)
+                try:
+                    size, multipart = future.result()
+                except Exception as err:
+                    report["failed"][source_key] = str(err)
+                    continue
+                report["copied"] += 1
+                report["multipart"] += int(multipart)
+                report["bytes"] += size
+                done.add(destination)
+                since_checkpoint += 1
+            if self.checkpoint and since_checkpoint >= self.checkpoint_every:
+                self.write_checkpoint(done)
+                since_checkpoint = 0
+
+        with ThreadPoolExecutor(
+            max_workers=self.max_workers
+        ) as executor, ThreadPoolExecutor(
+            max_workers=self.max_part_workers
+        ) as part_executor:
+            self._part_executor = part_executor
+            for source_key, dest_key in keys:
+                destination = f"{dest_bucket}/{dest_key}"
+                if destination in done:
+                    report["skipped"] += 1
+                    continue
+                # the keys are consumed as copies complete, not queued up front
+                if len(in_flight) >= 2 * self.max_workers:
+                    completed, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(completed)
+                future = executor.submit(
+                    self._copy_one,
+                    source_bucket,
+                    source_key,
+                    dest_bucket,
+                    dest_key,
+                    sizes.get(source_key),
+                )
+                in_flight[future] = (source_key, destination)
+            completed, _ = wait(in_flight)
+            collect(completed)
+        self._part_executor = None
+        if self.checkpoint and since_checkpoint:
+            self.write_checkpoint(done)
+        seconds = time.monotonic() - start
+        report.update(throttled=self.rate_limiter.throttled, seconds=round(seconds, 3))
+        self.log.info(
+            f"copied {report['copied']} objects ({report['bytes'] / GB:.2f}GB, "
+            f"{report['multipart']} in parts) from {source_bucket} to {dest_bucket} "
+            f"in {seconds:.1f}s: {report['skipped']} already copied, "
+            f"{len(report['failed'])} failed"
+        )
+        if report["failed"] and self.raise_on_failure:
+            failed = sorted(report["failed"].items())
+            raise AirflowException(
+                f"failed to copy {len(failed)} objects from {source_bucket} to "
+                f"{dest_bucket}, i.e. {dict(failed[:10])}. report: "
+                f"{dict(report, failed=len(failed))}"
+            )
+        return report
@@ -0,0 +1,203 @@
+import random
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, Optional, Set
+
+from airflow.utils.log.logging_mixin import LoggingMixin
+
+from airfart.utils.rate_limiter import AdaptiveRateLimiter
+
+# per key errors of a DeleteObjects response worth another attempt
+RETRIABLE_CODES = (
+    "SlowDown",
+    "InternalError",
+    "ServiceUnavailable",
+    "RequestTimeout",
+    "OperationAborted",
+)
+
+
+def _error_code(err: Exception) -> str:
+    code = getattr(err, "response", {}).get("Error", {}).get("Code")
+    return code or type(err).__name__
+
+
+class PipelinedS3Deleter(LoggingMixin):
+    """
+    Deletes a stream of S3 keys with DeleteObjects calls of `batch_size` keys,
+    keeping up to `max_in_flight` calls running while the next batches are read
+    from the stream (i.e. a ConcurrentS3Lister listing), so a purge is bounded by
+    the S3 request rate rather than by round trips.
+
+    A successful DeleteObjects response may still list keys that were not deleted.
+    The keys failing with a retriable code (SlowDown, InternalError, ...) are sent
+    again with a jittered exponential backoff, up to `retries` times, the others are
+    counted as failed. Throttled calls slow the shared AdaptiveRateLimiter down.
+
+    :param client: boto3 s3 client
+    :param batch_size: keys per DeleteObjects call (at most 1000)
+    :type batch_size: int
+    :param max_in_flight: number of concurrent DeleteObjects calls
+    :type max_in_flight: int
+    :param retries: attempts of the keys failing with a retriable error
+    :type retries: int
+    :param dry_run: only count (and log) the keys that would be deleted
+    :type dry_run: bool
+    :param rate_limiter: limiter of the DeleteObjects calls
+    :type rate_limiter: AdaptiveRateLimiter
+    :param max_failed_keys: number of failed keys kept in the report
+    :type max_failed_keys: int
+    """
+
+    log = LoggingMixin.log
+
+    def __init__(
+        self,
+        client,
+        batch_size: int = 1000,
+        max_in_flight: int = 8,
+        retries: int = 5,
+        dry_run: bool = False,
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        max_failed_keys: int = 100,
+    ):
+        super().__init__()
+        assert 1 <= batch_size <= 1000, "batch_size should be between 1 and 1000"
+        assert max_in_flight >= 1, "max_in_flight should be positive"
+        self.client = client
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.dry_run = dry_run
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.max_failed_keys = max_failed_keys
+
+    def _delete_objects(self, bucket: str, keys: List[str]) -> List[dict]:
+        response = self.rate_limiter.call(
+            self.client.delete_objects,
+            Bucket=bucket,
+            Delete=dict(Objects=[dict(Key=key) for key in keys], Quiet=True),
+        )
+        return response.get("Errors", [])
+
+    def _delete_batch(self, bucket: str, keys: List[str]) -> dict:
+        """
+        delete a batch, retrying its retriable per key errors
+        :return: the batch report
+        """
+        result = dict(deleted=0, retried=0, errors=[])
+        attempt = 0
+        while keys:
+            try:
+                errors = self._delete_objects(bucket, keys)
+            except Exception as err:
+                if not attempt:
+                    raise
+                # the keys deleted by the previous attempts stay counted
+                result["errors"].extend(
+                    dict(Key=key, Code=_error_code(err)) for key in keys
+                )
+                break
+            result["deleted"] += len(keys) - len(errors)
+            retriable = [e for e in errors if e.get("Code") in RETRIABLE_CODES]
+            result["errors"].extend(e for e in errors if e not in retriable)
+            if not retriable:
+                break
+            if attempt >= self.retries:
+                result["errors"].extend(retriable)
+                break
+            if any(e.get("Code") == "SlowDown" for e in retriable):
+                self.rate_limiter.on_throttle()
+            attempt += 1
+            result["retried"] += len(retriable)
+            keys = [e["Key"] for e in retriable]
+            time.sleep(random.uniform(0, min(30.0, 0.1 * 2**attempt)))
+        return result
+
+    def delete(self, bucket: str, keys: Iterable[str]) -> dict:
+        """
+        :param bucket: S3 bucket
+        :param keys: keys to delete, consumed as batches are formed
+        :return: report - deleted, failed and skipped (dry run, empty) key counts,
+            the retried keys count, the failed key counts by error code and
+            the first `max_failed_keys` failed keys
+        """
+        start = time.monotonic()
+        report = dict(
+            deleted=0,
+            failed=0,
+            skipped=0,
+            retried=0,
+            batches=0,
+            errors=Counter(),
+            failed_keys=[],
+            dry_run=self.dry_run,
+        )
+
+        # future -> its keys
+        in_flight: Dict[Future, List[str]] = dict()
+
+        def collect(futures: Set[Future]) -> None:
+            for future in futures:
+                keys_deleted = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as err:
+                    # the whole call failed
+                    result = dict(
+                        deleted=0,
+                        retried=0,
+                        errors=[
+                            dict(Key=key, Code=_error_code(err)) for key in keys_deleted
+                        ],
+                    )
+                report["deleted"] += result["deleted"]
+                report["retried"] += result["retried"]
+                report["failed"] += len(result["errors"])
+                for error in result["errors"]:
+                    report["errors"][error.get("Code")] += 1
+                    if len(report["failed_keys"]) < self.max_failed_keys:
+                        report["failed_keys"].append(error["Key"])
+
+        batch: List[str] = []
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+
+            def submit(keys_to_delete: List[str]) -> None:
+                report["batches"] += 1
+                if self.dry_run:
+                    report["skipped"] += len(keys_to_delete)
+                    return
+                # at most max_in_flight calls, the next batch waits for a free slot
+                if len(in_flight) >= self.max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                future = executor.submit(self._delete_batch, bucket, keys_to_delete)
+                in_flight[future] = keys_to_delete
+
+            for key in keys:
+                if not key:
+                    report["skipped"] += 1
+                    continue
+                batch.append(key)
+                if len(batch) == self.batch_size:
+                    submit(batch)
+                    batch = []
+            if batch:
+                submit(batch)
+            done, _ = wait(in_flight)
+            collect(done)
+
+        report["errors"] = dict(report["errors"])
+        report.update(
+            throttled=self.rate_limiter.throttled,
+            seconds=round(time.monotonic() - start, 3),
+        )
+        self.log.info(
+            f"deleted {report['deleted']} keys from {bucket} in {report['batches']} "
+            f"batches: {report['failed']} failed, {report['skipped']} skipped, "
+            f"{report['retried']} retried"
+        )
+        if report["errors"]:
+            self.log.warning(f"delete errors by code: {report['errors']}")
+        return report
@@ -0,0 +1,150 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator
+
+from airflow.utils.log.logging_mixin import LoggingMixin
+
+
+class ConcurrentS3Lister(LoggingMixin):
+    """
+    Lists many S3 prefixes concurrently, on a pool of `max_workers` threads.
+
+    Every prefix is listed with a "/" delimiter: its direct objects are returned,
+    and each of its sub-prefixes ("sub directories", i.e. date_=2021-03-08/) is
+    listed as a task of its own, down to `split_depth` levels, below which prefixes
+    are listed flat. So a huge prefix - a table with years of daily and hourly
+    partitions - is listed by many workers rather than by one serial pagination.
+
+    The objects are yielded as their listing pages arrive, in no particular order,
+    so they can be processed (i.e. deleted) before the listing is over.
+    At most `max_pending_pages` listed pages wait to be consumed.
+
+    :param client: boto3 s3 client
+    :param max_workers: number of concurrent list_objects_v2 paginations
+    :type max_workers: int
+    :param split_depth: number of sub-prefix levels listed as separate tasks.
+        0 lists every prefix flat
+    :type split_depth: int
+    :param max_pending_pages: number of listed pages buffered for the consumer
+    :type max_pending_pages: int
+    """
+
+    log = LoggingMixin.log
+
+    def __init__(
+        self,
+        client,
+        max_workers: int = 16,
+        split_depth: int = 2,
+        max_pending_pages: int = 64,
+    ):
+        super().__init__()
+        assert max_workers >= 1, "max_workers should be positive"
+        assert split_depth >= 0, "split_depth should not be negative"
+        self.client = client
+        self.max_workers = max_workers
+        self.split_depth = split_depth
+        self.max_pending_pages = max_pending_pages
+        self.pages: int = 0
+        self.prefixes: int = 0
+
+    def _put(self, results: queue.Queue, stop: threading.Event, message) -> bool:
+        # the consumer may stop iterating, workers then give up instead of blocking
+        while not stop.is_set():
+            try:
+                results.put(message, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _list_prefix(
+        self,
+        bucket: str,
+        prefix: str,
+        depth: int,
+        delimiter: str,
+        results: queue.Queue,
+        stop: threading.Event,
+    ) -> None:
+        try:
+            # a user delimiter lists the prefix's top level only, as S3Hook.list_keys
+            split = not delimiter and depth < self.split_depth
+            kwargs = dict(Bucket=bucket, Prefix=prefix)
+            if delimiter or split:
+                kwargs["Delimiter"] = delimiter or "/"
+            paginator = self.client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(**kwargs):
+                if stop.is_set():
+                    return
+                objects = [
+                    dict(
+                        Key=o["Key"],
+                        Size=o["Size"],
+                        ETag=o.get("ETag"),
+                        LastModified=o["LastModified"],
+                    )
+                    for o in page.get("Contents", [])
+                ]
+                if objects and not self._put(results, stop, ("objects", objects)):
+                    return
+                if split:
+                    for common_prefix in page.get("CommonPrefixes", []):
+                        message = ("prefix", (common_prefix["Prefix"], depth + 1))
+                        if not self._put(results, stop, message):
+                            return
+        except Exception as err:
+            self._put(results, stop, ("error", err))
+        finally:
+            self._put(results, stop, ("done", prefix))
+
+    def list(
+        self, bucket: str, prefixes: Iterable[str], delimiter: str = ""
+    ) -> Iterator[dict]:
+        """
+        :param bucket: S3 bucket
+        :param prefixes: prefixes to list
+        :param delimiter: if provided, only the keys of the top level of every
+            prefix are listed, and prefixes are not split
+        :return: generator of objects, as dict(Key, Size, ETag, LastModified)
+        """
+        start = time.monotonic()
+        results = queue.Queue(maxsize=self.max_pending_pages)
+        stop = threading.Event()
+        pending = 0
+        objects = 0
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        # tasks are only submitted from this thread, so `pending` needs no lock
+        def submit(prefix: str, depth: int) -> None:
+            nonlocal pending
+            pending += 1
+            self.prefixes += 1
+            executor.submit(
+                self._list_prefix, bucket, prefix, depth, delimiter, results, stop
+            )
+
+        try:
+            for prefix in prefixes:
+                submit(prefix, 0)
+            while pending:
+                kind, value = results.get()
+                if kind == "objects":
+                    self.pages += 1
+                    objects += len(value)
+                    yield from value
+                elif kind == "prefix":
+                    submit(*value)
+                elif kind == "done":
+                    pending -= 1
+                else:
+                    raise value
+        finally:
+            stop.set()
+            executor.shutdown(wait=True)
+        self.log.info(
+            f"listed {objects} objects from {self.prefixes} prefixes of {bucket} "
+            f"in {time.monotonic() - start:.1f}s"
+        )
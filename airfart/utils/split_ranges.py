@@ -0,0 +1,45 @@
+from typing import Any, List, Optional, Tuple
+
+
+def minmax_boundaries(low: Any, high: Any, n: int) -> List[Any]:
+    """
+    split [low, high] into n even key ranges and return the n-1 inner boundaries.
+    supports numbers, dates and datetimes
+    """
+    if low is None or high is None or low == high or n < 2:
+        return []
+    boundaries = []
+    for i in range(1, n):
+        if isinstance(low, int):
+            boundary = low + (high - low) * i // n
+        else:
+            boundary = low + (high - low) / n * i
+        if low < boundary < high and boundary not in boundaries:
+            boundaries.append(boundary)
+    return boundaries
+
+
+def quantile_boundaries(sample: List[Any], n: int) -> List[Any]:
+    """
+    return the n-1 inner boundaries splitting the sampled values into n ranges
+    holding (approximately) the same number of rows
+    """
+    values = sorted(v for v in sample if v is not None)
+    if not values or n < 2:
+        return []
+    boundaries = []
+    for i in range(1, n):
+        boundary = values[len(values) * i // n]
+        if boundary not in boundaries:
+            boundaries.append(boundary)
+    return boundaries
+
+
+def to_ranges(boundaries: List[Any]) -> List[Tuple[Optional[Any], Optional[Any]]]:
+    """
+    convert sorted boundaries to half-open [lower, upper) ranges.
+    the first range has no lower bound and the last range has no upper bound,
+    so together they cover the whole key space
+    """
+    bounds = [None] + list(boundaries) + [None]
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
@@ -0,0 +1,94 @@
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Optional
+
+
+class StageStats(object):
+    """
+    Accumulates wall time, rows and bytes per stage of an export.
+    Thread-safe, so concurrent sub-exports can share one instance
+    (their stage times then add up to more than the elapsed time)
+    """
+
+    STAGES = [
+        "connect",
+        "execute",
+        "fetch",
+        "transform",
+        "serialize",
+        "compress",
+        "upload",
+    ]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, dict] = dict()
+
+    def add(
+        self,
+        stage: str,
+        seconds: float,
+        rows: int = 0,
+        bytes_in: int = 0,
+        bytes_out: int = 0,
+    ) -> None:
+        with self._lock:
+            s = self._stages.setdefault(
+                stage, dict(seconds=0.0, calls=0, rows=0, bytes_in=0, bytes_out=0)
+            )
+            s["seconds"] += seconds
+            s["calls"] += 1
+            s["rows"] += rows
+            s["bytes_in"] += bytes_in
+            s["bytes_out"] += bytes_out
+
+    @contextmanager
+    def measure(self, stage: str, **kwargs):
+        """
+        time the enclosed block. the yielded dict may be updated with
+        rows, bytes_in and bytes_out known only at the end of the block
+        """
+        counters = dict(kwargs)
+        start = time.perf_counter()
+        try:
+            yield counters
+        finally:
+            self.add(stage, time.perf_counter() - start, **counters)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            order = self.STAGES + sorted(set(self._stages) - set(self.STAGES))
+            result = dict()
+            for stage in order:
+                if stage not in self._stages:
+                    continue
+                s = dict(self._stages[stage])
+                s["seconds"] = round(s["seconds"], 6)
+                s["rows_per_sec"] = (
+                    round(s["rows"] / s["seconds"], 1)
+                    if s["seconds"] and s["rows"]
+                    else None
+                )
+                result[stage] = s
+            return result
+
+    def summary(self) -> str:
+        lines = [
+            f"{'stage':<10}{'seconds':>10}{'calls':>8}{'rows':>12}"
+            f"{'bytes in':>14}{'bytes out':>14}{'rows/s':>14}"
+        ]
+        for stage, s in self.to_dict().items():
+            rows_per_sec = s["rows_per_sec"] if s["rows_per_sec"] is not None else "-"
+            lines.append(
+                f"{stage:<10}{s['seconds']:>10.3f}{s['calls']:>8}{s['rows']:>12}"
+                f"{s['bytes_in']:>14}{s['bytes_out']:>14}{rows_per_sec:>14}"
+            )
+        return "\n".join(lines)
+
+
+def measure(stats: Optional[StageStats], stage: str, **kwargs):
+    """
+    StageStats.measure, or a no-op when stats are not collected
+    """
+    return stats.measure(stage, **kwargs) if stats else nullcontext(dict(kwargs))
@@ -0,0 +1,81 @@
+"""
+Rows/s of the JSON-lines serialization used by the S3 sinks:
+the former per-record `json.dumps` loop vs. the airfart.utils.ndjson backends.
+Every backend's output is checked to read back the same records as the former loop.
+
+    python -m benchmarks.ndjson_encoding [rows]
+"""
+
+import json
+import sys
+import time
+from decimal import Decimal
+
+import pandas as pd
+
+from airfart.utils import ndjson
+
+
+def make_df(rows: int) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "id": range(rows),
+            "user_id": [i % 1000 for i in range(rows)],
+            "score": [i / 7 for i in range(rows)],
+            "title": [f"title number {i}" for i in range(rows)],
+            "amount": [Decimal(i) / 100 for i in range(rows)],
+            "created_at": pd.date_range("2020-01-01", periods=rows, freq="s"),
+        }
+    )
+
+
+def legacy(df: pd.DataFrame) -> bytes:
+    # BaseDataToS3Operator.execute before the shared encoder; its
+    # `default=lambda o: o.__dict__` failed on Decimal, str() keeps the digits
+    df = df.copy()
+    columns = df.select_dtypes(include=["datetime64"]).columns
+    for column in columns:
+        df[column] = df[column].astype(str)
+    out = []
+    for record in df.to_dict(orient="records"):
+        out.append((json.dumps(record, default=str) + "\n").encode("utf8"))
+    return b"".join(out)
+
+
+def read_back(buffer: bytes) -> list:
+    return [json.loads(line) for line in buffer.splitlines()]
+
+
+def bench(name: str, fn, df: pd.DataFrame, expected: list) -> None:
+    start = time.perf_counter()
+    buffer = fn(df)
+    took = time.perf_counter() - start
+    assert read_back(buffer) == expected, f"{name} output differs from legacy"
+    print(
+        f"{name:>16}: {took:7.3f}s {len(df) / took:12,.0f} rows/s {len(buffer) / 1024 / 1024:7.2f}MB"
+    )
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    frame = make_df(n)
+    reference = read_back(legacy(frame))
+    bench("legacy", legacy, frame, reference)
+    bench(
+        "json",
+        lambda df: ndjson._json_encode_records(
+            ndjson.datetimes_to_str(df).to_dict(orient="records")
+        ),
+        frame,
+        reference,
+    )
+    if ndjson.orjson:
+        bench(
+            "orjson",
+            lambda df: ndjson._orjson_encode_records(
+                ndjson.datetimes_to_str(df).to_dict(orient="records")
+            ),
+            frame,
+            reference,
+        )
+    bench("encode_df", ndjson.encode_df, frame, reference)
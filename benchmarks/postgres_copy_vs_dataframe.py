@@ -0,0 +1,59 @@
+"""
+Compares the two CSV export routes of PostgresToS3Operator:
+`pandas.read_sql` + CsvS3Sink vs. `COPY (sql) TO STDOUT` through copy_expert.
+
+Requires the POSTGRES_* variables used by PostgresExtendedHook, i.e.
+
+    python -m benchmarks.postgres_copy_vs_dataframe "select * from catalog_updates"
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import smart_open
+
+from airfart.hooks.postgres.postgres_extended import PostgresExtendedHook
+from airfart.sinks.s3_sink import CsvS3Sink
+
+
+def dataframe_route(hook: PostgresExtendedHook, sql: str, uri: str) -> None:
+    with CsvS3Sink(uri) as sink:
+        sink.write(hook.get_pandas_df(sql))
+
+
+def copy_route(hook: PostgresExtendedHook, sql: str, uri: str) -> None:
+    with smart_open.open(uri, "wb") as f:
+        hook.copy_to_file(sql, f)
+
+
+def bench(name: str, fn, hook: PostgresExtendedHook, sql: str, uri: str) -> float:
+    start = time.perf_counter()
+    fn(hook, sql, uri)
+    took = time.perf_counter() - start
+    print(f"{name:>10}: {took:8.3f}s, {os.path.getsize(uri) / 1024 / 1024:8.2f}MB")
+    return took
+
+
+if __name__ == "__main__":
+    query = sys.argv[1] if len(sys.argv) > 1 else "select * from catalog_updates"
+    postgres_hook = PostgresExtendedHook()
+    with tempfile.TemporaryDirectory() as tmp:
+        for suffix in [".csv", ".csv.gz"]:
+            print(f"{query} -> {suffix}")
+            df_took = bench(
+                "dataframe",
+                dataframe_route,
+                postgres_hook,
+                query,
+                os.path.join(tmp, f"dataframe{suffix}"),
+            )
+            copy_took = bench(
+                "copy",
+                copy_route,
+                postgres_hook,
+                query,
+                os.path.join(tmp, f"copy{suffix}"),
+            )
+            print(f"speedup: {df_took / copy_took:.1f}x")
@@ -0,0 +1,86 @@
+"""
+Keys/s of the retention filter of S3ListAndDeleteOperator on a synthetic listing
+of 5M keys (date_= partitions of 20 tables over 2 years, hourly sub-partitions):
+the former per-key split and pendulum.parse vs. airfart.utils.retention.
+
+The former filter is run on a sample, it takes minutes on the whole listing
+
+    python -m benchmarks.retention_filter [keys] [legacy_sample]
+"""
+
+import sys
+import time
+
+import pendulum
+
+from airfart.utils.retention import RetentionFilter
+
+FORMATS = [
+    lambda d, h: d.format("YYYY-MM-DD"),
+    lambda d, h: d.format("YYYY-MM-DD") + f"T{h:02d}",
+    lambda d, h: d.format("YYYY-MM-DD") + f"-{h:02d}-00",
+]
+
+
+def make_keys(n: int) -> list:
+    start = pendulum.datetime(2020, 1, 1)
+    days = [start.add(days=i) for i in range(730)]
+    keys = []
+    i = 0
+    while len(keys) < n:
+        day = days[i % len(days)]
+        table = i // len(days) % 20
+        fmt = FORMATS[table % len(FORMATS)]
+        prefix = f"db/table_{table}/date_={fmt(day, i % 24)}"
+        keys.append(f"{prefix}_$folder$")
+        keys.extend(
+            f"{prefix}/hour={h:02d}/part-{p:05d}.parquet"
+            for h in range(24)
+            for p in range(10)
+        )
+        i += 1
+    return keys[:n]
+
+
+def legacy(keys, cleanup_up_to_date) -> list:
+    # S3ListAndDeleteOperator.__keys_to_cleanup before RetentionFilter
+    result = []
+    for key in keys:
+        if "date" in key:
+            if "$folder$" in key:
+                result.append(key)
+            else:
+                d = key.split("date_")[-1].split("/")[0].split("=")[-1]
+                if "T" in d:
+                    d = d.split("T")[0]
+                else:
+                    if d.count("-") > 2:  # if date pattern is YYYY-MM-DD-HH24-MI
+                        d = "-".join(d.split("-")[:3])
+                key_date = pendulum.parse(d, tz="America/New_York")
+                if key_date <= cleanup_up_to_date:
+                    result.append(key)
+    return result
+
+
+def bench(name: str, fn, keys: list) -> list:
+    start = time.perf_counter()
+    result = fn(keys)
+    took = time.perf_counter() - start
+    print(f"{name:>16}: {took:7.3f}s {len(keys) / took:12,.0f} keys/s")
+    return result
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000000
+    sample = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    listing = make_keys(n)
+    cutoff = pendulum.datetime(2021, 3, 8, 15, 29, 16).subtract(days=30)
+
+    expected = bench("legacy (sample)", lambda k: legacy(k, cutoff), listing[:sample])
+    selected = bench(
+        "RetentionFilter",
+        lambda k: list(RetentionFilter(cutoff).filter(k)),
+        listing,
+    )
+    assert list(RetentionFilter(cutoff).filter(listing[:sample])) == expected
+    print(f"{len(selected):,} of {len(listing):,} keys expired")
@@ -0,0 +1,81 @@
+"""
+Memory and time of TableDef for a catalog of 10k tables:
+building the definitions from Glue tables, serializing them, and detecting
+the changed tables between two copies of the catalog.
+
+    python -m benchmarks.table_definitions [tables] [columns]
+"""
+
+import json
+import sys
+import time
+import tracemalloc
+
+from airfart.model.table_definitions import TableDef
+
+TYPES = [
+    ("int", "11"),
+    ("bigint", "20"),
+    ("varchar", ""),
+    ("datetime", ""),
+    ("text", ""),
+]
+
+
+def make_glue_tables(tables: int, columns: int) -> list:
+    glue_tables = []
+    for t in range(tables):
+        table = TableDef.from_query(
+            {
+                "TABLE_NAME": f"table_{t}",
+                "COLUMNS": json.dumps(
+                    [
+                        {
+                            "name": "id" if c == 0 else f"column_{c}",
+                            "data_type": TYPES[c % len(TYPES)][0],
+                            "data_length": TYPES[c % len(TYPES)][1],
+                            "ordinal_position": c + 1,
+                            "column_key": "PRI" if c == 0 else "",
+                        }
+                        for c in range(columns)
+                    ]
+                ),
+            }
+        )
+        glue_tables.append(table.to_glue("database"))
+    return glue_tables
+
+
+def timed(name: str, fn, count: int):
+    start = time.perf_counter()
+    result = fn()
+    took = time.perf_counter() - start
+    print(f"{name:>16}: {took:7.3f}s {count / took:12,.0f} tables/s")
+    return result
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    m = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    glue_tables = make_glue_tables(n, m)
+
+    tables = timed("from_glue", lambda: [TableDef.from_glue(t) for t in glue_tables], n)
+    # measured apart, tracemalloc slows the allocations down
+    del tables
+    tracemalloc.start()
+    tables = [TableDef.from_glue(t) for t in glue_tables]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{'memory':>16}: {current / 1024 / 1024:7.1f}MB for {n} tables of {m} columns"
+    )
+
+    timed("to_json", lambda: [t.to_json() for t in tables], n)
+    other = [TableDef.from_glue(t) for t in glue_tables]
+    # the first comparison computes the hashes, the following ones reuse them
+    for run in ("compare", "compare again"):
+        changed = timed(
+            run, lambda: [a.name for a, b in zip(tables, other) if a != b], n
+        )
+    assert not changed
+    timed("fingerprint", lambda: [t.fingerprint() for t in tables], n)
@@ -4,6 +4,8 @@ import pandas as pd
 import psycopg2
 import smart_open
 
+from airfart.sinks.s3_sink import ParquetS3Sink
+
 
 class PostgresToS3Operator:
     JSON: str = "json"
@@ -20,6 +22,9 @@ class PostgresToS3Operator:
         output_format: str = JSON,
         include_csv_headers: bool = False,
         post_db_path: str = None,
+        row_group_size: int = None,
+        compression: str = "snappy",
+        dictionary_columns: list = None,
     ):
         self.sql = sql
         self.bucket = bucket
@@ -31,6 +36,9 @@ class PostgresToS3Operator:
         ), f"output_format should be either {self.JSON}, {self.PARQUET} or {self.CSV}! "
         self.post_db_path = post_db_path
         self.include_csv_headers = include_csv_headers
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.dictionary_columns = dictionary_columns
 
     def execute(self):
         # Generate write destination
@@ -67,11 +75,31 @@ class PostgresToS3Operator:
 
         conn = psycopg2.connect(**conn_args)
 
-        df = pd.read_sql(self.sql, conn)
-
         if self.output_format == self.PARQUET:
-            df.to_parquet(address, engine="pyarrow", allow_truncated_timestamps=True)
+            # read in row group sized chunks and append them to the parquet file
+            with ParquetS3Sink(
+                address,
+                row_group_size=self.row_group_size,
+                compression=self.compression,
+                dictionary_columns=self.dictionary_columns,
+            ) as sink:
+                chunk_size = self.row_group_size or 100000
+                # a named cursor keeps the result set on the server, read_sql's
+                # chunksize would still fetch all of it into the client first
+                with conn.cursor(name="postgres_to_s3") as cur:
+                    cur.itersize = chunk_size
+                    cur.execute(self.sql)
+                    columns = None
+                    while True:
+                        rows = cur.fetchmany(chunk_size)
+                        if not rows:
+                            break
+                        # named cursors only describe the result after the first fetch
+                        if columns is None:
+                            columns = [c[0] for c in cur.description]
+                        sink.write(pd.DataFrame.from_records(rows, columns=columns))
         else:
+            df = pd.read_sql(self.sql, conn)
             if self.output_format == self.JSON:
                 columns = df.select_dtypes(include=["datetime64"]).columns
                 for column in columns:
@@ -1,13 +1,15 @@
 import inspect
 import json
 import time
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
 
 import boto3
 import smart_open
 from airflow.exceptions import AirflowException
 
-from mysql_schema_dump import TableDef
+from airfart.model.table_definitions import TableDef
+from airfart.utils.rate_limiter import AdaptiveRateLimiter
 
 
 def raise_error(calling_method: str, err: Exception):
@@ -18,6 +20,20 @@ def raise_error(calling_method: str, err: Exception):
 
 
 class S3ToGlueOperator:
+    """
+    Creates or updates the Glue tables of a schema dump (TableDef json lines)
+
+    :param bulk: fetch all the current tables with paginated get_tables calls,
+        compare them to the dump by fingerprint and push only the changed ones,
+        concurrently. execute then returns a change report instead of the list
+        of updated tables, and raises once all the calls are done if any failed
+    :type bulk: bool
+    :param max_workers: number of concurrent create / update calls in bulk mode
+    :type max_workers: int
+    :param retries: number of retries of a throttled call in bulk mode
+    :type retries: int
+    """
+
     default_target_db = "seekingalpha_production"
 
     def __init__(
@@ -27,6 +43,9 @@ class S3ToGlueOperator:
         key: str,
         post_key_path=None,
         database: str = default_target_db,
+        bulk: bool = False,
+        max_workers: int = 8,
+        retries: int = 5,
     ):
         self.file = file
         self.bucket = bucket
@@ -36,6 +55,9 @@ class S3ToGlueOperator:
             post_key_path.strip("/") if post_key_path else post_key_path
         )
         self.database = database
+        self.bulk = bulk
+        self.max_workers = max_workers
+        self.retries = retries
         self._hook = boto3.Session(
             profile_name="default", region_name="us-west-2"
         ).client("glue")
@@ -60,6 +82,9 @@ class S3ToGlueOperator:
             for line in s3_file:
                 tables.append(TableDef.from_json(json.loads(line)))
 
+        if self.bulk:
+            return self.sync(tables)
+
         while len(tables) > 0:
             # get current table implementation and compare
             table_def = tables.pop()
@@ -94,13 +119,85 @@ class S3ToGlueOperator:
             table_def = self._hook.get_table(
                 DatabaseName=self.database, Name=table_name
             )
-            return TableDef.from_glue(table_def)
+            return TableDef.from_glue(table_def["Table"])
         except Exception as err:
             if "EntityNotFoundException" in str(err):
                 return None
             else:
                 raise_error(inspect.currentframe().f_code.co_name, err)
 
+    def _get_fingerprints(self) -> Dict[str, Optional[str]]:
+        """
+        fingerprints of the current tables of the database, by table name
+        """
+        fingerprints = dict()
+        paginator = self._hook.get_paginator("get_tables")
+        for page in paginator.paginate(DatabaseName=self.database):
+            for table in page["TableList"]:
+                try:
+                    fingerprint = TableDef.from_glue(table).fingerprint()
+                except (KeyError, TypeError, ValueError):
+                    # not built from a schema dump, always updated
+                    fingerprint = None
+                fingerprints[table["Name"]] = fingerprint
+        return fingerprints
+
+    def sync(self, tables: List[TableDef]) -> dict:
+        """
+        Push the tables differing from the current Glue definitions,
+        through `max_workers` concurrent calls sharing an adaptive rate limit
+        (throttled calls are retried with a jittered exponential backoff)
+
+        :return: change report - created, updated, unchanged and failed tables.
+            Raises an AirflowException with the report if any table failed,
+            like the one by one mode does
+        """
+        start = time.monotonic()
+        current = self._get_fingerprints()
+        limiter = AdaptiveRateLimiter()
+        report = dict(created=[], updated=[], unchanged=0, failed=dict())
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = dict()
+            for table_def in tables:
+                if table_def.name not in current:
+                    action, fn = "created", self._hook.create_table
+                elif current[table_def.name] != table_def.fingerprint():
+                    action, fn = "updated", self._hook.update_table
+                else:
+                    report["unchanged"] += 1
+                    continue
+                future = executor.submit(
+                    limiter.call,
+                    fn,
+                    retries=self.retries,
+                    DatabaseName=self.database,
+                    TableInput=table_def.to_glue(self.database),
+                )
+                futures[future] = (action, table_def.name)
+            for future in as_completed(futures):
+                action, name = futures[future]
+                try:
+                    future.result()
+                    report[action].append(name)
+                except Exception as err:
+                    report["failed"][name] = str(err)
+        for action in ("created", "updated"):
+            report[action].sort()
+        report.update(
+            throttled=limiter.throttled, seconds=round(time.monotonic() - start, 3)
+        )
+        print(
+            f"synced {len(tables)} tables to {self.database}: "
+            f"{len(report['created'])} created, {len(report['updated'])} updated, "
+            f"{report['unchanged']} unchanged, {len(report['failed'])} failed"
+        )
+        if report["failed"]:
+            raise_error(
+                inspect.currentframe().f_code.co_name,
+                Exception(f"{len(report['failed'])} tables failed to sync: {report}"),
+            )
+        return report
+
     def _create_table(self, table_def: TableDef):
         table_input = table_def.to_glue(self.database)
         try:
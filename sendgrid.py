@@ -8,6 +8,8 @@ from dotenv import load_dotenv
 from pendulum import DateTime
 from smart_open import open
 
+from airfart.utils.ndjson import encode_records
+
 load_dotenv()
 
 
@@ -66,11 +68,7 @@ class SendGridOperator:
                         if messages:
                             with open(uri=uri, mode="wb") as s3_file:
                                 print("About to write response to {}".format(uri))
-                                for message in messages:
-                                    if message:
-                                        s3_file.write(
-                                            (json.dumps(message) + "\n").encode()
-                                        )
+                                s3_file.write(encode_records(messages))
                             print("Uploaded {} to S3".format(self._table))
                         else:
                             print(